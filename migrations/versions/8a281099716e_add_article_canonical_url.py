@@ -0,0 +1,135 @@
+"""Add article canonical URL
+
+Revision ID: 8a281099716e
+Revises: ef7390c49c7c
+Create Date: 2026-10-19 12:02:41.307214
+
+"""
+import hashlib
+import urllib.parse
+from typing import Optional, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a281099716e'
+down_revision: Union[str, None] = 'ef7390c49c7c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+# A frozen copy of quickfeed.canonical as of this revision, so changing the app's rules later doesn't change
+# what this migration does
+TRACKING_PARAMETER_PREFIXES = ("utm_", "mc_", "_hs", "pk_", "mtm_")
+TRACKING_PARAMETERS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "twclid", "_ga", "_gl",
+    "ref", "ref_src", "ref_url", "referrer", "cmpid", "spm", "s_cid", "wt.mc_id", "ocid",
+}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def is_tracking_parameter(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMETERS or name.startswith(TRACKING_PARAMETER_PREFIXES)
+
+
+def canonicalize_url(url: str) -> Optional[str]:
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return None
+
+    host = (parts.hostname or "").lower().rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    if not host:
+        return None
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    netloc = host if port in (None, DEFAULT_PORTS[scheme]) else f"{host}:{port}"
+
+    path = urllib.parse.quote(urllib.parse.unquote(parts.path), safe="/:@!$&'()*+,;=-._~%")
+    while "//" in path:
+        path = path.replace("//", "/")
+    if path.endswith("/"):
+        path = path.rstrip("/")
+    for index_page in ("/index.html", "/index.htm", "/index.php"):
+        if path.endswith(index_page):
+            path = path[:-len(index_page)]
+
+    query = sorted(
+        (name, value)
+        for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_parameter(name)
+    )
+    return urllib.parse.urlunsplit(("https", netloc, path or "/", urllib.parse.urlencode(query), ""))
+
+
+def url_hash(url: str) -> Optional[str]:
+    canonical_url = canonicalize_url(url)
+    if canonical_url is None:
+        return None
+    return hashlib.sha1(canonical_url.encode("utf-8")).hexdigest()
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('article') as batch_op:
+        batch_op.add_column(sa.Column('canonical_url_hash', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('canonical_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_article_canonical_url_hash'), ['canonical_url_hash'], unique=False)
+        batch_op.create_index(batch_op.f('ix_article_canonical_id'), ['canonical_id'], unique=False)
+        batch_op.create_foreign_key('fk_article_canonical_id_article', 'article', ['canonical_id'], ['id'])
+    # ### end Alembic commands ###
+
+    # Backfill the hashes in batches, then link each duplicate to the oldest article with its hash, unless
+    # that one is in the same feed. Links that aren't web links get no hash and are never linked
+    connection = op.get_bind()
+    article = sa.table(
+        'article', sa.column('id', sa.Integer), sa.column('feed_id', sa.Integer), sa.column('link', sa.String),
+        sa.column('read_at', sa.DateTime), sa.column('description', sa.String),
+        sa.column('canonical_url_hash', sa.String), sa.column('canonical_id', sa.Integer)
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(article.c.id, article.c.link).where(
+                article.c.id > last_id).order_by(article.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            sa.update(article).where(article.c.id == sa.bindparam('article_id')).values(
+                canonical_url_hash=sa.bindparam('url_hash')),
+            [{'article_id': row.id, 'url_hash': url_hash(row.link or '')} for row in rows]
+        )
+        last_id = rows[-1].id
+
+    original = article.alias('original')
+    first_id = sa.select(sa.func.min(original.c.id)).where(
+        original.c.canonical_url_hash == article.c.canonical_url_hash).scalar_subquery()
+    first = article.alias('first')
+    first_feed_id = sa.select(first.c.feed_id).where(first.c.id == first_id).scalar_subquery()
+    connection.execute(sa.update(article).where(article.c.id != first_id).where(
+        article.c.feed_id != first_feed_id).values(canonical_id=first_id))
+
+    # As add_article leaves a duplicate: sharing the read state of its canonical article, without a description
+    canonical_read_at = sa.select(original.c.read_at).where(original.c.id == article.c.canonical_id).scalar_subquery()
+    connection.execute(sa.update(article).where(article.c.canonical_id.is_not(None)).values(
+        read_at=canonical_read_at, description=''))
+
+
+def downgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('article') as batch_op:
+        batch_op.drop_constraint('fk_article_canonical_id_article', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_article_canonical_id'))
+        batch_op.drop_index(batch_op.f('ix_article_canonical_url_hash'))
+        batch_op.drop_column('canonical_id')
+        batch_op.drop_column('canonical_url_hash')
+    # ### end Alembic commands ###
@@ -0,0 +1,57 @@
+"""Compress article description
+
+Revision ID: eeda574d44e8
+Revises: a47f020a1dcc
+Create Date: 2026-10-19 14:12:36.841925
+
+"""
+import zlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'eeda574d44e8'
+down_revision: Union[str, None] = 'a47f020a1dcc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+
+def copy_in_batches(source: str, target: str, convert) -> None:
+    """Copy article.<source> into article.<target> through convert, BATCH_SIZE rows per statement."""
+    connection = op.get_bind()
+    article = sa.table('article', sa.column('id', sa.Integer), sa.column(source), sa.column(target))
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(article.c.id, article.c[source]).where(article.c.id > last_id).order_by(article.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            sa.update(article).where(article.c.id == sa.bindparam('article_id')).values(
+                {target: sa.bindparam('value')}),
+            [{'article_id': row[0], 'value': convert(row[1])} for row in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    op.add_column('article', sa.Column('description_z', sa.LargeBinary(), nullable=True))
+    copy_in_batches('description', 'description_z', lambda value: zlib.compress((value or '').encode('utf-8')))
+    with op.batch_alter_table('article') as batch_op:
+        batch_op.alter_column('description_z', existing_type=sa.LargeBinary(), nullable=False)
+        batch_op.drop_column('description')
+
+
+def downgrade() -> None:
+    op.add_column('article', sa.Column('description', sa.String(), nullable=True))
+    copy_in_batches('description_z', 'description', lambda value: zlib.decompress(value).decode('utf-8'))
+    with op.batch_alter_table('article') as batch_op:
+        batch_op.alter_column('description', existing_type=sa.String(), nullable=False)
+        batch_op.drop_column('description_z')
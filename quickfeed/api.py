@@ -1,11 +1,82 @@
 import datetime
+import logging
+import time
 import typing as T
 
-import feedparser
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-
-from quickfeed import models
+from sqlalchemy import (and_, delete, event, func, insert, inspect, literal,
+                        or_, select, update)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import (Session, aliased, make_transient_to_detached,
+                            selectinload)
+
+from quickfeed import article_listing, cache, canonical, change_log, http_client, models, tracing
+
+if T.TYPE_CHECKING:
+    import feedparser
+
+logger = logging.getLogger(__name__)
+
+# Lookup cache functions. Rows looked up again and again by the same key and rarely written (the bookmark list,
+# categories, feeds) are kept in cache.lookup_cache as detached copies, which are merged into the caller's session
+# without a query. Any session flushing a change to one of them invalidates its keys, again once committed.
+
+def detached_copy(obj: T.Any) -> T.Any:
+    """Copy the columns of a loaded row into a clean detached instance, which sessions can merge but not change."""
+    mapper = inspect(obj).mapper
+    copy = mapper.class_()
+    for attribute in mapper.column_attrs:
+        setattr(copy, attribute.key, getattr(obj, attribute.key))
+    make_transient_to_detached(copy)
+    return copy
+
+def cached_lookup(db: Session, key: T.Tuple[str, str], stmt: T.Any) -> T.Optional[T.Any]:
+    """Get the single row a query selects, from the lookup cache when it holds the key."""
+    cached = cache.lookup_cache.get(key)
+    if cached is not None:
+        existing = db.identity_map.get(inspect(cached).key)
+        return existing if existing is not None else db.merge(cached, load=False)
+    obj = db.scalars(stmt).one_or_none()
+    if obj is not None:
+        cache.lookup_cache.set(key, detached_copy(obj))
+    return obj
+
+async def cached_lookup_async(db: AsyncSession, key: T.Tuple[str, str], stmt: T.Any) -> T.Optional[T.Any]:
+    """Async counterpart of cached_lookup."""
+    cached = cache.lookup_cache.get(key)
+    if cached is not None:
+        existing = db.identity_map.get(inspect(cached).key)
+        return existing if existing is not None else await db.merge(cached, load=False)
+    obj = (await db.scalars(stmt)).one_or_none()
+    if obj is not None:
+        cache.lookup_cache.set(key, detached_copy(obj))
+    return obj
+
+def lookup_keys(obj: T.Any) -> T.List[T.Tuple[str, str]]:
+    """The lookup cache keys a feed, category or list can be cached under, including names it is being renamed from."""
+    if isinstance(obj, models.Feed):
+        return [("feed", str(obj.id))]
+    if isinstance(obj, models.Category):
+        names = {obj.name, *inspect(obj).attrs.name.history.deleted}
+        return [("category", str(obj.id))] + [("category_name", name) for name in names]
+    if isinstance(obj, models.List):
+        return [("list_name", name) for name in {obj.name, *inspect(obj).attrs.name.history.deleted}]
+    return []
+
+@event.listens_for(Session, "after_flush")
+def invalidate_flushed_lookups(session: Session, flush_context: T.Any) -> None:  # pylint: disable=unused-argument
+    keys = [key for obj in (*session.new, *session.dirty, *session.deleted) for key in lookup_keys(obj)]
+    if keys:
+        cache.lookup_cache.invalidate(*keys)
+        # Another session may cache the old row again until this one commits
+        session.info.setdefault("lookup_keys", set()).update(keys)
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_lookups(session: Session) -> None:
+    cache.lookup_cache.invalidate(*session.info.pop("lookup_keys", ()))
+
+@event.listens_for(Session, "after_rollback")
+def forget_rolled_back_lookups(session: Session) -> None:
+    session.info.pop("lookup_keys", None)
 
 # Article-related functions
 
@@ -27,37 +98,149 @@ def get_article(db: Session, feed_id: int, unique_id: str) -> T.Optional[models.
             models.Article.unique_id == unique_id)
     return db.scalars(stmt).one_or_none()
 
+def get_canonical_article(db: Session, canonical_url_hash: str, feed_id: int) -> T.Optional[models.Article]:
+    """Get the first article seen with a canonical URL in another feed than the given one, the one an article
+    of that feed with the same URL links to. Entries of a single feed sharing a link are distinct entries."""
+    stmt = select(
+        models.Article).filter(
+        models.Article.canonical_url_hash == canonical_url_hash).filter(
+            models.Article.canonical_id.is_(None)).filter(
+                models.Article.feed_id != feed_id).order_by(models.Article.id).limit(1)
+    return db.scalars(stmt).first()
+
+def get_duplicate_articles(db: Session, article_id: str) -> T.List[models.Article]:
+    """Get every copy of an article's story: the canonical article and all articles linked to it."""
+    article = get_article_by_id(db, article_id)
+    if article is None:
+        return []
+    root_id = article.canonical_id or article.id
+    stmt = select(models.Article).filter(
+        or_(models.Article.id == root_id, models.Article.canonical_id == root_id))
+    return list(db.scalars(stmt).all())  # Convert Sequence to List
+
+def feed_has_duplicates(db: Session, feed_id: int) -> bool:
+    """Tell whether any article of a feed is a duplicate of another article, or has duplicates."""
+    feed_article = aliased(models.Article)
+    feed_article_ids = select(feed_article.id).filter(feed_article.feed_id == feed_id)
+    stmt = select(models.Article.id).filter(or_(
+        and_(models.Article.feed_id == feed_id, models.Article.canonical_id.is_not(None)),
+        models.Article.canonical_id.in_(feed_article_ids)
+    )).limit(1)
+    return db.scalar(stmt) is not None
+
 def add_article(
     db: Session,
     feed_id: int,
     unique_id: str, title: str, link: str, description: str, published_at: datetime.datetime,
     added_at: datetime.datetime
 ) -> models.Article:
-    """Add a new article to the database."""
+    """Add a new article to the database.
+
+    If the story was already seen in another feed through a link to the same canonical URL, the new article is
+    linked to the first one, shares its read state and doesn't store the description again. Articles without
+    a web link are never linked."""
+    canonical_url_hash = canonical.url_hash(link)
+    original = get_canonical_article(db, canonical_url_hash, feed_id) if canonical_url_hash is not None else None
     article = models.Article(
         feed_id=feed_id,
         unique_id=unique_id,
         title=title,
         link=link,
-        description=description,
+        description=description if original is None else '',
         published_at=published_at,
-        added_at=added_at
+        added_at=added_at,
+        canonical_url_hash=canonical_url_hash,
+        canonical_id=original.id if original is not None else None,
+        read_at=original.read_at if original is not None else None
     )
     db.add(article)
     db.flush()  # Explicitly flush to make sure the article is persisted
+    article_listing.refresh_article_listing(db, models.Article.id == article.id)
+    change_log.record_changes(db, models.Change.ARTICLE, [article.id], models.Change.INSERT)
     return article
 
+def promote_oldest_duplicate(db: Session, article: models.Article) -> T.Optional[models.Article]:
+    """Make the oldest duplicate of a canonical article about to be deleted the canonical article in its place.
+
+    The promoted article takes over the description, which duplicates don't store, and the other duplicates
+    are linked to it. Returns the promoted article, if there was a duplicate."""
+    if article.canonical_id is not None:
+        return None
+    stmt = select(models.Article).filter(models.Article.canonical_id == article.id).order_by(models.Article.id).limit(1)
+    successor = db.scalars(stmt).first()
+    if successor is None:
+        return None
+    successor.canonical_id = None
+    successor.description = article.description
+    db.execute(update(models.Article).filter(models.Article.canonical_id == article.id).filter(
+        models.Article.id != successor.id).values(canonical_id=successor.id))
+    copies = or_(models.Article.id == successor.id, models.Article.canonical_id == successor.id)
+    article_listing.refresh_article_listing(db, copies)
+    change_log.record_changes(
+        db, models.Change.ARTICLE, db.scalars(select(models.Article.id).filter(copies)), models.Change.UPDATE)
+    return successor
+
 def delete_article_by_id(session: Session, article_id: str) -> None:
-    """Delete an article by its ID."""
+    """Delete an article by its ID. Its oldest duplicate, if any, becomes the canonical article."""
     stmt = select(models.Article).filter(models.Article.id == article_id)
     article = session.scalars(stmt).one()
+    promote_oldest_duplicate(session, article)
+    session.execute(delete(models.ArticleListing).filter(models.ArticleListing.article_id == article.id))
+    change_log.record_changes(session, models.Change.ARTICLE, [article.id], models.Change.DELETE)
     session.delete(article)
 
 def update_read(db: Session, article_id: str) -> None:
-    """Mark an article as read by setting its read_at timestamp."""
+    """Mark an article, and every duplicate of its story, as read by setting their read_at timestamp."""
     article_stmt = select(models.Article).filter(models.Article.id == article_id)
     article = db.scalars(article_stmt).one()
-    article.read_at = datetime.datetime.now() # type: ignore
+    root_id = article.canonical_id or article.id
+    copies = or_(models.Article.id == root_id, models.Article.canonical_id == root_id)
+    stmt = update(models.Article).filter(copies).values(read_at=datetime.datetime.now())
+    db.execute(stmt)
+    article_listing.refresh_article_listing(db, copies)
+    change_log.record_changes(
+        db, models.Change.ARTICLE, db.scalars(select(models.Article.id).filter(copies)), models.Change.READ
+    )
+
+def update_read_state(
+    db: Session, read: bool, feed_id: T.Optional[int] = None, category_name: T.Optional[str] = None,
+    published_before: T.Optional[datetime.datetime] = None
+) -> int:
+    """Mark the articles matching the filters (all articles without any), and every duplicate of their stories,
+    as read or unread. Returns the number of articles changed.
+
+    Articles are matched on the indexed article_listing columns, and each table is changed with a single
+    UPDATE whatever the number of articles."""
+    criteria = []
+    if feed_id is not None:
+        criteria.append(models.ArticleListing.feed_id == feed_id)
+    if category_name is not None:
+        criteria.append(models.ArticleListing.category_name == category_name)
+    if published_before is not None:
+        criteria.append(models.ArticleListing.published_at < published_before)
+    roots = select(
+        func.coalesce(models.ArticleListing.canonical_id, models.ArticleListing.article_id)).filter(*criteria)
+    copies = or_(models.Article.id.in_(roots), models.Article.canonical_id.in_(roots))
+    if read:
+        changing = models.Article.read_at.is_(None)
+        action = models.Change.READ
+    else:
+        changing = models.Article.read_at.is_not(None)
+        action = models.Change.UNREAD
+    now = datetime.datetime.now()
+    read_at = now if read else None
+    change_log.lock_change_log(db)
+    db.execute(insert(models.Change).from_select(
+        ['entity', 'entity_id', 'action', 'created_at', 'updated_at'],
+        select(literal(models.Change.ARTICLE), models.Article.id, literal(action), literal(now), literal(now)).filter(
+            copies, changing)
+    ))
+    count = db.execute(update(models.Article).filter(copies, changing).values(read_at=read_at)).rowcount
+    # Listing rows carry read_at too; same rows, same value
+    listing_copies = or_(models.ArticleListing.article_id.in_(roots), models.ArticleListing.canonical_id.in_(roots))
+    listing_changing = models.ArticleListing.read_at.is_(None) if read else models.ArticleListing.read_at.is_not(None)
+    db.execute(update(models.ArticleListing).filter(listing_copies, listing_changing).values(read_at=read_at))
+    return count
 
 def sort_articles(articles: T.List[models.Article]) -> T.List[models.Article]:
     """Sort articles based on published date, with a decay factor for feed age."""
@@ -78,6 +261,11 @@ def get_feeds(session: Session) -> T.List[models.Feed]:
     stmt = select(models.Feed)
     return list(session.scalars(stmt).all())  # Convert Sequence to List
 
+def get_feed_ids(session: Session) -> T.List[int]:
+    """Get the IDs of all feeds."""
+    stmt = select(models.Feed.id).order_by(models.Feed.id)
+    return list(session.scalars(stmt).all())  # Convert Sequence to List
+
 def get_feed_by_uri(session: Session, feed_url: str) -> T.Optional[models.Feed]:
     """Retrieve a single feed by its URL."""
     stmt = select(models.Feed).filter(models.Feed.feed_url == feed_url)
@@ -86,7 +274,7 @@ def get_feed_by_uri(session: Session, feed_url: str) -> T.Optional[models.Feed]:
 def get_feed_by_id(session: Session, feed_id: str) -> T.Optional[models.Feed]:
     """Retrieve a single feed by its ID."""
     stmt = select(models.Feed).filter(models.Feed.id == feed_id)
-    return session.scalars(stmt).one_or_none()
+    return cached_lookup(session, ("feed", str(feed_id)), stmt)
 
 def add_feed(db: Session, feed_url: str, site_url: str, title: str,
              description: str, category_id: T.Optional[int] = None) -> models.Feed:
@@ -100,6 +288,7 @@ def add_feed(db: Session, feed_url: str, site_url: str, title: str,
                        )
     db.add(feed)
     db.flush()  # Explicitly flush to make sure the feed is persisted
+    change_log.record_changes(db, models.Change.FEED, [feed.id], models.Change.INSERT)
     return feed
 
 def delete_feed_and_articles_by_id(session: Session, feed_id: str) -> bool:
@@ -110,6 +299,8 @@ def delete_feed_and_articles_by_id(session: Session, feed_id: str) -> bool:
         return False
     for article in feed.articles:
         delete_article_by_id(session, article.id)
+    session.execute(delete(models.FetchJob).filter(models.FetchJob.feed_id == feed.id))
+    change_log.record_changes(session, models.Change.FEED, [feed.id], models.Change.DELETE)
     session.delete(feed)
     return True
 
@@ -128,12 +319,21 @@ def get_feeds_by_category_id(db: Session, category_id: int) -> T.List[models.Fee
     stmt = select(models.Feed).filter(models.Feed.category_id == category_id)
     return list(db.scalars(stmt).all())  # Convert Sequence to List
 
+def get_feeds_and_categories_signature(session: Session) -> T.Tuple[T.Any, ...]:
+    """Get a cheap summary of the feeds and categories that changes whenever one is added, changed or deleted.
+
+    Read from the change log: updated_at also moves when a fetch stores a feed's validators, which changes
+    nothing shown. Compaction keeps the latest change of every entity, so the summary never goes back."""
+    stmt = select(func.max(models.Change.seq)).filter(
+        models.Change.entity.in_([models.Change.FEED, models.Change.CATEGORY]))
+    return (session.scalar(stmt),)
+
 # Category-related functions
 
 def get_default_category(session: Session) -> T.Optional[models.Category]:
     """Get the default category."""
     stmt = select(models.Category).filter(models.Category.name == 'Default')
-    return session.scalars(stmt).one_or_none()
+    return cached_lookup(session, ("category_name", 'Default'), stmt)
 
 def get_categories(db: Session) -> T.List[models.Category]:
     """Get all categories."""
@@ -143,24 +343,37 @@ def get_categories(db: Session) -> T.List[models.Category]:
 def get_category_by_name(db: Session, name: str) -> T.Optional[models.Category]:
     """Get a specific category by name."""
     stmt = select(models.Category).filter(models.Category.name == name)
-    return db.scalars(stmt).one_or_none()
+    return cached_lookup(db, ("category_name", name), stmt)
 
 def get_category_by_id(db: Session, category_id: int) -> T.Optional[models.Category]:
     """Get a specific category by ID."""
     stmt = select(models.Category).filter(models.Category.id == category_id)
-    return db.scalars(stmt).one_or_none()
+    return cached_lookup(db, ("category", str(category_id)), stmt)
 
 def add_category(db: Session, name: str, description: str, order_number: int) -> models.Category:
     """Add a new category to the database."""
     category = models.Category(name=name, description=description, order_number=order_number)
     db.add(category)
     db.flush()  # Explicitly flush to make sure the category is persisted
+    change_log.record_changes(db, models.Change.CATEGORY, [category.id], models.Change.INSERT)
+    return category
+
+def update_category(
+    db: Session, category: models.Category, name: str, description: str, order_number: int
+) -> models.Category:
+    """Update a category, and the listing rows of its articles which carry its name."""
+    category.name = name
+    category.description = description
+    category.order_number = order_number
+    article_listing.refresh_category_listing(db, category.id)
+    change_log.record_changes(db, models.Change.CATEGORY, [category.id], models.Change.UPDATE)
     return category
 
 def delete_category(session: Session, category_id: int) -> None:
     """Delete a category by its ID."""
     stmt = select(models.Category).filter(models.Category.id == category_id)
     category = session.scalars(stmt).one()
+    change_log.record_changes(session, models.Change.CATEGORY, [category.id], models.Change.DELETE)
     session.delete(category)
 
 def add_feed_to_category(db: Session, feed_id: int, category: models.Category) -> models.Feed:
@@ -168,6 +381,8 @@ def add_feed_to_category(db: Session, feed_id: int, category: models.Category) -
     feed_stmt = select(models.Feed).filter(models.Feed.id == feed_id)
     feed = db.scalars(feed_stmt).one()
     feed.category = category
+    article_listing.refresh_feed_listing(db, feed.id)
+    change_log.record_changes(db, models.Change.FEED, [feed.id], models.Change.UPDATE)
     return feed
 
 # List and Bookmark functions
@@ -175,7 +390,7 @@ def add_feed_to_category(db: Session, feed_id: int, category: models.Category) -
 def get_bookmark_list(db: Session) -> T.Optional[models.List]:
     """Get the bookmark list."""
     stmt = select(models.List).filter(models.List.name == 'Bookmarks')
-    return db.scalars(stmt).one_or_none()
+    return cached_lookup(db, ("list_name", 'Bookmarks'), stmt)
 
 def get_list(db: Session, list_id: int) -> T.Optional[models.List]:
     """Get a specific list by ID."""
@@ -195,16 +410,253 @@ def add_article_to_list(db: Session, list_id: int, article_id: str) -> models.Ar
     article_list = models.ArticleList(article_id=article_id, list_id=list_id)
     db.add(article_list)
     db.flush()  # Explicitly flush to make sure the article list entry is persisted
+    article_listing.refresh_article_listing(db, models.Article.id == article_id)
+    change_log.record_changes(db, models.Change.ARTICLE, [article_id], models.Change.BOOKMARK)
     return article_list
 
+def remove_article_from_list(db: Session, article_list: models.ArticleList) -> None:
+    """Remove an article from a list."""
+    article_id = article_list.article_id
+    db.delete(article_list)
+    db.flush()
+    article_listing.refresh_article_listing(db, models.Article.id == article_id)
+    change_log.record_changes(db, models.Change.ARTICLE, [article_id], models.Change.BOOKMARK)
+
 def get_articles_in_list(db: Session, list_id: int) -> T.List[models.ArticleList]:
     """Get all articles in a specific list."""
     stmt = select(models.ArticleList).filter(models.ArticleList.list_id == list_id)
     return list(db.scalars(stmt).all())  # Convert Sequence to List
 
-# Feed parsing function
+def get_list_ids_for_article(db: Session, article_id: int) -> T.List[int]:
+    """Get the IDs of all lists containing an article."""
+    stmt = select(models.ArticleList.list_id).filter(models.ArticleList.article_id == article_id)
+    return list(db.scalars(stmt).all())  # Convert Sequence to List
+
+# Async read functions, used by the request handlers. Relationships the callers need are loaded eagerly
+# since lazy loading isn't available on an AsyncSession.
+
+async def get_feeds_async(db: AsyncSession) -> T.List[models.Feed]:
+    """Get all feeds along with their category."""
+    stmt = select(models.Feed).options(selectinload(models.Feed.category))
+    return list((await db.scalars(stmt)).all())  # Convert Sequence to List
+
+async def get_feed_by_id_async(db: AsyncSession, feed_id: int) -> T.Optional[models.Feed]:
+    """Retrieve a single feed by its ID along with its category and articles."""
+    stmt = select(models.Feed).filter(models.Feed.id == feed_id).options(
+        selectinload(models.Feed.category), selectinload(models.Feed.articles))
+    return (await db.scalars(stmt)).one_or_none()
+
+async def get_feeds_by_category_id_async(db: AsyncSession, category_id: int) -> T.List[models.Feed]:
+    """Get all feeds that belong to a specific category by category ID, along with their category."""
+    stmt = select(models.Feed).filter(models.Feed.category_id == category_id).options(
+        selectinload(models.Feed.category))
+    return list((await db.scalars(stmt)).all())  # Convert Sequence to List
+
+async def get_last_updated_async(db: AsyncSession) -> T.Optional[models.Feed]:
+    """Get the last updated feed."""
+    stmt = select(models.Feed).order_by(models.Feed.feed_last_updated.desc()).limit(1)
+    return (await db.scalars(stmt)).first()
+
+async def get_categories_async(db: AsyncSession) -> T.List[models.Category]:
+    """Get all categories."""
+    stmt = select(models.Category)
+    return list((await db.scalars(stmt)).all())  # Convert Sequence to List
+
+async def get_category_by_id_async(db: AsyncSession, category_id: int) -> T.Optional[models.Category]:
+    """Get a specific category by ID."""
+    stmt = select(models.Category).filter(models.Category.id == category_id)
+    return await cached_lookup_async(db, ("category", str(category_id)), stmt)
 
-def get_feed_data(feed_url: str) -> feedparser.FeedParserDict:
-    """Parse feed data from a URL."""
-    return feedparser.parse(feed_url)
+async def get_bookmark_list_async(db: AsyncSession) -> T.Optional[models.List]:
+    """Get the bookmark list."""
+    stmt = select(models.List).filter(models.List.name == 'Bookmarks')
+    return await cached_lookup_async(db, ("list_name", 'Bookmarks'), stmt)
 
+async def get_list_async(db: AsyncSession, list_id: int) -> T.Optional[models.List]:
+    """Get a specific list by ID."""
+    stmt = select(models.List).filter(models.List.id == list_id)
+    return (await db.scalars(stmt)).one_or_none()
+
+# JSON API functions. Rows are streamed from the database so a large page is never held in memory at once.
+
+ARTICLE_FIELDS = (
+    'id', 'feed_id', 'title', 'link', 'description', 'published_at', 'added_at', 'read_at', 'canonical_id'
+)
+FEED_FIELDS = (
+    'id', 'title', 'feed_url', 'site_url', 'description', 'category_id', 'added_at', 'feed_last_updated'
+)
+CATEGORY_FIELDS = ('id', 'name', 'description', 'order_number')
+
+async def get_rows_by_id_async(
+    db: AsyncSession, model: T.Any, fields: T.Sequence[str], ids: T.Collection[int]
+) -> T.Dict[int, T.Any]:
+    """Get the given fields (the first being the ID) of a model's rows by ID."""
+    if not ids:
+        return {}
+    stmt = select(*(getattr(model, field) for field in fields)).filter(model.id.in_(ids))
+    return {row[0]: row for row in await db.execute(stmt)}
+
+async def get_bookmarked_ids_async(db: AsyncSession, article_ids: T.Collection[int]) -> T.Set[int]:
+    """Get which of the articles are bookmarked."""
+    if not article_ids:
+        return set()
+    stmt = select(models.ArticleList.article_id).join(
+        models.List, models.ArticleList.list_id == models.List.id).filter(models.List.name == 'Bookmarks').filter(
+            models.ArticleList.article_id.in_(article_ids))
+    return set((await db.scalars(stmt)).all())
+
+async def stream_articles_async(
+    db: AsyncSession,
+    fields: T.Sequence[str],
+    limit: int,
+    before_id: T.Optional[int] = None,
+    feed_id: T.Optional[int] = None,
+    category_name: T.Optional[str] = None
+) -> T.AsyncIterator[T.Any]:
+    """Stream the given fields of articles, most recently added first, starting below an article ID."""
+    stmt = select(*(getattr(models.Article, field) for field in fields)).order_by(
+        models.Article.id.desc()).limit(limit)
+    if before_id is not None:
+        stmt = stmt.filter(models.Article.id < before_id)
+    if feed_id is not None:
+        stmt = stmt.filter(models.Article.feed_id == feed_id)
+    if category_name is not None:
+        stmt = stmt.filter(models.Article.feed_id.in_(
+            select(models.Feed.id).join(models.Feed.category).filter(models.Category.name == category_name)))
+    async for row in await db.stream(stmt):
+        yield row
+
+async def stream_feeds_async(
+    db: AsyncSession,
+    fields: T.Sequence[str],
+    limit: int,
+    after_id: T.Optional[int] = None,
+    category_id: T.Optional[int] = None
+) -> T.AsyncIterator[T.Any]:
+    """Stream the given fields of feeds in ID order, starting above a feed ID."""
+    stmt = select(*(getattr(models.Feed, field) for field in fields)).order_by(models.Feed.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.filter(models.Feed.id > after_id)
+    if category_id is not None:
+        stmt = stmt.filter(models.Feed.category_id == category_id)
+    async for row in await db.stream(stmt):
+        yield row
+
+async def stream_categories_async(
+    db: AsyncSession, fields: T.Sequence[str], limit: int, after_id: T.Optional[int] = None
+) -> T.AsyncIterator[T.Any]:
+    """Stream the given fields of categories in ID order, starting above a category ID."""
+    stmt = select(*(getattr(models.Category, field) for field in fields)).order_by(models.Category.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.filter(models.Category.id > after_id)
+    async for row in await db.stream(stmt):
+        yield row
+
+# Feed parsing functions. The parsing and HTTP libraries are only imported by the processes that fetch feeds.
+
+def get_feed_data(feed_url: str) -> "feedparser.FeedParserDict":
+    """Parse feed data from a URL, downloaded through the shared HTTP client."""
+    # pylint: disable=import-outside-toplevel
+    import feedparser
+    import httpx
+
+    try:
+        with http_client.feed_fetcher.stream(feed_url) as response:
+            response.raise_for_status()
+            content = response.read()
+            headers = {
+                "content-type": response.headers.get("content-type", ""), "content-location": str(response.url)}
+    except (httpx.UnsupportedProtocol, httpx.InvalidURL):
+        # Not an HTTP URL, e.g. a local file, feedparser knows how to read those
+        return feedparser.parse(feed_url)
+    except (httpx.HTTPError, http_client.HostThrottled) as ex:
+        logger.warning("Fetching feed %s failed: %s", feed_url, ex)
+        return feedparser.FeedParserDict(feed=feedparser.FeedParserDict(), entries=[], bozo=1, bozo_exception=ex)
+    return feedparser.parse(content, response_headers=headers)
+
+def stream_feed_entries(feed: models.Feed) -> T.Iterator["feedparser.FeedParserDict"]:
+    """Yield a feed's entries as they are downloaded and parsed. Stopping iteration stops the download.
+
+    Sends a conditional request with the feed's stored validators, and updates them unless the download fails
+    before the caller stops. Documents that aren't well-formed XML are handed to feedparser along with the bytes
+    already downloaded."""
+    # pylint: disable=import-outside-toplevel
+    import httpx
+
+    from quickfeed import feed_stream
+
+    seen: T.Set[T.Optional[str]] = set()
+    try:
+        # Includes waiting for the host's turn, connecting and the time to the first byte
+        requested = time.perf_counter()
+        # stream() releases the response and the host's slot through with blocks, which pylint doesn't see
+        # pylint: disable-next=contextmanager-generator-missing-cleanup
+        with http_client.feed_fetcher.stream(feed.feed_url, conditional_headers(feed)) as response:
+            headers_seconds = time.perf_counter() - requested
+            tracing.get_current_span().set_attribute("http.headers_ms", headers_seconds * 1000)
+            if response.status_code == 304:
+                return
+            response.raise_for_status()
+            # Only stored once the entries they vouch for were all read, or known to the caller: a 304 to a
+            # download that failed halfway would lose the rest for good
+            validators = (response.headers.get("etag"), response.headers.get("last-modified"))
+            content_type = response.headers.get("content-type", "")
+            # Relative links are relative to where the feed was redirected to, as feedparser has them
+            base_url = str(response.url)
+            recorded = feed_stream.RecordedChunks(response.iter_bytes())
+            try:
+                for entry in feed_stream.iter_entries(recorded, base_url):
+                    seen.add(entry.get("id", entry.get("link")))
+                    try:
+                        yield entry
+                    except GeneratorExit:
+                        # The caller stopped at entries it already has
+                        feed.http_etag, feed.http_last_modified = validators
+                        raise
+                feed.http_etag, feed.http_last_modified = validators
+                return
+            except feed_stream.FeedStreamError:
+                recorded.drain()
+            finally:
+                # Parsing is interleaved with the download, tell the network time (headers included) apart for
+                # the caller's span
+                tracing.get_current_span().set_attributes({
+                    "http.receive_ms": (headers_seconds + recorded.receive_seconds) * 1000,
+                    "http.response_bytes": len(recorded.data)
+                })
+    except http_client.HostThrottled as ex:
+        logger.warning("Skipping feed %s: %s", feed.feed_url, ex)
+        return
+    except (httpx.UnsupportedProtocol, httpx.InvalidURL):
+        # Not an HTTP URL, e.g. a local file, feedparser knows how to read those
+        yield from get_feed_data(feed.feed_url).entries
+        return
+    except httpx.HTTPError as ex:
+        logger.warning("Fetching feed %s failed: %s", feed.feed_url, ex)
+        return
+
+    feed.http_etag, feed.http_last_modified = validators
+    # Skip what was already yielded before the stream failed
+    yield from parse_unseen_entries(bytes(recorded.data), content_type, base_url, seen)
+
+def conditional_headers(feed: models.Feed) -> T.Dict[str, str]:
+    """The request headers asking for a feed only if it changed since its stored validators."""
+    headers = {}
+    if feed.http_etag:
+        headers["If-None-Match"] = feed.http_etag
+    if feed.http_last_modified:
+        headers["If-Modified-Since"] = feed.http_last_modified
+    return headers
+
+def parse_unseen_entries(
+    document: bytes, content_type: str, base_url: str, seen: T.Set[T.Optional[str]]
+) -> T.List["feedparser.FeedParserDict"]:
+    """Parse a whole feed document with feedparser, leaving out the entries whose ID or link is in `seen`."""
+    import feedparser  # pylint: disable=import-outside-toplevel
+
+    parsed = feedparser.parse(document, response_headers={"content-type": content_type, "content-location": base_url})
+    return [entry for entry in parsed.entries if entry.get("id", entry.get("link")) not in seen]
+
+
+# Every function above gets a span when called within a sampled trace, see quickfeed.tracing
+tracing.instrument(globals())
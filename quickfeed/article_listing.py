@@ -0,0 +1,175 @@
+"""
+The denormalized article_listing table, which listing pages read instead of joining article, feed, category and
+the bookmark list.
+
+It is derived from those tables: every write to them goes through one of the refresh functions below, and
+`quickfeed.listing` rebuilds or checks it from the command line.
+"""
+
+import datetime
+import functools
+import typing as T
+
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from quickfeed import models, tracing
+
+
+LISTING_COLUMNS = (
+    'article_id', 'feed_id', 'feed_title', 'category_id', 'category_name', 'category_order', 'canonical_id',
+    'canonical_category_id', 'title', 'link', 'published_at', 'read_at', 'bookmarked'
+)
+
+
+@functools.lru_cache(maxsize=None)
+def select_article_listing() -> T.Any:
+    """Select the article_listing rows from the source tables, in LISTING_COLUMNS order.
+
+    Built once: statements are immutable and the aliases are costly to set up on every article insert."""
+    canonical_article = aliased(models.Article)
+    canonical_feed = aliased(models.Feed)
+    bookmarked = select(models.ArticleList.article_id).join(
+        models.List, models.ArticleList.list_id == models.List.id).filter(
+            models.List.name == 'Bookmarks').filter(models.ArticleList.article_id == models.Article.id).exists()
+    return select(
+        models.Article.id,
+        models.Article.feed_id,
+        models.Feed.title,
+        models.Feed.category_id,
+        models.Category.name,
+        models.Category.order_number,
+        canonical_article.id,
+        canonical_feed.category_id,
+        models.Article.title,
+        models.Article.link,
+        models.Article.published_at,
+        models.Article.read_at,
+        bookmarked
+    ).join(models.Feed, models.Article.feed_id == models.Feed.id).outerjoin(
+        models.Category, models.Feed.category_id == models.Category.id).outerjoin(
+            canonical_article, models.Article.canonical_id == canonical_article.id).outerjoin(
+                canonical_feed, canonical_article.feed_id == canonical_feed.id)
+
+
+def refresh_article_listing(db: Session, *criteria: T.Any) -> None:
+    """Recompute the listing rows of the articles matching the criteria."""
+    db.flush()
+    article_ids = select(models.Article.id).filter(*criteria)
+    db.execute(delete(models.ArticleListing).filter(models.ArticleListing.article_id.in_(article_ids)))
+    db.execute(insert(models.ArticleListing).from_select(LISTING_COLUMNS, select_article_listing().filter(*criteria)))
+
+
+def refresh_feed_listing(db: Session, feed_id: int) -> None:
+    """Recompute the listing rows of a feed's articles, and of their duplicates in other feeds."""
+    feed_article = aliased(models.Article)
+    feed_article_ids = select(feed_article.id).filter(feed_article.feed_id == feed_id)
+    refresh_article_listing(
+        db, or_(models.Article.feed_id == feed_id, models.Article.canonical_id.in_(feed_article_ids)))
+
+
+def refresh_category_listing(db: Session, category_id: int) -> None:
+    """Recompute the listing rows of the articles in a category, e.g. after it is renamed."""
+    feed_ids = select(models.Feed.id).filter(models.Feed.category_id == category_id)
+    refresh_article_listing(db, models.Article.feed_id.in_(feed_ids))
+
+
+def rebuild_article_listing(db: Session) -> int:
+    """Recompute the whole article_listing table. Returns the number of rows."""
+    db.execute(delete(models.ArticleListing))
+    db.execute(insert(models.ArticleListing).from_select(LISTING_COLUMNS, select_article_listing()))
+    return db.scalar(select(func.count()).select_from(models.ArticleListing))
+
+
+def check_article_listing(db: Session) -> T.Dict[str, T.List[int]]:
+    """Compare article_listing with the source tables.
+
+    Returns the IDs of articles whose listing row is missing or out of date ("stale") and of listing rows
+    whose article no longer exists ("orphaned")."""
+    expected = select_article_listing()
+    actual = select(*(getattr(models.ArticleListing, column) for column in LISTING_COLUMNS))
+    missing_or_stale = {row[0] for row in db.execute(expected.except_(actual))}
+    outdated = {row[0] for row in db.execute(actual.except_(expected))}
+    existing = set(db.scalars(select(models.Article.id).filter(models.Article.id.in_(outdated))))
+    return {
+        "stale": sorted(missing_or_stale | existing),
+        "orphaned": sorted(outdated - existing),
+    }
+
+
+def unique_listing_filter(category_name: T.Optional[str]) -> T.Any:
+    """Filter out duplicate articles whose canonical article is listed too.
+
+    Across all feeds only canonical articles are listed. In a category, a duplicate is listed unless its
+    canonical article is in the same category."""
+    if category_name is None:
+        return models.ArticleListing.canonical_id.is_(None)
+    return or_(
+        models.ArticleListing.canonical_id.is_(None),
+        models.ArticleListing.canonical_category_id.is_(None),
+        models.ArticleListing.canonical_category_id != models.ArticleListing.category_id
+    )
+
+
+async def get_listing_page_async(
+    db: AsyncSession, category_name: T.Optional[str], offset: int, limit: int, unread_only: bool = False
+) -> T.Tuple[T.List[models.ArticleListing], int]:
+    """Get a page of listing rows, newest first, for all articles or a category, and the total row count."""
+    criteria = [unique_listing_filter(category_name)]
+    if category_name is not None:
+        criteria.append(models.ArticleListing.category_name == category_name)
+    if unread_only:
+        criteria.append(models.ArticleListing.read_at.is_(None))  # Served by the partial unread indexes
+    stmt = select(models.ArticleListing).filter(*criteria).order_by(
+        models.ArticleListing.published_at.desc(), models.ArticleListing.article_id.desc()).offset(offset).limit(limit)
+    rows = list((await db.scalars(stmt)).all())
+    total = await db.scalar(select(func.count()).select_from(models.ArticleListing).filter(*criteria))
+    return rows, total
+
+
+async def get_list_page_async(
+    db: AsyncSession, list_id: int, offset: int, limit: int
+) -> T.Tuple[T.List[models.ArticleListing], int]:
+    """Get a page of the listing rows of a list's articles, most recently added to the list first, and the total
+    row count."""
+    criteria = [models.ArticleList.list_id == list_id]
+    stmt = select(models.ArticleListing).join(
+        models.ArticleList, models.ArticleList.article_id == models.ArticleListing.article_id).filter(
+            *criteria).order_by(
+                models.ArticleList.created_at.desc(), models.ArticleList.article_id.desc()).offset(
+                    offset).limit(limit)
+    rows = list((await db.scalars(stmt)).all())
+    total = await db.scalar(select(func.count()).select_from(models.ArticleList).filter(*criteria))
+    return rows, total
+
+
+async def get_timeline_async(
+    db: AsyncSession, category_name: T.Optional[str], limit: int
+) -> T.Tuple[T.List[T.Tuple[int, int, datetime.datetime]], T.Dict[int, int], int]:
+    """Get the newest (article_id, feed_id, published_at) listing rows of all articles or a category, the
+    number of rows per feed and the last article ID they account for, to build its timeline."""
+    criteria = [unique_listing_filter(category_name)]
+    if category_name is not None:
+        criteria.append(models.ArticleListing.category_name == category_name)
+    stmt = select(
+        models.ArticleListing.article_id, models.ArticleListing.feed_id, models.ArticleListing.published_at
+    ).filter(*criteria).order_by(
+        models.ArticleListing.published_at.desc(), models.ArticleListing.article_id.desc()).limit(limit)
+    rows = [tuple(row) for row in await db.execute(stmt)]
+    counts_stmt = select(models.ArticleListing.feed_id, func.count()).filter(*criteria).group_by(
+        models.ArticleListing.feed_id)
+    feed_counts = dict(tuple(row) for row in await db.execute(counts_stmt))
+    last_article_id = await db.scalar(select(func.max(models.ArticleListing.article_id)))
+    return rows, feed_counts, last_article_id or 0
+
+
+async def get_listing_rows_async(db: AsyncSession, article_ids: T.List[int]) -> T.List[models.ArticleListing]:
+    """Get the listing rows of articles by ID, in the order of the IDs."""
+    stmt = select(models.ArticleListing).filter(models.ArticleListing.article_id.in_(article_ids))
+    rows_by_id = {row.article_id: row for row in (await db.scalars(stmt)).all()}
+    return [rows_by_id[article_id] for article_id in article_ids if article_id in rows_by_id]
+
+
+# Every function above gets a span when called within a sampled trace, see quickfeed.tracing
+tracing.instrument(globals())
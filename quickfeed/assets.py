@@ -0,0 +1,117 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import typing as T
+
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from quickfeed import compression
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class Asset:
+    """A static file held in memory along with its precompressed variants."""
+
+    def __init__(self, name: str, content: bytes) -> None:
+        self.name = name
+        self.content = content
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.encoded: T.Dict[str, bytes] = {}
+        if compression.is_compressible(self.media_type):
+            for encoding in compression.available_encodings():
+                compressed = compression.compress(content, encoding)
+                # Only keep variants that actually save bytes
+                if len(compressed) < len(content):
+                    self.encoded[encoding] = compressed
+
+    def etag(self, encoding: T.Optional[str]) -> str:
+        """ETag of the variant sent with an encoding (None for identity), which differ in bytes."""
+        if encoding is None:
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    @property
+    def fingerprinted_name(self) -> str:
+        stem, ext = os.path.splitext(self.name)
+        return f"{stem}.{self.digest}{ext}"
+
+
+class StaticAssets:
+    """ASGI app serving a directory of static files from memory.
+
+    Files are read and precompressed once by `load`. Each file is served both under its plain
+    name and a content-hash fingerprinted name; the fingerprinted URL (see `url`) never changes
+    content so it is sent with an immutable Cache-Control header.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.__assets: T.Dict[str, Asset] = {}
+        self.__fingerprinted: T.Dict[str, Asset] = {}
+
+    def load(self) -> None:
+        assets: T.Dict[str, Asset] = {}
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as file:
+                    assets[name] = Asset(name, file.read())
+        self.__assets = assets
+        self.__fingerprinted = {asset.fingerprinted_name: asset for asset in assets.values()}
+        logger.info("Loaded %d static assets (encodings: %s)", len(assets), compression.available_encodings())
+
+    def url(self, name: str) -> str:
+        """Fingerprinted URL for a static file, for use in templates."""
+        asset = self.__assets.get(name)
+        if asset is None:
+            return f"/static/{name}"
+        return f"/static/{asset.fingerprinted_name}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        response = self.get_response(scope)
+        await response(scope, receive, send)
+
+    def get_response(self, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            return PlainTextResponse("Method Not Allowed", status_code=405)
+
+        # Mounted apps see the full path, with the mount point in root_path
+        path: str = scope["path"]
+        root_path: str = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        name = path.lstrip("/")
+        if name in self.__fingerprinted:
+            asset = self.__fingerprinted[name]
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        elif name in self.__assets:
+            asset = self.__assets[name]
+            cache_control = REVALIDATE_CACHE_CONTROL
+        else:
+            return PlainTextResponse("Not Found", status_code=404)
+
+        request_headers = Headers(scope=scope)
+        encoding = compression.negotiate(request_headers.get("accept-encoding"), asset.encoded.keys())
+        etag = asset.etag(encoding)
+        headers = {
+            "cache-control": cache_control,
+            "etag": etag,
+            "vary": "Accept-Encoding",
+        }
+        if etag in (tag.strip() for tag in request_headers.get("if-none-match", "").split(",")):
+            return Response(status_code=304, headers=headers)
+
+        body = asset.content
+        if encoding is not None:
+            body = asset.encoded[encoding]
+            headers["content-encoding"] = encoding
+        return Response(content=body, headers=headers, media_type=asset.media_type)
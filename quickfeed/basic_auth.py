@@ -1,45 +1,177 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import os
 import secrets
+import time
+import typing as T
 
-from fastapi import HTTPException, Request, status
+from fastapi import status
 from fastapi.responses import JSONResponse
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from starlette.middleware.base import (BaseHTTPMiddleware,
-                                       RequestResponseEndpoint)
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+logger = logging.getLogger(__name__)
 
-class AuthMiddleware(BaseHTTPMiddleware):
+SESSION_COOKIE_NAME = "quickfeed_session"
+DEFAULT_SESSION_MAX_AGE = 30 * 24 * 60 * 60
+DEFAULT_PUBLIC_PATH_PREFIXES = ("/static/",)
+DEFAULT_SESSION_SECRET_FILE = ".session_secret"
 
-    def __init__(self, app, username: str, password: str, security: HTTPBasic = HTTPBasic()) -> None:
+
+def load_or_create_session_secret(path: str = DEFAULT_SESSION_SECRET_FILE) -> str:
+    """Read the session secret from a file, creating it with a random secret on first use.
+
+    The file is written aside and linked into place, which fails if it already exists, so workers starting
+    together all end up reading the same secret. Delete the file to invalidate every session."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        pass
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+        file.write(secrets.token_urlsafe(32))
+    try:
+        os.link(temporary_path, path)
+        logger.info("Created a new session secret in %s", path)
+    except FileExistsError:  # Another worker created it first
+        pass
+    finally:
+        os.unlink(temporary_path)
+    with open(path, encoding="utf-8") as file:
+        return file.read().strip()
+
+
+class AuthMiddleware:
+    """Pure ASGI basic auth middleware.
+
+    A signed session cookie is issued after the first successful Basic auth so later requests
+    only need an HMAC check. Paths under a public prefix (static assets) skip auth entirely.
+    Response messages are forwarded as they come, so streaming responses are untouched.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        username: str,
+        password: str,
+        session_secret: str,
+        session_max_age: int = DEFAULT_SESSION_MAX_AGE,
+        public_path_prefixes: T.Tuple[str, ...] = DEFAULT_PUBLIC_PATH_PREFIXES
+    ) -> None:
+        self.app = app
         self.__username = username
         self.__password = password
-        self.__security = security
-        super().__init__(app)
+        if not session_secret:
+            raise ValueError("A session secret is required to sign session cookies")
+        self.__secret = session_secret.encode("utf-8")
+        self.__session_max_age = session_max_age
+        self.__public_path_prefixes = public_path_prefixes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"].startswith(self.__public_path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if self.validate_session(self.get_cookie(headers, SESSION_COOKIE_NAME)):
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
         # Extract credentials
-        try:
-            credentials: HTTPBasicCredentials = await self.__security(request)
-        except HTTPException:
-            return JSONResponse(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                content={"detail": "Authentication required"},
-                headers={"WWW-Authenticate": "Basic"},
-            )
+        credentials = self.parse_basic_credentials(headers.get("authorization"))
+        if credentials is None:
+            await self.reject(scope, receive, send, "Authentication required")
+            return
 
         # Check credentials
-        if not self.authenticate(credentials):
-            return JSONResponse(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                content={"detail": "Invalid authentication credentials"},
-                headers={"WWW-Authenticate": "Basic"},
-            )
+        if not self.authenticate(*credentials):
+            await self.reject(scope, receive, send, "Invalid authentication credentials")
+            return
+
+        if scope["type"] == "websocket":
+            await self.app(scope, receive, send)
+            return
+
+        cookie = self.session_cookie(secure=scope.get("scheme") == "https")
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("set-cookie", cookie)
+            await send(message)
 
         # Proceed to endpoint
-        response = await call_next(request)
-        return response
+        await self.app(scope, receive, send_with_cookie)
 
-    def authenticate(self, credentials: HTTPBasicCredentials) -> bool:
-        is_correct_username = secrets.compare_digest(credentials.username, self.__username)
-        is_correct_password = secrets.compare_digest(credentials.password, self.__password)
+    async def reject(self, scope: Scope, receive: Receive, send: Send, detail: str) -> None:
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        response = JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"detail": detail},
+            headers={"WWW-Authenticate": "Basic"},
+        )
+        await response(scope, receive, send)
+
+    def authenticate(self, username: str, password: str) -> bool:
+        is_correct_username = secrets.compare_digest(username.encode("utf-8"), self.__username.encode("utf-8"))
+        is_correct_password = secrets.compare_digest(password.encode("utf-8"), self.__password.encode("utf-8"))
 
         return is_correct_username and is_correct_password
+
+    def session_cookie(self, secure: bool) -> str:
+        expires_at = int(time.time()) + self.__session_max_age
+        value = f"{expires_at}.{self.sign(str(expires_at))}"
+        cookie = f"{SESSION_COOKIE_NAME}={value}; Max-Age={self.__session_max_age}; Path=/; HttpOnly; SameSite=Lax"
+        if secure:
+            cookie += "; Secure"
+        return cookie
+
+    def validate_session(self, value: T.Optional[str]) -> bool:
+        if not value:
+            return False
+        expires_at, _, signature = value.partition(".")
+        if not expires_at.isdigit():
+            return False
+        # As bytes: compare_digest refuses non-ASCII strings, which a client can put in the cookie
+        if not secrets.compare_digest(signature.encode("utf-8"), self.sign(expires_at).encode("utf-8")):
+            return False
+        return int(expires_at) > time.time()
+
+    def sign(self, payload: str) -> str:
+        digest = hmac.new(self.__secret, payload.encode("utf-8"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+    @staticmethod
+    def get_cookie(headers: Headers, name: str) -> T.Optional[str]:
+        for cookie_header in headers.getlist("cookie"):
+            for chunk in cookie_header.split(";"):
+                key, _, value = chunk.strip().partition("=")
+                if key == name:
+                    return value
+        return None
+
+    @staticmethod
+    def parse_basic_credentials(authorization: T.Optional[str]) -> T.Optional[T.Tuple[str, str]]:
+        if not authorization:
+            return None
+        scheme, _, param = authorization.partition(" ")
+        if scheme.lower() != "basic":
+            return None
+        try:
+            decoded = base64.b64decode(param, validate=True).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        username, separator, password = decoded.partition(":")
+        if not separator:
+            return None
+        return username, password
@@ -0,0 +1,171 @@
+import threading
+import time
+import typing as T
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_FRAGMENT_MAX_ENTRIES = 16
+DEFAULT_LOOKUP_TTL_SECONDS = 60.0
+DEFAULT_LOOKUP_MAX_ENTRIES = 1024
+
+# Tags used to invalidate groups of cached pages
+LISTING_TAG = "listing"
+ALL_TAG = "all"
+SIDEBAR_TAG = "sidebar"
+
+
+def category_tag(category_name: T.Optional[str]) -> str:
+    """Tag for the pages listing a single category."""
+    return f"category:{category_name}"
+
+
+def list_tag(list_id: int) -> str:
+    """Tag for the pages listing a single article list."""
+    return f"list:{list_id}"
+
+
+class PageCache:
+    """Bounded LRU cache of rendered pages, invalidated by tag.
+
+    Entries are keyed by any hashable key (typically route, category, list and page)
+    and carry a set of tags so writers can drop only the pages they affect.
+
+    Pages are rendered outside the lock, so every invalidation bumps the version of its tags; a page
+    whose tags' version moved since it was taken, before reading what it shows, may be stale and isn't stored.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries: "OrderedDict[T.Hashable, T.Tuple[bytes, T.FrozenSet[str]]]" = OrderedDict()
+        self.__versions: T.Dict[str, int] = {}
+        self.__generation = 0
+        self.__lock = threading.Lock()
+
+    def __version(self, tags: T.Iterable[str]) -> T.Tuple[int, ...]:
+        return (self.__generation, *(self.__versions.get(tag, 0) for tag in sorted(set(tags))))
+
+    def version(self, tags: T.Iterable[str]) -> T.Tuple[int, ...]:
+        """Version of the given tags, to take before reading the data of a page stored with them."""
+        with self.__lock:
+            return self.__version(tags)
+
+    def get(self, key: T.Hashable) -> T.Optional[bytes]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(
+        self, key: T.Hashable, body: bytes, tags: T.Iterable[str], version: T.Optional[T.Tuple[int, ...]] = None
+    ) -> None:
+        """Store a page, unless one of its tags was invalidated since `version` was taken."""
+        if self.max_entries <= 0:
+            return
+        tags = frozenset(tags)
+        with self.__lock:
+            if version is not None and self.__version(tags) != version:
+                return
+            self.__entries[key] = (body, tags)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self, *tags: str) -> int:
+        """Drop every entry carrying at least one of the given tags. Returns the number dropped."""
+        wanted = set(tags)
+        with self.__lock:
+            for tag in wanted:
+                self.__versions[tag] = self.__versions.get(tag, 0) + 1
+            stale = [key for key, (_, entry_tags) in self.__entries.items() if entry_tags & wanted]
+            for key in stale:
+                del self.__entries[key]
+        return len(stale)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__generation += 1
+            self.__entries.clear()
+
+    def stats(self) -> T.Dict[str, T.Any]:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.__entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class LookupCache:
+    """Bounded LRU cache of near-static rows (the bookmark list, categories, feeds) by lookup key, with a TTL.
+
+    Holds detached copies that `quickfeed.api` merges into the caller's session without a query. Writes to the rows
+    invalidate their keys; the TTL bounds how long a row changed by another process can be served.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_LOOKUP_TTL_SECONDS, max_entries: int = DEFAULT_LOOKUP_MAX_ENTRIES) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries: "OrderedDict[T.Hashable, T.Tuple[T.Any, float]]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: T.Hashable) -> T.Optional[T.Any]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: T.Hashable, value: T.Any) -> None:
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        with self.__lock:
+            self.__entries[key] = (value, time.monotonic() + self.ttl)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self, *keys: T.Hashable) -> None:
+        with self.__lock:
+            for key in keys:
+                self.__entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self) -> T.Dict[str, T.Any]:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.__entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+page_cache = PageCache()
+fragment_cache = PageCache(max_entries=DEFAULT_FRAGMENT_MAX_ENTRIES)
+lookup_cache = LookupCache()
+
+
+def invalidate_feeds_and_categories() -> None:
+    """Drop everything rendered from the feed/category tree, i.e. every page through the sidebar."""
+    fragment_cache.clear()
+    page_cache.clear()
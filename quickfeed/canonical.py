@@ -0,0 +1,68 @@
+"""
+Canonical article URLs.
+
+The same story often arrives through several feeds with slightly different links (tracking parameters,
+http vs https, a trailing slash...). `canonicalize_url` reduces a link to a normal form and `url_hash`
+gives the short digest stored in `article.canonical_url_hash` to find duplicates with an index lookup.
+Links that aren't http(s) URLs (missing, relative, mailto:...) don't identify a story and get no hash.
+"""
+
+import hashlib
+import typing as T
+import urllib.parse
+
+TRACKING_PARAMETER_PREFIXES = ("utm_", "mc_", "_hs", "pk_", "mtm_")
+TRACKING_PARAMETERS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "twclid", "_ga", "_gl",
+    "ref", "ref_src", "ref_url", "referrer", "cmpid", "spm", "s_cid", "wt.mc_id", "ocid",
+}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def is_tracking_parameter(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMETERS or name.startswith(TRACKING_PARAMETER_PREFIXES)
+
+
+def canonicalize_url(url: str) -> T.Optional[str]:
+    """Reduce a link to a normal form shared by its trivially different variants, None if it isn't a web link."""
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return None
+
+    host = (parts.hostname or "").lower().rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    if not host:
+        return None
+    try:
+        port = parts.port
+    except ValueError:  # Malformed port
+        return None
+    netloc = host if port in (None, DEFAULT_PORTS[scheme]) else f"{host}:{port}"
+
+    path = urllib.parse.quote(urllib.parse.unquote(parts.path), safe="/:@!$&'()*+,;=-._~%")
+    while "//" in path:
+        path = path.replace("//", "/")
+    if path.endswith("/"):
+        path = path.rstrip("/")
+    for index_page in ("/index.html", "/index.htm", "/index.php"):
+        if path.endswith(index_page):
+            path = path[:-len(index_page)]
+
+    query = sorted(
+        (name, value)
+        for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_parameter(name)
+    )
+    # http and https variants of a link are the same story
+    return urllib.parse.urlunsplit(("https", netloc, path or "/", urllib.parse.urlencode(query), ""))
+
+
+def url_hash(url: str) -> T.Optional[str]:
+    """Digest of the canonical form of a link, None if it isn't a web link."""
+    canonical_url = canonicalize_url(url)
+    if canonical_url is None:
+        return None
+    return hashlib.sha1(canonical_url.encode("utf-8")).hexdigest()
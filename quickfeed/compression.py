@@ -0,0 +1,131 @@
+import gzip
+import typing as T
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+GZIP = "gzip"
+BROTLI = "br"
+
+COMPRESSIBLE_MEDIA_TYPES = (
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/xml",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def available_encodings() -> T.List[str]:
+    """Content encodings we can produce, best first."""
+    if brotli is not None:
+        return [BROTLI, GZIP]
+    return [GZIP]
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == BROTLI:
+        return brotli.compress(body)
+    if encoding == GZIP:
+        # mtime=0 keeps the output deterministic for identical bodies
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def negotiate(accept_encoding: T.Optional[str], encodings: T.Iterable[str]) -> T.Optional[str]:
+    """Pick the first of our encodings the client accepts, or None for identity.
+
+    An encoding listed by name takes its own quality, so `gzip;q=0` refuses gzip even alongside `*`."""
+    if not accept_encoding:
+        return None
+    qualities: T.Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        key, _, value = params.strip().partition("=")
+        if key.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+    for encoding in encodings:
+        if qualities.get(encoding, qualities.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(media_type: T.Optional[str]) -> bool:
+    if not media_type:
+        return False
+    return media_type.split(";")[0].strip().lower() in COMPRESSIBLE_MEDIA_TYPES
+
+
+class CompressionMiddleware:
+    """Compress complete text responses with the best encoding the client accepts.
+
+    Only responses sent as a single body message are compressed. Streaming responses
+    (e.g. /reload_feed) are forwarded untouched so they keep flushing incrementally.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 512) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"), available_encodings())
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: T.Optional[Message] = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or not is_compressible(headers.get("content-type")):
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # Streaming or tiny response, send as is
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,116 @@
+"""
+Server-sent events for pages that stay open.
+
+`EventBroker` fans events out to the browsers connected to `/events`. Publishers (the feed update job,
+which runs in a scheduler thread) hand an event to the event loop once; it is encoded once and put on
+every subscriber's queue. Idle connections just wait on their queue, with a keep-alive comment now and
+then so proxies don't drop them, so hundreds of them cost no more than their sockets.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import threading
+import typing as T
+
+logger = logging.getLogger(__name__)
+
+# Events a subscriber can fall behind by before it misses some
+SUBSCRIBER_QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 25
+# How long browsers wait before reconnecting after the stream ends
+RETRY_MILLISECONDS = 5000
+# Articles announced by this process that are remembered, so they are never announced twice
+PUBLISHED_IDS_KEPT = 10000
+
+
+def encode_event(event: str, data: T.Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8")
+
+
+class EventBroker:
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE) -> None:
+        self.queue_size = queue_size
+        self.loop: T.Optional[asyncio.AbstractEventLoop] = None
+        self.subscribers: T.Set[asyncio.Queue] = set()
+
+    def publish(self, event: str, data: T.Any) -> None:
+        """Send an event to every subscriber. Safe to call from any thread."""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return  # Nobody ever subscribed in this process
+        message = encode_event(event, data)
+        try:
+            loop.call_soon_threadsafe(self.broadcast, message)
+        except RuntimeError:  # The loop closed in the meantime
+            pass
+
+    def broadcast(self, message: T.Optional[bytes]) -> None:
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.debug("Dropping event for a slow subscriber")
+
+    async def subscribe(self) -> T.AsyncIterator[bytes]:
+        """Yield encoded events, and keep-alive comments while there are none, until the broker closes."""
+        self.loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n".encode("utf-8")
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.subscribers.discard(queue)
+
+    def close(self) -> None:
+        """End every subscription, e.g. at shutdown. Must be called from the event loop."""
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()  # Make room, the subscriber is going away anyway
+            queue.put_nowait(None)
+
+
+class PublishedIds:
+    """The IDs of the latest articles announced, up to a number of them."""
+
+    def __init__(self, size: int = PUBLISHED_IDS_KEPT) -> None:
+        self.size = size
+        self.__ids: T.Set[int] = set()
+        self.__order: T.Deque[int] = collections.deque()
+        self.__lock = threading.Lock()
+
+    def claim(self, article_ids: T.Iterable[int]) -> T.Set[int]:
+        """Remember the articles as announced. Returns those that weren't already."""
+        with self.__lock:
+            claimed = {article_id for article_id in article_ids if article_id not in self.__ids}
+            self.__ids.update(claimed)
+            self.__order.extend(claimed)
+            while len(self.__order) > self.size:
+                self.__ids.discard(self.__order.popleft())
+            return claimed
+
+
+broker = EventBroker()
+published_ids = PublishedIds()
+
+
+def publish_new_articles(feed_id: int, articles: T.List[T.Dict[str, T.Any]]) -> None:
+    """Announce articles just added to a feed, as the rows a listing page shows.
+
+    Both this process's ingest and the watcher of changes made elsewhere announce the articles they see, so
+    articles already announced are left out."""
+    claimed = published_ids.claim(article["id"] for article in articles)
+    articles = [article for article in articles if article["id"] in claimed]
+    if articles:
+        broker.publish("articles", {"feed_id": feed_id, "articles": articles})
@@ -0,0 +1,117 @@
+"""
+Incremental RSS/Atom parsing.
+
+`iter_entries` feeds a document to an XML pull parser chunk by chunk and yields each entry as soon as
+its closing tag is seen, then drops it. Callers that stop iterating early (e.g. once they reach entries
+they already know) never read or parse the rest of the document, so memory and CPU depend on the number
+of entries consumed rather than on the size of the feed.
+
+Each entry is handed to feedparser on its own, inside empty copies of the elements it was nested in, so
+it is sanitized, has its relative links resolved against the inherited xml:base and its dates parsed
+exactly as `feedparser.parse` would do for the whole document.
+"""
+
+import time
+import typing as T
+import xml.etree.ElementTree as ET
+
+import feedparser
+
+CHUNK_SIZE = 16 * 1024
+
+ENTRY_TAGS = {"item", "entry"}
+
+
+class FeedStreamError(Exception):
+    """The document isn't well-formed XML and should be parsed by feedparser instead."""
+
+
+def local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_entry(
+    element: ET.Element, ancestors: T.List[ET.Element], base_url: T.Optional[str]
+) -> feedparser.FeedParserDict:
+    """Parse an entry element with feedparser, as part of a document made of its ancestors alone."""
+    root = parent = ET.Element(ancestors[0].tag, ancestors[0].attrib)
+    for ancestor in ancestors[1:]:
+        parent = ET.SubElement(parent, ancestor.tag, ancestor.attrib)
+    parent.append(element)
+    headers = {"content-type": "application/xml"}
+    if base_url:
+        headers["content-location"] = base_url
+    parsed = feedparser.parse(ET.tostring(root, encoding="utf-8"), response_headers=headers)
+    if not parsed.entries:
+        return feedparser.FeedParserDict()
+    return parsed.entries[0]
+
+
+def iter_entries(
+    chunks: T.Iterable[bytes], base_url: T.Optional[str] = None
+) -> T.Iterator[feedparser.FeedParserDict]:
+    """Yield the entries of an RSS/Atom document read from an iterable of byte chunks.
+
+    Relative links are resolved against the document's URL, `base_url`, unless an xml:base says otherwise."""
+    parser = ET.XMLPullParser(events=("start", "end"))
+    # The elements enclosing the current one, outside of entries
+    ancestors: T.List[ET.Element] = []
+    depth = 0
+    entry_depth = None
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == "start":
+                    depth += 1
+                    if entry_depth is None and local_name(element.tag) in ENTRY_TAGS:
+                        entry_depth = depth
+                    elif entry_depth is None:
+                        ancestors.append(element)
+                    continue
+                if depth == entry_depth:
+                    entry_depth = None
+                    yield parse_entry(element, ancestors, base_url)
+                    element.clear()
+                elif entry_depth is None:
+                    # Drop channel level elements as we go too
+                    ancestors.pop()
+                    element.clear()
+                depth -= 1
+        parser.close()
+    except ET.ParseError as ex:
+        raise FeedStreamError(str(ex)) from ex
+
+
+class RecordedChunks:
+    """Iterates over the chunks of a download, keeping a copy of them and the time spent waiting for them."""
+
+    def __init__(self, chunks: T.Iterable[bytes]) -> None:
+        self.chunks = iter(chunks)
+        self.data = bytearray()
+        self.receive_seconds = 0.0
+
+    def __iter__(self) -> "RecordedChunks":
+        return self
+
+    def __next__(self) -> bytes:
+        started = time.perf_counter()
+        try:
+            chunk = next(self.chunks)
+        finally:
+            self.receive_seconds += time.perf_counter() - started
+        self.data.extend(chunk)
+        return chunk
+
+    def drain(self) -> None:
+        """Download and keep the remaining chunks."""
+        for _ in self:
+            pass
+
+
+def iter_response_chunks(response: T.BinaryIO, chunk_size: int = CHUNK_SIZE) -> T.Iterator[bytes]:
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,189 @@
+"""
+Shared HTTP client for fetching feeds.
+
+All fetches go through one keep-alive connection pool, so feeds sharing a host reuse connections
+instead of paying a new TCP and TLS handshake each time. Requests to a host are capped in concurrency
+and spaced out by a minimum interval, and a host that answers 429/503 is left alone for as long as its
+Retry-After header asks: short waits are slept through and the request retried, longer ones skip the fetch.
+
+A request holds one of its host's slots until its body is downloaded, not while the caller parses it.
+"""
+
+import email.utils
+import logging
+import threading
+import time
+import typing as T
+import urllib.parse
+from contextlib import contextmanager
+
+if T.TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_CONNECTIONS = 50
+DEFAULT_PER_HOST_CONCURRENCY = 2
+DEFAULT_PER_HOST_INTERVAL = 1.0
+DEFAULT_RETRY_AFTER = 60.0
+# Longest Retry-After we wait out in place; longer ones skip the fetch
+MAX_RETRY_WAIT = 30.0
+# Times a request is retried after waiting out a 429/503
+MAX_THROTTLED_RETRIES = 2
+
+
+class HostThrottled(Exception):
+    """The host asked us to back off for longer than we are willing to wait, or kept asking."""
+
+
+class HostState:
+
+    def __init__(self, concurrency: int) -> None:
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.next_request_at = 0.0
+        self.blocked_until = 0.0
+
+
+class HostSlot:
+    """One of a host's concurrent request slots, released at most once."""
+
+    def __init__(self, semaphore: threading.BoundedSemaphore) -> None:
+        self.__semaphore = semaphore
+        self.__lock = threading.Lock()
+        self.__held = False
+
+    def __enter__(self) -> "HostSlot":
+        self.__semaphore.acquire()
+        self.__held = True
+        return self
+
+    def __exit__(self, *exc_info: T.Any) -> None:
+        self.release()
+
+    def release(self) -> None:
+        with self.__lock:
+            if not self.__held:
+                return
+            self.__held = False
+        self.__semaphore.release()
+
+
+def parse_retry_after(value: T.Optional[str], default: float = DEFAULT_RETRY_AFTER) -> float:
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return default
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class FeedFetcher:  # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        per_host_concurrency: int = DEFAULT_PER_HOST_CONCURRENCY,
+        per_host_interval: float = DEFAULT_PER_HOST_INTERVAL
+    ) -> None:
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_interval = per_host_interval
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # Created on the first fetch: web processes that never fetch don't import httpx or load certificates
+        self.__client: T.Optional["httpx.Client"] = None
+        self.__client_lock = threading.Lock()
+        self.__hosts: T.Dict[str, HostState] = {}
+        self.__hosts_lock = threading.Lock()
+
+    def client(self) -> "httpx.Client":
+        with self.__client_lock:
+            if self.__client is None:
+                # pylint: disable=import-outside-toplevel
+                import feedparser
+                import httpx
+                self.__client = httpx.Client(
+                    timeout=self.timeout,
+                    follow_redirects=True,
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                    headers={"User-Agent": feedparser.USER_AGENT},
+                )
+            return self.__client
+
+    def host_state(self, url: str) -> HostState:
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self.__hosts_lock:
+            if host not in self.__hosts:
+                self.__hosts[host] = HostState(self.per_host_concurrency)
+            return self.__hosts[host]
+
+    def wait_for_turn(self, state: HostState) -> None:
+        """Block until the host's rate limit and back off allow another request."""
+        with state.lock:
+            now = time.monotonic()
+            if state.blocked_until - now > MAX_RETRY_WAIT:
+                raise HostThrottled(f"Host is throttling us for another {state.blocked_until - now:.0f}s")
+            start_at = max(now, state.next_request_at, state.blocked_until)
+            state.next_request_at = start_at + self.per_host_interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    @contextmanager
+    def stream(self, url: str, headers: T.Optional[T.Dict[str, str]] = None) -> T.Iterator["httpx.Response"]:
+        """Open a streaming GET for a URL, respecting the per-host limits.
+
+        A 429/503 asking to retry within MAX_RETRY_WAIT is waited out and the request sent again. Raises
+        HostThrottled if the host asks for longer, keeps answering 429/503 or is still backing off."""
+        state = self.host_state(url)
+        retries = 0
+        while True:
+            with HostSlot(state.semaphore) as slot:
+                self.wait_for_turn(state)
+                with self.client().stream("GET", url, headers=headers) as response:
+                    if response.status_code in (429, 503):
+                        retry_after = parse_retry_after(response.headers.get("retry-after"))
+                        with state.lock:
+                            state.blocked_until = max(state.blocked_until, time.monotonic() + retry_after)
+                        if retry_after > MAX_RETRY_WAIT or retries >= MAX_THROTTLED_RETRIES:
+                            raise HostThrottled(
+                                f"{url} answered {response.status_code}, retry after {retry_after:.0f}s")
+                        retries += 1
+                        logger.info("%s answered %d, retrying in %.0fs", url, response.status_code, retry_after)
+                        continue  # wait_for_turn sleeps until the host is unblocked
+                    # httpx closes a streamed response once its body is read to the end, and again on leaving
+                    # client.stream: the first of the two frees the host's slot
+                    close = response.close
+
+                    def close_and_release() -> None:
+                        try:
+                            close()
+                        finally:
+                            slot.release()
+
+                    response.close = close_and_release  # type: ignore[method-assign]
+                    yield response
+                    return
+
+    def close(self) -> None:
+        with self.__client_lock:
+            if self.__client is not None:
+                self.__client.close()
+                self.__client = None
+
+
+feed_fetcher = FeedFetcher()
+
+
+def configure(**settings: T.Any) -> None:
+    """Replace the shared fetcher, e.g. with settings from the "http_client" config entry."""
+    global feed_fetcher  # pylint: disable=global-statement
+    previous = feed_fetcher
+    feed_fetcher = FeedFetcher(**settings)
+    previous.close()
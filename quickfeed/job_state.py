@@ -0,0 +1,179 @@
+"""
+What the background jobs share through the database: leases, so only one process runs a job at a time, the
+record of job runs, and the queue of feeds to fetch.
+"""
+
+import datetime
+import typing as T
+
+from sqlalchemy import and_, delete, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from quickfeed import models, tracing
+
+
+# Lease functions
+
+def acquire_lease(db: Session, name: str, owner: str, duration: datetime.timedelta) -> bool:
+    """Acquire or renew a named lease. Returns False while another owner holds an unexpired lease.
+
+    Commits immediately so other processes see the new holder."""
+    now = datetime.datetime.now()
+    stmt = update(models.Lease).filter(
+        models.Lease.name == name).filter(
+            or_(models.Lease.owner == owner, models.Lease.expires_at < now)).values(
+                owner=owner, expires_at=now + duration)
+    if db.execute(stmt).rowcount == 1:
+        db.commit()
+        return True
+    if db.get(models.Lease, name) is not None:
+        db.rollback()
+        return False
+    db.add(models.Lease(name=name, owner=owner, expires_at=now + duration))
+    try:
+        db.commit()
+    except IntegrityError:  # Another process created it first
+        db.rollback()
+        return False
+    return True
+
+
+def release_lease(db: Session, name: str, owner: str) -> None:
+    """Release a named lease if it is held by the given owner."""
+    stmt = update(models.Lease).filter(
+        models.Lease.name == name).filter(
+            models.Lease.owner == owner).values(expires_at=datetime.datetime.now())
+    db.execute(stmt)
+    db.commit()
+
+
+# Job run functions
+
+def start_job_run(
+    db: Session, name: str, trigger: str, owner: str, status: str = models.JobRun.RUNNING
+) -> models.JobRun:
+    """Record the start of a job run, or a skipped one."""
+    now = datetime.datetime.now()
+    job_run = models.JobRun(
+        name=name, trigger=trigger, owner=owner, status=status, started_at=now,
+        finished_at=now if status == models.JobRun.SKIPPED else None
+    )
+    db.add(job_run)
+    db.flush()  # Explicitly flush to make sure the job run is persisted
+    return job_run
+
+
+def update_job_run(db: Session, job_run_id: int, **values: T.Any) -> None:
+    """Update the progress or outcome of a job run."""
+    db.execute(update(models.JobRun).filter(models.JobRun.id == job_run_id).values(**values))
+
+
+def fail_abandoned_job_runs(db: Session, name: str) -> int:
+    """Mark runs of a job still recorded as running as failed, e.g. once their process died and the run
+    lease expired. Returns the number of runs marked."""
+    stmt = update(models.JobRun).filter(models.JobRun.name == name).filter(
+        models.JobRun.status == models.JobRun.RUNNING).values(
+            status=models.JobRun.FAILED, finished_at=datetime.datetime.now(), error="Abandoned")
+    return db.execute(stmt).rowcount
+
+
+def delete_old_job_runs(db: Session, started_before: datetime.datetime) -> int:
+    """Delete job runs started before a time. Returns the number deleted."""
+    stmt = delete(models.JobRun).filter(models.JobRun.started_at < started_before)
+    return db.execute(stmt).rowcount
+
+
+async def get_job_runs_async(db: AsyncSession, limit: int) -> T.List[models.JobRun]:
+    """Get the latest job runs, newest first."""
+    stmt = select(models.JobRun).order_by(models.JobRun.id.desc()).limit(limit)
+    return list((await db.scalars(stmt)).all())  # Convert Sequence to List
+
+
+# Fetch queue functions
+
+def enqueue_due_feeds(db: Session, due_before: datetime.datetime) -> int:
+    """Queue a fetch job for every feed last updated before the given time that isn't already queued.
+
+    Returns the number of jobs queued."""
+    active_jobs = select(models.FetchJob.feed_id).filter(
+        models.FetchJob.status.in_([models.FetchJob.PENDING, models.FetchJob.RUNNING]))
+    due_feeds = select(
+        models.Feed.id,
+        literal(models.FetchJob.PENDING),
+        literal(0),
+        literal(datetime.datetime.now())).filter(
+            or_(models.Feed.feed_last_updated.is_(None), models.Feed.feed_last_updated < due_before)).filter(
+                models.Feed.id.not_in(active_jobs))
+    stmt = insert(models.FetchJob).from_select(
+        ["feed_id", "status", "attempts", "enqueued_at"], due_feeds)
+    return db.execute(stmt).rowcount
+
+
+def fail_exhausted_fetch_jobs(db: Session, max_attempts: int) -> int:
+    """Mark running jobs whose lease expired after their last allowed attempt as failed."""
+    now = datetime.datetime.now()
+    stmt = update(models.FetchJob).filter(
+        models.FetchJob.status == models.FetchJob.RUNNING).filter(
+            models.FetchJob.lease_expires_at < now).filter(
+                models.FetchJob.attempts >= max_attempts).values(
+                    status=models.FetchJob.FAILED, finished_at=now, error="Lease expired")
+    return db.execute(stmt).rowcount
+
+
+def claim_fetch_job(
+    db: Session, owner: str, lease_duration: datetime.timedelta, max_attempts: int
+) -> T.Optional[models.FetchJob]:
+    """Claim the oldest pending job, or a running one whose lease expired with attempts left, for the given owner.
+
+    Claims are a conditional UPDATE so concurrent fetchers never get the same job. Commits immediately."""
+    now = datetime.datetime.now()
+    claimable = or_(
+        models.FetchJob.status == models.FetchJob.PENDING,
+        and_(
+            models.FetchJob.status == models.FetchJob.RUNNING,
+            models.FetchJob.lease_expires_at < now,
+            models.FetchJob.attempts < max_attempts
+        )
+    )
+    candidates_stmt = select(models.FetchJob.id).filter(claimable).order_by(models.FetchJob.enqueued_at).limit(5)
+    for job_id in db.scalars(candidates_stmt).all():
+        stmt = update(models.FetchJob).filter(models.FetchJob.id == job_id).filter(claimable).values(
+            status=models.FetchJob.RUNNING,
+            lease_owner=owner,
+            lease_expires_at=now + lease_duration,
+            attempts=models.FetchJob.attempts + 1,
+            started_at=now
+        )
+        if db.execute(stmt).rowcount == 1:
+            db.commit()
+            return db.get(models.FetchJob, job_id)
+    db.rollback()
+    return None
+
+
+def finish_fetch_job(db: Session, job_id: int, owner: str, articles_inserted: int, error: T.Optional[str]) -> bool:
+    """Record the outcome of a claimed job. Returns False if the lease was lost to another fetcher."""
+    now = datetime.datetime.now()
+    job = db.get(models.FetchJob, job_id)
+    if job is None or job.lease_owner != owner or job.status != models.FetchJob.RUNNING:
+        return False
+    job.status = models.FetchJob.FAILED if error else models.FetchJob.DONE
+    job.finished_at = now
+    job.duration_ms = int((now - job.started_at).total_seconds() * 1000)
+    job.articles_inserted = articles_inserted
+    job.error = error
+    return True
+
+
+def delete_finished_fetch_jobs(db: Session, finished_before: datetime.datetime) -> int:
+    """Delete done and failed jobs that finished before the given time."""
+    stmt = delete(models.FetchJob).filter(
+        models.FetchJob.status.in_([models.FetchJob.DONE, models.FetchJob.FAILED])).filter(
+            models.FetchJob.finished_at < finished_before)
+    return db.execute(stmt).rowcount
+
+
+# Every function above gets a span when called within a sampled trace, see quickfeed.tracing
+tracing.instrument(globals())
@@ -1,12 +1,31 @@
 import datetime
 import logging
+import os
+import socket
+import threading
+import time
 import typing as T
+import uuid
 
 from sqlalchemy.orm import Session
 
-from quickfeed import api
+from quickfeed import api, article_listing, cache, change_log, events, job_state, models, timeline, tracing, writer
 
 logger = logging.getLogger(__name__)
+tracer = tracing.get_tracer(__name__)
+
+DEFAULT_FETCH_INTERVAL = datetime.timedelta(minutes=5)
+DEFAULT_FETCH_LEASE = datetime.timedelta(minutes=5)
+FETCH_JOB_RETENTION = datetime.timedelta(days=7)
+MAX_FETCH_ATTEMPTS = 3
+KNOWN_ENTRIES_BEFORE_STOP = 5
+UPDATE_FEEDS_RUN_LEASE = "update_feeds_run"
+# Renewed while the run makes progress, so it only runs out if the process died
+RUN_LEASE_DURATION = datetime.timedelta(minutes=10)
+JOB_RUN_RETENTION = datetime.timedelta(days=30)
+MAX_RECORDED_ERRORS = 20
+# Articles inserted by other processes that the watcher announces per check
+INSERTED_ARTICLES_LIMIT = 500
 
 
 def entrypoint(session_maker: T.Generator[Session, None, None], func: T.Callable[[Session], T.Iterator[str]]):
@@ -18,28 +37,322 @@ def entrypoint(session_maker: T.Generator[Session, None, None], func: T.Callable
     logger.debug("Done job: %s", func.__name__)
 
 
-def update_feeds(session: Session):
-    yield "Updating all feeds"
-    for feed in api.get_feeds(session):
-        yield feed.site_url
-        feed_data = api.get_feed_data(feed.feed_url)
-        for entry in feed_data.entries:
-            if not hasattr(entry, 'id'):
-                article_id = entry.link
-            else:
-                article_id = entry.id
-            if not api.get_article(session, feed.id, article_id):
-                date = entry.published_parsed[:6]
-                api.add_article(
-                    session,
-                    feed.id,
-                    article_id,
-                    entry.title,
-                    entry.link,
-                    entry.description if hasattr(entry, 'description') else '',
-                    datetime.datetime(*date),
-                    datetime.datetime.now()
-                )
-        yield "Done"
-        feed.feed_last_updated = datetime.datetime.now()
+def process_owner_id() -> str:
+    """Identify this process as a lease owner."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def leased_entrypoint(
+    session_maker: T.Callable[[], T.ContextManager[Session]],
+    func: T.Callable[[Session], T.Iterator[str]],
+    owner: str,
+    lease_duration: datetime.timedelta
+) -> None:
+    """Run a job only while holding its DB lease, so a single scheduler is active across processes.
+
+    The lease is kept after the run and renewed on the next one, which keeps the same scheduler active
+    until it stops. Long runs renew it as they make progress."""
+    with session_maker() as session:
+        if not job_state.acquire_lease(session, func.__name__, owner, lease_duration):
+            logger.debug("Skipping job %s, lease held by another scheduler", func.__name__)
+            return
+
+    logger.debug("Starting job: %s", func.__name__)
+    renew_interval = lease_duration.total_seconds() / 3
+    renew_at = time.monotonic() + renew_interval
+    with session_maker() as session:
+        for _ in func(session):
+            if time.monotonic() < renew_at:
+                continue
+            with session_maker() as lease_session:
+                if not job_state.acquire_lease(lease_session, func.__name__, owner, lease_duration):
+                    logger.warning("Lost lease for job %s, stopping", func.__name__)
+                    return
+            renew_at = time.monotonic() + renew_interval
+    logger.debug("Done job: %s", func.__name__)
+
+
+def release_lease(session_maker: T.Callable[[], T.ContextManager[Session]], name: str, owner: str) -> None:
+    with session_maker() as session:
+        job_state.release_lease(session, name, owner)
+
+
+class ExternalUpdateWatcher:
+    """Drop cached pages when feeds or categories were changed by another process (e.g. the fetch worker),
+    or when the change log moved, e.g. an article was read or bookmarked through another web worker.
+
+    Articles added by other processes are announced to this process's event subscribers and added to its
+    timelines too. Those this process inserted itself were handled when they were inserted, and are skipped.
+
+    Any other change to feeds or categories discards the timelines and the cached lookups."""
+
+    def __init__(self, session_maker: T.Callable[[], T.ContextManager[Session]]) -> None:
+        self.session_maker = session_maker
+        self.signature: T.Optional[T.Tuple[T.Any, ...]] = None
+        self.last_change_seq: T.Optional[int] = None
+
+    def __call__(self) -> None:
+        with self.session_maker() as session:
+            signature = api.get_feeds_and_categories_signature(session)
+            last_change_seq = change_log.get_last_change_seq(session)
+            if self.last_change_seq is not None and last_change_seq != self.last_change_seq:
+                self.publish_new_articles(session, self.last_change_seq, last_change_seq)
+        if self.signature is not None and signature != self.signature:
+            cache.invalidate_feeds_and_categories()
+            cache.lookup_cache.clear()
+            timeline.timelines.clear()
+        elif self.last_change_seq is not None and last_change_seq != self.last_change_seq:
+            cache.page_cache.invalidate(cache.LISTING_TAG)
+        self.signature = signature
+        self.last_change_seq = last_change_seq
+
+    @staticmethod
+    def publish_new_articles(session: Session, after_seq: int, up_to_seq: int) -> None:
+        rows_by_feed: T.Dict[int, T.List[T.Dict[str, T.Any]]] = {}
+        articles = change_log.get_inserted_articles(session, after_seq, up_to_seq, limit=INSERTED_ARTICLES_LIMIT)
+        if len(articles) == INSERTED_ARTICLES_LIMIT:
+            timeline.timelines.clear()  # Too many to follow, rebuild them
+        for article in articles:
+            category_name = article.feed.category.name if article.feed.category else None
+            timeline.timelines.add(
+                category_name, article.id, article.feed_id, article.published_at, *timeline_listed_in(session, article))
+            if article.canonical_id is None:
+                rows_by_feed.setdefault(article.feed_id, []).append(
+                    listing_event_row(article, article.feed.title, category_name))
+        for feed_id, rows in rows_by_feed.items():
+            events.publish_new_articles(feed_id, rows)
+
+
+def listing_event_row(article: models.Article, feed_title: str, category_name: T.Optional[str]) -> T.Dict[str, T.Any]:
+    """The fields of a listing page row, for the new articles event."""
+    return {
+        "id": article.id,
+        "title": article.title,
+        "link": article.link,
+        "published_at": article.published_at.strftime('%Y-%m-%d'),
+        "feed_id": article.feed_id,
+        "feed_name": feed_title,
+        "category": category_name,
+    }
+
+
+def update_feed(session: Session, feed: models.Feed) -> int:
+    """Fetch a feed, insert its new articles and commit. Returns the number of articles inserted.
+
+    The whole feed is read before anything is written, and its articles are then inserted as one unit of work
+    of the write queue, so the write lock is never held while waiting on the network."""
+    with tracer.start_as_current_span("update_feed", {"feed.id": feed.id, "feed.url": feed.feed_url}) as span:
+        with tracer.start_as_current_span("update_feed.fetch") as fetch_span:
+            new_entries = read_new_entries(session, feed)
+            fetch_span.set_attribute("entries.new", len(new_entries))
+        feed_id = feed.id
+        feed_title = feed.title
+        category_name = feed.category.name if feed.category else None
+        # Set by stream_feed_entries on this session's copy of the feed
+        http_etag = feed.http_etag
+        http_last_modified = feed.http_last_modified
+
+        def insert_articles(write_session: Session) -> T.Tuple[list, list]:
+            added_rows = []
+            timeline_rows = []
+            written_feed = write_session.get(models.Feed, feed_id)
+            if written_feed is None:
+                return added_rows, timeline_rows  # Deleted while it was being fetched
+            for unique_id, title, link, description, published_at in new_entries:
+                article = api.add_article(
+                    write_session, feed_id, unique_id, title, link, description, published_at,
+                    datetime.datetime.now())
+                if article.canonical_id is None:
+                    added_rows.append(listing_event_row(article, feed_title, category_name))
+                timeline_rows.append((article.id, article.published_at, *timeline_listed_in(write_session, article)))
+            written_feed.feed_last_updated = datetime.datetime.now()
+            written_feed.http_etag = http_etag
+            written_feed.http_last_modified = http_last_modified
+            return added_rows, timeline_rows
+
+        with tracer.start_as_current_span("update_feed.insert"):
+            added_rows, timeline_rows = writer.write_queue.run(session, insert_articles)
+        if timeline_rows:
+            with tracer.start_as_current_span("update_feed.publish"):
+                publish_new_articles(feed_id, category_name, added_rows, timeline_rows)
+        span.set_attribute("articles.inserted", len(timeline_rows))
+        return len(timeline_rows)
+
+
+def publish_new_articles(
+    feed_id: int, category_name: T.Optional[str], added_rows: list, timeline_rows: list
+) -> None:
+    """Make a feed's newly inserted articles visible: timelines, cached pages and event subscribers."""
+    for article_id, published_at, in_all, in_category in timeline_rows:
+        timeline.timelines.add(category_name, article_id, feed_id, published_at, in_all, in_category)
+    cache.page_cache.invalidate(cache.ALL_TAG, cache.category_tag(category_name))
+    events.publish_new_articles(feed_id, added_rows)
+
+
+def read_new_entries(
+    session: Session, feed: models.Feed
+) -> T.List[T.Tuple[str, str, str, str, datetime.datetime]]:
+    """Download and parse a feed, up to the entries already stored. Returns the fields of the new ones."""
+    new_entries = []
+    seen_ids: T.Set[str] = set()
+    known_in_a_row = 0
+    entries = api.stream_feed_entries(feed)
+    for entry in entries:
+        if not hasattr(entry, 'id'):
+            article_id = entry.link
+        else:
+            article_id = entry.id
+        if article_id in seen_ids or api.get_article(session, feed.id, article_id):
+            # Feeds list newest entries first, so a run of known ones means the rest are known too
+            known_in_a_row += 1
+            if known_in_a_row >= KNOWN_ENTRIES_BEFORE_STOP:
+                break
+        else:
+            known_in_a_row = 0
+            seen_ids.add(article_id)
+            date = entry.published_parsed[:6]
+            new_entries.append((
+                article_id,
+                entry.title,
+                entry.link,
+                entry.description if hasattr(entry, 'description') else '',
+                datetime.datetime(*date)
+            ))
+    entries.close()
+    return new_entries
+
+
+def timeline_listed_in(session: Session, article: models.Article) -> T.Tuple[bool, bool]:
+    """Whether an article is listed in All and in its feed's category, see `article_listing.unique_listing_filter`."""
+    if article.canonical_id is None:
+        return True, True
+    original = session.get(models.Article, article.canonical_id)
+    return False, original is None or original.feed.category_id != article.feed.category_id
+
+
+def update_feeds(session: Session, trigger: str = models.JobRun.SCHEDULED):
+    """Update every feed, one at a time, unless a run is already in progress in any process.
+
+    Scheduled and manual (/reload_feed) runs share a DB lease, so runs never overlap and fetch the same
+    feeds twice. Each run, or skipped run, is recorded in job_run.
+
+    Only feed IDs are kept across feeds: each feed is loaded on its own and everything it loaded is expunged
+    once it is committed, so the identity map and memory stay the size of one feed whatever their number.
+
+    Each feed is traced on its own (a span can't stay current across the yields of a generator resumed from
+    other threads, as /reload_feed does), as part of the request's trace for /reload_feed."""
+    owner = process_owner_id()
+    if not job_state.acquire_lease(session, UPDATE_FEEDS_RUN_LEASE, owner, RUN_LEASE_DURATION):
+        job_state.start_job_run(session, "update_feeds", trigger, owner, status=models.JobRun.SKIPPED)
         session.commit()
+        logger.info("Skipping %s feed update, another update is running", trigger)
+        yield "Feeds are already being updated"
+        return
+    job_state.fail_abandoned_job_runs(session, "update_feeds")
+    run_id = job_state.start_job_run(session, "update_feeds", trigger, owner).id
+    session.commit()
+
+    feeds_processed = 0
+    articles_inserted = 0
+    errors: T.List[str] = []
+    status = models.JobRun.FAILED
+    renew_at = time.monotonic() + RUN_LEASE_DURATION.total_seconds() / 3
+    try:
+        yield "Updating all feeds"
+        for feed_id in api.get_feed_ids(session):
+            feed = api.get_feed_by_id(session, feed_id)
+            if feed is None:
+                continue  # Deleted since the run started
+            yield feed.site_url
+            try:
+                articles_inserted += update_feed(session, feed)
+            except Exception as ex:  # pylint: disable=broad-except
+                session.rollback()
+                logger.warning("Updating feed %s failed: %s", feed_id, ex)
+                errors.append(f"Feed {feed_id}: {type(ex).__name__}: {ex}")
+            feeds_processed += 1
+            session.expunge_all()
+            if time.monotonic() >= renew_at:
+                job_state.acquire_lease(session, UPDATE_FEEDS_RUN_LEASE, owner, RUN_LEASE_DURATION)
+                renew_at = time.monotonic() + RUN_LEASE_DURATION.total_seconds() / 3
+            yield "Done"
+        with tracer.start_as_current_span("update_feeds.cleanup", {"job_run.id": run_id}):
+            change_log.compact_changes(session)
+            job_state.delete_old_job_runs(session, datetime.datetime.now() - JOB_RUN_RETENTION)
+            session.commit()
+        status = models.JobRun.DONE
+    except GeneratorExit:  # A /reload_feed client went away mid-run
+        errors.append("Interrupted")
+        raise
+    except Exception as ex:
+        errors.append(f"{type(ex).__name__}: {ex}")
+        raise
+    finally:
+        session.rollback()
+        job_state.update_job_run(
+            session,
+            run_id,
+            status=status,
+            finished_at=datetime.datetime.now(),
+            feeds_processed=feeds_processed,
+            articles_inserted=articles_inserted,
+            errors=len(errors),
+            error="\n".join(errors[:MAX_RECORDED_ERRORS]) or None
+        )
+        job_state.release_lease(session, UPDATE_FEEDS_RUN_LEASE, owner)
+    # Every listing page shows the last update time
+    cache.page_cache.invalidate(cache.LISTING_TAG)
+
+
+def enqueue_fetch_jobs(session: Session, fetch_interval: datetime.timedelta = DEFAULT_FETCH_INTERVAL):
+    """Queue fetch jobs for due feeds and prune old finished ones."""
+    yield "Enqueuing due feeds"
+    now = datetime.datetime.now()
+    job_state.fail_exhausted_fetch_jobs(session, MAX_FETCH_ATTEMPTS)
+    queued = job_state.enqueue_due_feeds(session, now - fetch_interval)
+    job_state.delete_finished_fetch_jobs(session, now - FETCH_JOB_RETENTION)
+    change_log.compact_changes(session)
+    session.commit()
+    yield f"Enqueued {queued} feeds"
+
+
+def run_fetch_job(session: Session, owner: str, lease_duration: datetime.timedelta) -> bool:
+    """Claim and run a single fetch job. Returns False when the queue is empty."""
+    job = job_state.claim_fetch_job(session, owner, lease_duration, MAX_FETCH_ATTEMPTS)
+    if job is None:
+        return False
+    job_id = job.id
+    feed_id = job.feed_id
+    articles_inserted = 0
+    error = None
+    try:
+        feed = job.feed
+        if feed is None:
+            raise LookupError(f"Feed {feed_id} no longer exists")
+        logger.debug("Fetching feed %s (job %s, attempt %s)", feed.feed_url, job_id, job.attempts)
+        articles_inserted = update_feed(session, feed)
+    except Exception as ex:  # pylint: disable=broad-except
+        session.rollback()
+        logger.warning("Fetching feed %s failed: %s", feed_id, ex)
+        error = f"{type(ex).__name__}: {ex}"
+    if not job_state.finish_fetch_job(session, job_id, owner, articles_inserted, error):
+        logger.warning("Lost lease on fetch job %s", job_id)
+    session.commit()
+    return True
+
+
+def run_fetcher(
+    session_maker: T.Callable[[], T.ContextManager[Session]],
+    owner: str,
+    lease_duration: datetime.timedelta = DEFAULT_FETCH_LEASE,
+    idle_sleep: float = 5.0,
+    stop: T.Optional[threading.Event] = None
+) -> None:
+    """Claim and run fetch jobs until stopped, sleeping while the queue is empty."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        # A session per job keeps the identity map from growing over the life of the fetcher
+        with session_maker() as session:
+            ran = run_fetch_job(session, owner, lease_duration)
+        if not ran:
+            stop.wait(idle_sleep)
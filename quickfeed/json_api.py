@@ -0,0 +1,226 @@
+"""
+Read-only JSON API under /api/v1, for scripts and clients that would otherwise scrape the HTML pages.
+
+Every list endpoint takes:
+
+- `limit`: page size (default 100, at most 1000)
+- `cursor`: the `next_cursor` of the previous page; `null` in a response means there are no more pages
+- `fields`: comma separated fields to return, e.g. `fields=id,title,link` to skip article descriptions.
+  `id` is always included.
+
+Articles are returned most recently added first, feeds and categories in ID order. Responses are streamed
+in batches straight from the database and serialized with orjson when it is installed.
+
+`/api/v1/changes?since=<seq>` returns what changed after a seq (start with 0): each change names the entity
+("article", "feed" or "category"), its ID, the action (insert, update, read, bookmark, delete) and the
+entity's current fields, or null once it is deleted. Clients store `last_seq` and pass it as `since` next time.
+Older changes to an entity are compacted away once it changes again, so a client may skip intermediate seqs.
+"""
+
+import base64
+import datetime
+import json
+import typing as T
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from quickfeed import api, change_log, models
+
+try:
+    # Imported by name: pylint can't see the members of the compiled module
+    from orjson import dumps as orjson_dumps
+except ImportError:  # orjson is optional, the standard library serializer is the fallback
+    orjson_dumps = None  # type: ignore[assignment]
+
+router = APIRouter(prefix="/api/v1")
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Items serialized per chunk of the streamed response
+BATCH_SIZE = 100
+
+
+def json_default(value: T.Any) -> T.Any:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: T.Any) -> bytes:
+    if orjson_dumps is not None:
+        return orjson_dumps(value)
+    return json.dumps(value, default=json_default, separators=(",", ":")).encode("utf-8")
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode("ascii")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: T.Optional[str]) -> T.Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii"))
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from ex
+
+
+def parse_fields(fields: T.Optional[str], available: T.Sequence[str]) -> T.List[str]:
+    if not fields:
+        return list(available)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in available]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # The ID goes first, it's what the next cursor is made of
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+
+def check_limit(limit: int) -> int:
+    if not 1 <= limit <= MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_LIMIT}")
+    return limit
+
+
+def stream_page(
+    request: Request,
+    query: T.Callable[[T.Any], T.AsyncIterator[T.Any]],
+    fields: T.List[str],
+    limit: int
+) -> StreamingResponse:
+    """Stream `{"items": [...], "next_cursor": ...}` for the rows returned by `query(session)`."""
+    async def generate() -> T.AsyncIterator[bytes]:
+        async with request.app.state.async_session_maker() as session:
+            yield b'{"items":['
+            count = 0
+            last_id = None
+            batch: T.List[bytes] = []
+            async for row in query(session):
+                batch.append(dumps(dict(zip(fields, row))))
+                count += 1
+                last_id = row[0]
+                if len(batch) == BATCH_SIZE:
+                    yield (b"," if count > BATCH_SIZE else b"") + b",".join(batch)
+                    batch = []
+            if batch:
+                yield (b"," if count > len(batch) else b"") + b",".join(batch)
+            next_cursor = encode_cursor(last_id) if count == limit and last_id is not None else None
+            yield b'],"next_cursor":' + dumps(next_cursor) + b"}"
+
+    return StreamingResponse(generate(), media_type="application/json")
+
+
+@router.get("/articles")
+async def list_articles(
+    request: Request,
+    cursor: T.Optional[str] = None,
+    limit: int = DEFAULT_LIMIT,
+    fields: T.Optional[str] = None,
+    feed_id: T.Optional[int] = None,
+    category: T.Optional[str] = None
+) -> StreamingResponse:
+    selected = parse_fields(fields, api.ARTICLE_FIELDS)
+    before_id = decode_cursor(cursor)
+    limit = check_limit(limit)
+    return stream_page(
+        request,
+        lambda session: api.stream_articles_async(session, selected, limit, before_id, feed_id, category),
+        selected,
+        limit
+    )
+
+
+@router.get("/feeds")
+async def list_feeds(
+    request: Request,
+    cursor: T.Optional[str] = None,
+    limit: int = DEFAULT_LIMIT,
+    fields: T.Optional[str] = None,
+    category_id: T.Optional[int] = None
+) -> StreamingResponse:
+    selected = parse_fields(fields, api.FEED_FIELDS)
+    after_id = decode_cursor(cursor)
+    limit = check_limit(limit)
+    return stream_page(
+        request,
+        lambda session: api.stream_feeds_async(session, selected, limit, after_id, category_id),
+        selected,
+        limit
+    )
+
+
+@router.get("/categories")
+async def list_categories(
+    request: Request,
+    cursor: T.Optional[str] = None,
+    limit: int = DEFAULT_LIMIT,
+    fields: T.Optional[str] = None
+) -> StreamingResponse:
+    selected = parse_fields(fields, api.CATEGORY_FIELDS)
+    after_id = decode_cursor(cursor)
+    limit = check_limit(limit)
+    return stream_page(
+        request,
+        lambda session: api.stream_categories_async(session, selected, limit, after_id),
+        selected,
+        limit
+    )
+
+
+@router.get("/changes")
+async def list_changes(
+    request: Request,
+    since: int = 0,
+    limit: int = DEFAULT_LIMIT,
+    fields: T.Optional[str] = None
+) -> Response:
+    article_fields = parse_fields(fields, api.ARTICLE_FIELDS)
+    limit = check_limit(limit)
+    async with request.app.state.async_session_maker() as session:
+        changes = await change_log.get_changes_async(session, since, limit)
+        entity_ids: T.Dict[str, T.Set[int]] = {}
+        for change in changes:
+            entity_ids.setdefault(change.entity, set()).add(change.entity_id)
+        article_ids = entity_ids.get(models.Change.ARTICLE, set())
+        rows = {
+            models.Change.ARTICLE: await api.get_rows_by_id_async(
+                session, models.Article, article_fields, article_ids),
+            models.Change.FEED: await api.get_rows_by_id_async(
+                session, models.Feed, api.FEED_FIELDS, entity_ids.get(models.Change.FEED, set())),
+            models.Change.CATEGORY: await api.get_rows_by_id_async(
+                session, models.Category, api.CATEGORY_FIELDS, entity_ids.get(models.Change.CATEGORY, set())),
+        }
+        bookmarked_ids = await api.get_bookmarked_ids_async(session, article_ids)
+        last_seq = changes[-1].seq if changes else max(since, 0)
+        has_more = len(changes) == limit
+
+    items = change_items(changes, rows, article_fields, bookmarked_ids)
+    return Response(
+        content=dumps({"changes": items, "last_seq": last_seq, "has_more": has_more}),
+        media_type="application/json"
+    )
+
+
+def change_items(
+    changes: T.List[models.Change],
+    rows: T.Dict[str, T.Dict[int, T.Any]],
+    article_fields: T.List[str],
+    bookmarked_ids: T.Set[int]
+) -> T.List[T.Dict[str, T.Any]]:
+    """The /changes items, with the current fields of the changed entities or None once they are deleted."""
+    fields_by_entity = {
+        models.Change.ARTICLE: article_fields,
+        models.Change.FEED: api.FEED_FIELDS,
+        models.Change.CATEGORY: api.CATEGORY_FIELDS,
+    }
+    items = []
+    for change in changes:
+        row = rows[change.entity].get(change.entity_id)
+        data = dict(zip(fields_by_entity[change.entity], row)) if row is not None else None
+        if data is not None and change.entity == models.Change.ARTICLE:
+            data["bookmarked"] = change.entity_id in bookmarked_ids
+        items.append({
+            "seq": change.seq, "entity": change.entity, "id": change.entity_id, "action": change.action, "data": data
+        })
+    return items
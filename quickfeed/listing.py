@@ -0,0 +1,70 @@
+"""
+Maintenance commands for the denormalized article_listing table.
+
+Listing pages read article_listing instead of joining article, feed, category and article_list. The
+application keeps it in step as it writes, but after restoring a backup, editing the database by hand or
+changing what the table holds, rebuild it:
+
+    poetry run python -m quickfeed.listing rebuild
+
+Check it against the source tables (exits with status 1 if they differ), optionally fixing the rows that do:
+
+    poetry run python -m quickfeed.listing check [--repair]
+"""
+
+import argparse
+import logging
+import sys
+
+from sqlalchemy import delete
+
+from quickfeed import article_listing, models, utils
+
+logger = logging.getLogger("quickfeed.listing")  # __name__ is __main__ when run with -m
+
+
+def rebuild(session_maker) -> None:
+    with session_maker() as session:
+        rows = article_listing.rebuild_article_listing(session)
+        session.commit()
+    logger.info("Rebuilt article_listing with %d rows", rows)
+
+
+def check(session_maker, repair: bool) -> bool:
+    """Log the differences between article_listing and the source tables, returns whether they agree."""
+    with session_maker() as session:
+        problems = article_listing.check_article_listing(session)
+        for kind, article_ids in problems.items():
+            if article_ids:
+                logger.warning("%d %s listing rows, e.g. articles %s", len(article_ids), kind, article_ids[:10])
+        if not any(problems.values()):
+            logger.info("article_listing is consistent")
+            return True
+        if repair:
+            article_ids = problems["stale"] + problems["orphaned"]
+            session.execute(delete(models.ArticleListing).filter(
+                models.ArticleListing.article_id.in_(problems["orphaned"])))
+            article_listing.refresh_article_listing(session, models.Article.id.in_(article_ids))
+            session.commit()
+            logger.info("Repaired %d listing rows", len(article_ids))
+        return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--repair", action="store_true", help="With check: recompute the rows that differ")
+    args = parser.parse_args()
+
+    config = utils.get_config(args.config)
+    utils.configure_logging(config)
+    session_maker = utils.setup_session_maker(config["database_url"])
+    if args.command == "rebuild":
+        rebuild(session_maker)
+    elif not check(session_maker, args.repair):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,27 @@
 import datetime
+import zlib
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer,
+                        LargeBinary, String)
+from sqlalchemy.orm import declarative_base, deferred, relationship
+from sqlalchemy.types import TypeDecorator
 
 Base = declarative_base()
 
 
+# process_literal_param is optional: neither dialect renders binary literals anyway
+class CompressedText(TypeDecorator):  # pylint: disable=abstract-method,too-many-ancestors
+    """Text stored zlib compressed, compressed and decompressed transparently."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return zlib.compress(value.encode("utf-8")) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return zlib.decompress(value).decode("utf-8") if value is not None else None
+
+
 class ModelMixin(Base):
     __abstract__ = True
     created_at = Column(DateTime, default=datetime.datetime.now)
@@ -24,6 +40,10 @@ class ArticleList(ModelMixin):
     __tablename__ = 'article_list'
     article_id = Column(Integer, ForeignKey('article.id'), primary_key=True)
     list_id = Column(Integer, ForeignKey('list.id'), primary_key=True)
+    __table_args__ = (
+        # The primary key leads with article_id, list pages read the members of one list by bookmark time
+        Index('ix_article_list_list_id', 'list_id', 'created_at', 'article_id'),
+    )
 
 
 class Category(ModelMixin):
@@ -31,7 +51,7 @@ class Category(ModelMixin):
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String, nullable=False)
     description = Column(String, nullable=False)
-    feeds = relationship('Feed', backref='category')
+    feeds = relationship('Feed', back_populates='category')
     order_number = Column(Integer, nullable=False)
 
 
@@ -45,7 +65,11 @@ class Feed(ModelMixin):
     description = Column(String, nullable=False)
     added_at = Column(DateTime, nullable=False)
     feed_last_updated = Column(DateTime, nullable=True)
+    http_etag = Column(String, nullable=True)
+    http_last_modified = Column(String, nullable=True)
     category_id = Column(Integer, ForeignKey('category.id'), nullable=False)
+    category = relationship('Category', back_populates='feeds')
+    articles = relationship('Article', back_populates='feed')
 
 
 class Article(ModelMixin):
@@ -56,7 +80,118 @@ class Article(ModelMixin):
     title = Column(String, nullable=False)
     link = Column(String, nullable=False)
     read_at = Column(DateTime, nullable=True)
-    description = Column(String, nullable=False)
+    # Often several KB of HTML that no listing shows: compressed, and only loaded when accessed
+    description = deferred(Column('description_z', CompressedText, nullable=False))
     published_at = Column(DateTime, nullable=False)
     added_at = Column(DateTime, nullable=False)
-    feed = relationship('Feed', backref='articles')
+    canonical_url_hash = Column(String, nullable=True, index=True)
+    # Set on duplicates of a story first seen through another feed, points at that first article
+    canonical_id = Column(Integer, ForeignKey('article.id'), nullable=True, index=True)
+    feed = relationship('Feed', back_populates='articles')
+
+
+class ArticleListing(Base):
+    """What a listing page shows for an article, copied from article, feed, category and the bookmark list so
+    a page is a single indexed scan. Derived data: kept in step by the api functions that write the source
+    tables, and rebuilt or checked with `python -m quickfeed.listing`."""
+    __tablename__ = 'article_listing'
+    article_id = Column(Integer, ForeignKey('article.id'), primary_key=True)
+    feed_id = Column(Integer, nullable=False, index=True)
+    feed_title = Column(String, nullable=False)
+    category_id = Column(Integer, nullable=True)
+    category_name = Column(String, nullable=True)
+    category_order = Column(Integer, nullable=True)
+    # Category of the canonical article's feed, to hide duplicates already listed in the same category
+    canonical_id = Column(Integer, nullable=True)
+    canonical_category_id = Column(Integer, nullable=True)
+    title = Column(String, nullable=False)
+    link = Column(String, nullable=False)
+    published_at = Column(DateTime, nullable=False)
+    read_at = Column(DateTime, nullable=True)
+    bookmarked = Column(Boolean, nullable=False, default=False)
+    __table_args__ = (
+        Index('ix_article_listing_published_at', 'published_at', 'article_id'),
+        Index('ix_article_listing_category_name_published_at', 'category_name', 'published_at', 'article_id'),
+        # Partial indexes holding only unread rows, for the unread_only listings
+        Index('ix_article_listing_unread_published_at', 'published_at', 'article_id',
+              sqlite_where=read_at.is_(None), postgresql_where=read_at.is_(None)),
+        Index('ix_article_listing_unread_category_name_published_at', 'category_name', 'published_at', 'article_id',
+              sqlite_where=read_at.is_(None), postgresql_where=read_at.is_(None)),
+    )
+
+
+class Change(ModelMixin):
+    """A change to an article, feed or category, numbered by seq for clients syncing with /api/v1/changes."""
+    __tablename__ = 'change'
+    ARTICLE = 'article'
+    FEED = 'feed'
+    CATEGORY = 'category'
+
+    INSERT = 'insert'
+    UPDATE = 'update'
+    READ = 'read'
+    UNREAD = 'unread'
+    BOOKMARK = 'bookmark'
+    DELETE = 'delete'
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)
+    __table_args__ = (
+        Index('ix_change_entity', 'entity', 'entity_id'),
+        # Never reuse the seq of a deleted (compacted) row
+        {'sqlite_autoincrement': True},
+    )
+
+
+class JobRun(ModelMixin):
+    __tablename__ = 'job_run'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    SCHEDULED = 'scheduled'
+    MANUAL = 'manual'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    trigger = Column(String, nullable=False)
+    owner = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False, index=True)
+    finished_at = Column(DateTime, nullable=True)
+    feeds_processed = Column(Integer, nullable=False, default=0)
+    articles_inserted = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+
+
+class Lease(ModelMixin):
+    __tablename__ = 'lease'
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class FetchJob(ModelMixin):
+    __tablename__ = 'fetch_job'
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    feed_id = Column(Integer, ForeignKey('feed.id'), nullable=False, index=True)
+    status = Column(String, nullable=False, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    enqueued_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    articles_inserted = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    feed = relationship('Feed')
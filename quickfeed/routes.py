@@ -1,22 +1,35 @@
-
+import datetime
+import logging
+import time
 import typing as T
 from os.path import normpath
 from urllib.parse import urlparse
 
 from fastapi import APIRouter, BackgroundTasks, Form, Header, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import (HTMLResponse, JSONResponse, RedirectResponse,
+                               StreamingResponse)
+from markupsafe import Markup
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from quickfeed import api, jobs
+from quickfeed import (api, article_listing, cache, events, job_state, jobs,
+                       models, timeline, tracing, worker, writer)
+
+logger = logging.getLogger(__name__)
+tracer = tracing.get_tracer(__name__)
 
 router = APIRouter()
 
 VALID_REDIRECT_PATHS: T.List[str] = [
     "/feed",
     "/feeds",
+    "/feed_details",
     "/bookmarks"
 ]
 DEFAULT_REDIRECT_PATH: str = "/feeds"
+# Job runs listed on the status page
+JOB_RUNS_SHOWN = 50
 
 
 def construct_redirect_url(path: str, query: str) -> str:
@@ -47,19 +60,56 @@ def valid_redirect(url: str) -> str:
     return DEFAULT_REDIRECT_PATH
 
 
-def templated_response(request: Request, name: str, context: T.Dict[str, T.Any]) -> HTMLResponse:
-    if "sidebar" in context:
-        raise ValueError("Key 'sidebar' is reserved in context")
-    with request.app.state.session_maker() as session:  # type: Session
-        context["sidebar"] = get_sidebar_data(session)
-    return request.app.state.templates.TemplateResponse(
-        request=request,
-        name=name,
-        context=context
-    )
-
-
-def get_sidebar_data(session: Session) -> T.Dict[str, T.Any]:
+async def templated_response(
+    request: Request,
+    name: str,
+    context: T.Dict[str, T.Any],
+    cache_key: T.Optional[T.Hashable] = None,
+    cache_tags: T.Iterable[str] = (),
+    cache_version: T.Optional[T.Tuple[int, ...]] = None
+) -> HTMLResponse:
+    """Render a template with the sidebar. When a cache key is given the rendered page is stored in the page cache,
+    unless its tags were invalidated since `cache_version`, see `cache.PageCache.version`."""
+    if "sidebar" in context or "sidebar_html" in context:
+        raise ValueError("Keys 'sidebar' and 'sidebar_html' are reserved in context")
+    start = time.perf_counter()
+    with tracer.start_as_current_span("render_sidebar"):
+        context["sidebar_html"] = await render_sidebar(request)
+    with tracer.start_as_current_span("render_template", {"template": name}):
+        response = request.app.state.templates.TemplateResponse(
+            request=request,
+            name=name,
+            context=context
+        )
+    logger.debug("Rendered %s in %.2fms", name, (time.perf_counter() - start) * 1000)
+    if cache_key is not None:
+        cache.page_cache.set(cache_key, response.body, cache_tags, cache_version)
+    return response
+
+
+def invalidate_article_pages(session: Session, article_id: str) -> None:
+    """Drop the cached listing pages an article, or any duplicate of its story, can appear on."""
+    tags = {cache.ALL_TAG}
+    for article in api.get_duplicate_articles(session, article_id):
+        tags.add(cache.category_tag(article.feed.category.name if article.feed.category else None))
+        tags.update(cache.list_tag(list_id) for list_id in api.get_list_ids_for_article(session, article.id))
+    cache.page_cache.invalidate(*tags)
+
+
+async def render_sidebar(request: Request) -> Markup:
+    """Render the sidebar fragment, reusing the cached HTML until feeds or categories change."""
+    sidebar_html = cache.fragment_cache.get(cache.SIDEBAR_TAG)
+    if sidebar_html is None:
+        # Taken first, so a feed or category edited while rendering keeps the outdated sidebar out of the cache
+        version = cache.fragment_cache.version((cache.SIDEBAR_TAG,))
+        async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+            sidebar = await get_sidebar_data(session)
+        sidebar_html = request.app.state.templates.get_template("sidebar.html").render(sidebar=sidebar).encode("utf-8")
+        cache.fragment_cache.set(cache.SIDEBAR_TAG, sidebar_html, (cache.SIDEBAR_TAG,), version)
+    return Markup(sidebar_html.decode("utf-8"))
+
+
+async def get_sidebar_data(session: AsyncSession) -> T.Dict[str, T.Any]:
     feeds: T.List[T.Dict[str, T.Any]] = [
         {
             "id": feed.id,
@@ -71,7 +121,7 @@ def get_sidebar_data(session: Session) -> T.Dict[str, T.Any]:
             "category": feed.category.name,
             "category_order_number": feed.category.order_number if feed.category else -1
         }
-        for feed in sorted(api.get_feeds(session), key=lambda x: x.title)
+        for feed in sorted(await api.get_feeds_async(session), key=lambda x: x.title)
     ]
     categories: T.Dict[str, T.List[T.Dict[str, T.Any]]] = {}
     for feed in feeds:
@@ -88,7 +138,7 @@ def get_sidebar_data(session: Session) -> T.Dict[str, T.Any]:
     }
 
 
-def get_all_categories(session: Session) -> T.List[T.Dict[str, T.Any]]:
+async def get_all_categories(session: AsyncSession) -> T.List[T.Dict[str, T.Any]]:
     return [
         {
             "id": category.id,
@@ -96,7 +146,7 @@ def get_all_categories(session: Session) -> T.List[T.Dict[str, T.Any]]:
             "description": category.description,
             "order_number": category.order_number
         }
-        for category in api.get_categories(session)
+        for category in await api.get_categories_async(session)
     ]
 
 
@@ -106,70 +156,82 @@ def root() -> RedirectResponse:
 
 
 @router.get("/feed", response_class=HTMLResponse)
-def feed_page_index(request: Request, page: T.Optional[int] = 1, per_page: T.Optional[int] = 15) -> HTMLResponse:
-    return feed_page(request, category=None, page=page, per_page=per_page)
+async def feed_page_index(
+    request: Request,
+    page: T.Optional[int] = 1,
+    per_page: T.Optional[int] = 15,
+    unread_only: bool = False
+) -> HTMLResponse:
+    return await feed_page(request, category=None, page=page, per_page=per_page, unread_only=unread_only)
 
 
 @router.get("/feed/{category}", response_class=HTMLResponse)
-def feed_page_category(
+async def feed_page_category(
     request: Request,
     category: T.Optional[str] = None,
     page: T.Optional[int] = 1,
-    per_page: T.Optional[int] = 15
+    per_page: T.Optional[int] = 15,
+    unread_only: bool = False
 ) -> HTMLResponse:
-    return feed_page(request, category=category, page=page, per_page=per_page)
+    return await feed_page(request, category=category, page=page, per_page=per_page, unread_only=unread_only)
 
 
-def feed_page(
+async def feed_page(
     request: Request,
     category: T.Optional[str] = None,
     list_id: T.Optional[int] = None,
     page: int = 1,
-    per_page: int = 15
+    per_page: int = 15,
+    unread_only: bool = False
 ) -> HTMLResponse:
     # pylint: disable=too-many-locals
-    with request.app.state.session_maker() as session:  # type: Session
-        if category is None:
-            article_feeds = api.get_feeds(session)
-        else:
-            article_feeds = api.get_feeds_by_category_name(session, category)
-
-        article_models: T.List[T.Any] = [article for feed in article_feeds for article in feed.articles]
-
+    cache_key = ("feed", category, list_id, page, per_page, unread_only)
+    cached_body = cache.page_cache.get(cache_key)
+    if cached_body is not None:
+        return HTMLResponse(content=cached_body)
+
+    if list_id is not None:
+        cache_tags = [cache.LISTING_TAG, cache.list_tag(list_id)]
+    elif category is not None:
+        cache_tags = [cache.LISTING_TAG, cache.category_tag(category)]
+    else:
+        cache_tags = [cache.LISTING_TAG, cache.ALL_TAG]
+    # Before reading anything the page shows, so an invalidation during the render keeps it out of the cache
+    cache_version = cache.page_cache.version(cache_tags)
+
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
         list_model: T.Optional[T.Any] = None
-        if list_id is not None:
-            list_model = api.get_list(session, list_id)
+        if list_id is None:
+            # Listing pages come straight from the denormalized article_listing table, the first ones through
+            # the in-memory timeline of the category
+            listing_rows, total = await get_listing_page(
+                session, category, (page - 1) * per_page, per_page, unread_only)
+        else:
+            list_model = await api.get_list_async(session, list_id)
             if list_model is None:
                 error = "List not found"
                 return RedirectResponse(url=f"/feed&error={error}", status_code=303)
-            articles_ids_in_list = {
-                article.article_id for article in api.get_articles_in_list(session, list_id)
-            }
-            article_models = [article for article in article_models if article.id in articles_ids_in_list]
-
-        bookmarked_ids: T.Set[int] = set()
-        bookmark_list = api.get_bookmark_list(session)
-        if bookmark_list:
-            bookmarked_articles = api.get_articles_in_list(session, bookmark_list.id)
-            bookmarked_ids = {article.article_id for article in bookmarked_articles}
-
-        articles: T.List[T.Dict[str, T.Any]] = [
-            {
-                "title": article.title,
-                "link": article.link,
-                "published_at": article.published_at,
-                "feed_name": article.feed.title,
-                "category": article.feed.category.name if article.feed.category else None,
-                "read_at": article.read_at,
-                "id": article.id,
-                "feed_id": article.feed.id,
-                "bookmarked": article.id in bookmarked_ids
-            }
-            for article in api.sort_articles(article_models)
-        ]
+            listing_rows, total = await article_listing.get_list_page_async(
+                session, list_id, (page - 1) * per_page, per_page
+            )
+        with tracer.start_as_current_span("build_page_articles", {"rows": len(listing_rows)}):
+            page_articles: T.List[T.Dict[str, T.Any]] = [
+                {
+                    "title": row.title,
+                    "link": row.link,
+                    "published_at": row.published_at,
+                    "feed_name": row.feed_title,
+                    "category": row.category_name,
+                    "read_at": row.read_at,
+                    "id": row.article_id,
+                    "feed_id": row.feed_id,
+                    "bookmarked": row.bookmarked
+                }
+                for row in listing_rows
+            ]
 
-        last_updated_feed = api.get_last_updated(session)
-        return templated_response(
+        last_updated_feed = await api.get_last_updated_async(session)
+        return await templated_response(
             request=request,
             name="index.html",
             context={
@@ -177,11 +239,41 @@ def feed_page(
                 "list_name": list_model.name if list_model else None,
                 "page": page,
                 "per_page": per_page,
-                "total_pages": len(articles) // per_page,
-                "articles": articles[(page - 1) * per_page: page * per_page],
+                "unread_only": unread_only,
+                "total_pages": total // per_page,
+                "articles": page_articles,
                 "last_updated": last_updated_feed.feed_last_updated if last_updated_feed else None,
-            }
+            },
+            cache_key=cache_key,
+            cache_tags=cache_tags,
+            cache_version=cache_version
+        )
+
+
+async def get_listing_page(
+    session: AsyncSession, category: T.Optional[str], offset: int, limit: int, unread_only: bool = False
+) -> T.Tuple[T.List[models.ArticleListing], int]:
+    if unread_only:
+        return await article_listing.get_listing_page_async(
+            session, category, offset=offset, limit=limit, unread_only=True
         )
+    timelines = timeline.timelines
+    timeline_page = timelines.get_page(category, offset, limit)
+    if timeline_page is None and offset + limit <= timelines.size:
+        # Not built yet, or shrunk by deleted feeds
+        await load_timeline(session, category)
+        timeline_page = timelines.get_page(category, offset, limit)
+    if timeline_page is None:
+        return await article_listing.get_listing_page_async(session, category, offset=offset, limit=limit)
+    article_ids, total = timeline_page
+    return await article_listing.get_listing_rows_async(session, article_ids), total
+
+
+async def load_timeline(session: AsyncSession, category: T.Optional[str]) -> None:
+    """Build the timeline of a category, or of All for None, from the database."""
+    timelines = timeline.timelines
+    version = timelines.version(category)
+    timelines.load(category, version, *await article_listing.get_timeline_async(session, category, timelines.size))
 
 
 @router.get("/reload_feed")
@@ -190,8 +282,8 @@ def reload_feed(request: Request) -> StreamingResponse:
         yield "<html>"
         yield "Reloading the feed, please wait...<br>"
         with request.app.state.session_maker() as session:  # type: Session
-            val = jobs.update_feeds(session)
-            next(val) # pylint: disable=stop-iteration-return
+            val = jobs.update_feeds(session, trigger=models.JobRun.MANUAL)
+            yield f"{next(val)}...<br>"  # pylint: disable=stop-iteration-return
             while True:
                 try:
                     yield f"Updating: {next(val)}..."
@@ -211,6 +303,29 @@ def reload_feed(request: Request) -> StreamingResponse:
     return StreamingResponse(generate(), media_type="text/html")
 
 
+@router.get("/jobs", response_class=HTMLResponse)
+async def jobs_page(request: Request) -> HTMLResponse:
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+        job_runs = await job_state.get_job_runs_async(session, JOB_RUNS_SHOWN)
+    finished = [
+        job_run for job_run in job_runs if job_run.status == models.JobRun.DONE and job_run.finished_at is not None
+    ]
+    durations = [(job_run.finished_at - job_run.started_at).total_seconds() for job_run in finished]
+    return await templated_response(
+        request=request,
+        name="jobs.html",
+        context={
+            "job_runs": job_runs,
+            "update_interval_minutes": request.app.state.config.get(
+                "update_interval_minutes", worker.DEFAULT_UPDATE_INTERVAL_MINUTES),
+            "average_seconds": sum(durations) / len(durations) if durations else None,
+            "max_seconds": max(durations) if durations else None,
+            "average_articles": sum(run.articles_inserted for run in finished) / len(finished) if finished else None,
+            "skipped": sum(1 for job_run in job_runs if job_run.status == models.JobRun.SKIPPED),
+        }
+    )
+
+
 @router.get("/redirect")
 def redirect(
     request: Request,
@@ -220,18 +335,18 @@ def redirect(
 ) -> RedirectResponse:
     def update_read(article_id: str) -> None:
         with request.app.state.session_maker() as session:  # type: Session
-            api.update_read(session, article_id)
-            session.commit()
+            writer.write_queue.run(session, lambda write_session: api.update_read(write_session, article_id))
+            invalidate_article_pages(session, article_id)
     background_tasks.add_task(update_read, article_id)
     return RedirectResponse(url)
 
 
 @router.get("/add_feed", response_class=HTMLResponse)
-def add_feed_page(request: Request) -> HTMLResponse:
-    with request.app.state.session_maker() as session:  # type: Session
-        categories = get_all_categories(session)
+async def add_feed_page(request: Request) -> HTMLResponse:
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+        categories = await get_all_categories(session)
 
-        return templated_response(
+        return await templated_response(
             request=request,
             name="add_feed.html",
             context={
@@ -243,9 +358,18 @@ def add_feed_page(request: Request) -> HTMLResponse:
 @router.post("/delete_feed_process")
 def delete_feed(request: Request, feed_id: T.Annotated[str, Form()]) -> RedirectResponse:
     with request.app.state.session_maker() as session:  # type: Session
+        feed = api.get_feed_by_id(session, feed_id)
+        category_name = feed.category.name if feed is not None and feed.category else None
+        has_duplicates = feed is not None and api.feed_has_duplicates(session, feed.id)
         if api.delete_feed_and_articles_by_id(session, feed_id):
             message = "Feed deleted successfully"
             session.commit()
+            cache.invalidate_feeds_and_categories()
+            if has_duplicates:
+                # Duplicates of its articles in other feeds are listed in their place now
+                timeline.timelines.clear()
+            else:
+                timeline.timelines.remove_feed(int(feed_id), category_name)
             return RedirectResponse(
                 url=f"/delete_feed?success={message}",
                 status_code=303,
@@ -259,15 +383,15 @@ def delete_feed(request: Request, feed_id: T.Annotated[str, Form()]) -> Redirect
 
 
 @router.get("/delete_feed", response_class=HTMLResponse)
-def delete_feed_page(
+async def delete_feed_page(
     request: Request,
     feed_id: T.Optional[int] = None,
     success: T.Optional[str] = None,
     error: T.Optional[str] = None
 ) -> HTMLResponse:
-    with request.app.state.session_maker() as session:  # type: Session
-        feed = api.get_feed_by_id(session, feed_id)
-        return templated_response(
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+        feed = await api.get_feed_by_id_async(session, feed_id)
+        return await templated_response(
             request=request,
             name="delete_feed.html",
             context={
@@ -279,18 +403,26 @@ def delete_feed_page(
 
 
 @router.post("/add_feed", response_class=HTMLResponse)
-def add_feed_post(
+async def add_feed_post(
     request: Request,
     uri: T.Annotated[str, Form()],
     category: T.Annotated[str, Form()]
 ) -> HTMLResponse:
-    feed = api.get_feed_data(uri)
+    feed = await run_in_threadpool(api.get_feed_data, uri)
     if not feed.entries:
-        return templated_response(request=request, name="add_feed.html", context={"error": "No entries found in feed"})
+        return await templated_response(
+            request=request,
+            name="add_feed.html",
+            context={"error": "No entries found in feed"}
+        )
 
     with request.app.state.session_maker() as session:  # type: Session
         if api.get_feed_by_uri(session, uri):
-            return templated_response(request=request, name="add_feed.html", context={"error": "Feed already added"})
+            return await templated_response(
+                request=request,
+                name="add_feed.html",
+                context={"error": "Feed already added"}
+            )
 
         category_obj = None
         if category:
@@ -307,9 +439,10 @@ def add_feed_post(
             category_id=category_obj.id if category_obj else None
         )
         session.commit()
+        cache.invalidate_feeds_and_categories()
 
     reload_time = request.app.state.config["reload_time_after_new_feed_submit"]
-    return templated_response(
+    return await templated_response(
         request=request,
         name="add_feed.html",
         context={
@@ -320,12 +453,12 @@ def add_feed_post(
 
 
 @router.get("/feeds", response_class=HTMLResponse)
-def feeds_page(
+async def feeds_page(
     request: Request,
     error: T.Optional[str] = None,
     success: T.Optional[str] = None
 ) -> HTMLResponse:
-    with request.app.state.session_maker() as session:  # type: Session
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
         feeds = [
             {
                 "title": feed.title,
@@ -336,13 +469,13 @@ def feeds_page(
                 "category": feed.category.name if feed.category else None,
                 "id": feed.id
             }
-            for feed in sorted(api.get_feeds(session), key=lambda x: x.title)
+            for feed in sorted(await api.get_feeds_async(session), key=lambda x: x.title)
         ]
-        return templated_response(
+        return await templated_response(
             request=request,
             name="feeds.html",
             context={
-                "categories": get_all_categories(session),
+                "categories": await get_all_categories(session),
                 "error": error,
                 "success": success,
                 "feeds": feeds
@@ -351,14 +484,14 @@ def feeds_page(
 
 
 @router.get("/feed_details", response_class=HTMLResponse)
-def feed_details(
+async def feed_details(
     request: Request,
-    feed_id: str,
+    feed_id: int,
     error: T.Optional[str] = None,
     success: T.Optional[str] = None
 ) -> HTMLResponse:
-    with request.app.state.session_maker() as session:  # type: Session
-        feed = api.get_feed_by_id(session, feed_id)
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+        feed = await api.get_feed_by_id_async(session, feed_id)
         feeds = [
             {
                 "title": feed.title,
@@ -369,7 +502,7 @@ def feed_details(
                 "category": feed.category.name if feed.category else None,
                 "id": feed.id
             }
-            for feed in sorted(api.get_feeds(session), key=lambda x: x.title)
+            for feed in sorted(await api.get_feeds_async(session), key=lambda x: x.title)
         ]
         if feed is not None:
             articles = [
@@ -382,11 +515,11 @@ def feed_details(
                 }
                 for article in api.sort_articles(feed.articles)
             ]
-            return templated_response(
+            return await templated_response(
                 request=request,
                 name="feed_details.html",
                 context={
-                    "categories": get_all_categories(session),
+                    "categories": await get_all_categories(session),
                     "feed": {
                         "title": feed.title,
                         "site_url": feed.site_url,
@@ -404,7 +537,7 @@ def feed_details(
                 }
             )
 
-        return templated_response(
+        return await templated_response(
             request=request,
             name="feed_details.html",
             context={
@@ -418,12 +551,12 @@ def feed_details(
 
 
 @router.get("/add_category", response_class=HTMLResponse)
-def add_category_page(
+async def add_category_page(
     request: Request,
     success: T.Optional[str] = None,
     error: T.Optional[str] = None
 ) -> HTMLResponse:
-    return templated_response(
+    return await templated_response(
         request=request,
         name="add_category.html",
         context={
@@ -445,15 +578,16 @@ async def add_category_post(request: Request) -> RedirectResponse:
             return RedirectResponse(url=f"/add_category?error={message}", status_code=303)
         api.add_category(session, category_name, category_description, category_order_number)
         session.commit()
+        cache.invalidate_feeds_and_categories()
         message = f"Category {category_name} added successfully"
         return RedirectResponse(url=f"/add_category?success={message}", status_code=303)
 
 
 @router.get("/categories", response_class=HTMLResponse)
-def categories_page(request: Request) -> HTMLResponse:
-    with request.app.state.session_maker() as session:  # type: Session
-        categories = get_all_categories(session)
-        return templated_response(
+async def categories_page(request: Request) -> HTMLResponse:
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+        categories = await get_all_categories(session)
+        return await templated_response(
             request=request,
             name="categories.html",
             context={
@@ -463,14 +597,14 @@ def categories_page(request: Request) -> HTMLResponse:
 
 
 @router.get("/category_details", response_class=HTMLResponse)
-def category_details(
+async def category_details(
     request: Request,
-    category_id: str,
+    category_id: int,
     error: T.Optional[str] = None,
     success: T.Optional[str] = None
 ) -> HTMLResponse:
-    with request.app.state.session_maker() as session:  # type: Session
-        category = api.get_category_by_id(session, category_id)
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+        category = await api.get_category_by_id_async(session, category_id)
         feeds = [
             {
                 "title": feed.title,
@@ -481,9 +615,9 @@ def category_details(
                 "category": feed.category.name if feed.category else None,
                 "id": feed.id
             }
-            for feed in sorted(api.get_feeds_by_category_id(session, category_id), key=lambda x: x.title)
+            for feed in sorted(await api.get_feeds_by_category_id_async(session, category_id), key=lambda x: x.title)
         ]
-        return templated_response(
+        return await templated_response(
             request=request,
             name="category_details.html",
             context={
@@ -496,15 +630,15 @@ def category_details(
 
 
 @router.get("/delete_category", response_class=HTMLResponse)
-def delete_category_get(
+async def delete_category_get(
     request: Request,
     category_id: int,
     success: T.Optional[str] = None,
     error: T.Optional[str] = None
 ) -> HTMLResponse:
-    with request.app.state.session_maker() as session:  # type: Session
-        category = api.get_category_by_id(session, category_id)
-        return templated_response(
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+        category = await api.get_category_by_id_async(session, category_id)
+        return await templated_response(
             request=request,
             name="delete_category.html",
             context={
@@ -529,18 +663,31 @@ def delete_category(
         feeds = api.get_feeds_by_category_id(session, category_id)
         default_category = api.get_default_category(session)
         for feed in feeds:
-            feed.category = default_category
+            api.add_feed_to_category(session, feed.id, default_category)
 
-        session.delete(category)
+        api.delete_category(session, category.id)
         message = "Category deleted successfully"
+        category_names = (category.name, default_category.name if default_category else None)
         session.commit()
+        cache.invalidate_feeds_and_categories()
+        timeline.timelines.discard(*category_names)
         return RedirectResponse(url=f"/categories?success={message}", status_code=303)
 
 
+def move_feed(
+    session: Session, feed: models.Feed, category: models.Category
+) -> T.Tuple[int, T.Optional[str], T.Optional[str], bool]:
+    """Move a feed to a category. Returns the arguments of `TimelineCache.move_feed`, to call once committed."""
+    old_category_name = feed.category.name if feed.category else None
+    api.add_feed_to_category(session, feed.id, category)
+    return feed.id, old_category_name, category.name, api.feed_has_duplicates(session, feed.id)
+
+
 @router.post("/update_feeds")
 async def update_feeds(request: Request) -> RedirectResponse:
     with request.app.state.session_maker() as session:  # type: Session
         form_data = await request.form()
+        moves = []
         for category_feed_key in form_data.keys():
             if category_feed_key.startswith("category_"):
                 feed_id_parts = category_feed_key.split("_")
@@ -554,14 +701,16 @@ async def update_feeds(request: Request) -> RedirectResponse:
                 feed_id = int(feed_id)
                 category_id = form_data.get(category_feed_key)
                 feed = api.get_feed_by_id(session, feed_id)
-                if feed is not None and feed.category_id != category_id:
+                if feed is not None and str(feed.category_id) != category_id:
                     category = api.get_category_by_id(session, category_id)
                     if category is None:
                         error = f"Category not found: {category_id}"
                         return RedirectResponse(url=f"/feeds?error={error}", status_code=303)
-                    feed.category = category
-                    session.add(feed)
+                    moves.append(move_feed(session, feed, category))
         session.commit()
+        cache.invalidate_feeds_and_categories()
+        for move in moves:
+            timeline.timelines.move_feed(*move)
         success = "Feeds updated successfully"
         return RedirectResponse(url=f"/feeds?success={success}", status_code=303)
 
@@ -581,9 +730,10 @@ async def update_feed(request: Request) -> RedirectResponse:
             if category is None:
                 error = "Category not found"
                 return RedirectResponse(url=f"/feed_details?feed_id={feed_id}&error={error}", status_code=303)
-            feed.category = category
-            session.add(feed)
+            move = move_feed(session, feed, category)
             session.commit()
+            cache.invalidate_feeds_and_categories()
+            timeline.timelines.move_feed(*move)
         success = "Feed updated successfully"
         return RedirectResponse(url=f"/feed_details?feed_id={feed_id}&success={success}", status_code=303)
 
@@ -605,11 +755,11 @@ async def update_category(request: Request) -> RedirectResponse:
         if category is None:
             error = "Category not found"
             return RedirectResponse(url=f"/category_details?category_id={category_id}&error={error}", status_code=303)
-        category.name = category_name
-        category.description = category_description
-        category.order_number = category_order_number
-        session.add(category)
+        old_category_name = category.name
+        api.update_category(session, category, category_name, category_description, category_order_number)
         session.commit()
+        cache.invalidate_feeds_and_categories()
+        timeline.timelines.discard(old_category_name, category_name)
         success = "Category updated successfully"
         return RedirectResponse(url=f"/category_details?category_id={category_id}&success={success}", status_code=303)
 
@@ -627,22 +777,93 @@ async def bookmark(request: Request, referer: str = Header(None)) -> RedirectRes
         if bookmark_list is None:
             error = "Bookmark list not found. Internal error."
             return RedirectResponse(url=f"/feed?error={error}", status_code=303)
-        article_list = api.get_article_in_list(session, bookmark_list.id, article.id)
-        if article_list is None:
-            article_list = api.add_article_to_list(session, bookmark_list.id, article.id)
-        else:
-            session.delete(article_list)
-
-        session.commit()
+        bookmark_list_id = bookmark_list.id
+        article_id = article.id
+
+        def toggle_bookmark(write_session: Session) -> None:
+            article_list = api.get_article_in_list(write_session, bookmark_list_id, article_id)
+            if article_list is None:
+                api.add_article_to_list(write_session, bookmark_list_id, article_id)
+            else:
+                api.remove_article_from_list(write_session, article_list)
+
+        await writer.write_queue.run_async(session, toggle_bookmark)
+        invalidate_article_pages(session, article_id)
+        cache.page_cache.invalidate(cache.list_tag(bookmark_list_id))
         return RedirectResponse(url=valid_redirect(referer), status_code=303)
 
 
+@router.post("/mark_read")
+def mark_read(
+    request: Request,
+    feed_id: T.Annotated[T.Optional[int], Form()] = None,
+    category: T.Annotated[T.Optional[str], Form()] = None,
+    before: T.Annotated[T.Optional[datetime.date], Form()] = None,
+    referer: str = Header(None)
+) -> RedirectResponse:
+    return update_read_state(request, True, feed_id, category, before, referer)
+
+
+@router.post("/mark_unread")
+def mark_unread(
+    request: Request,
+    feed_id: T.Annotated[T.Optional[int], Form()] = None,
+    category: T.Annotated[T.Optional[str], Form()] = None,
+    before: T.Annotated[T.Optional[datetime.date], Form()] = None,
+    referer: str = Header(None)
+) -> RedirectResponse:
+    return update_read_state(request, False, feed_id, category, before, referer)
+
+
+def update_read_state(
+    request: Request, read: bool, feed_id: T.Optional[int], category: T.Optional[str],
+    before: T.Optional[datetime.date], referer: T.Optional[str]
+) -> RedirectResponse:
+    """Mark every article, or those of a feed or category and/or published before a date, as read or unread."""
+    with request.app.state.session_maker() as session:  # type: Session
+        published_before = datetime.datetime.combine(before, datetime.time()) if before else None
+        count = writer.write_queue.run(session, lambda write_session: api.update_read_state(
+            write_session, read, feed_id=feed_id, category_name=category, published_before=published_before))
+    logger.info("Marked %d articles as %s", count, "read" if read else "unread")
+    cache.page_cache.invalidate(cache.LISTING_TAG)
+    return RedirectResponse(url=valid_redirect(referer) if referer else "/feed", status_code=303)
+
+
 @router.get("/bookmarks", response_class=HTMLResponse)
-def bookmarks_page(
+async def bookmarks_page(
     request: Request,
     page: T.Optional[int] = 1,
     per_page: T.Optional[int] = 15
 ) -> HTMLResponse:
-    with request.app.state.session_maker() as session:  # type: Session
-        bookmark_list = api.get_bookmark_list(session)
-        return feed_page(request, page=page, per_page=per_page, list_id=bookmark_list.id)
+    async with request.app.state.async_session_maker() as session:  # type: AsyncSession
+        bookmark_list = await api.get_bookmark_list_async(session)
+    return await feed_page(request, page=page, per_page=per_page, list_id=bookmark_list.id)
+
+
+@router.get("/events")
+async def event_stream() -> StreamingResponse:
+    return StreamingResponse(
+        events.broker.subscribe(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/stats/page_cache")
+def page_cache_stats() -> JSONResponse:
+    return JSONResponse(cache.page_cache.stats())
+
+
+@router.get("/stats/lookup_cache")
+def lookup_cache_stats() -> JSONResponse:
+    return JSONResponse(cache.lookup_cache.stats())
+
+
+@router.get("/stats/writes")
+def write_queue_stats() -> JSONResponse:
+    return JSONResponse(writer.write_queue.stats())
+
+
+@router.get("/stats/timelines")
+def timeline_stats() -> JSONResponse:
+    return JSONResponse(timeline.timelines.stats())
@@ -7,6 +7,9 @@ if __name__ == "__main__":
     uvicorn.run("quickfeed.server:app",
                 host=config["host"],
                 port=config["port"],
+                workers=config.get("workers", 1),
+                # Event streams never finish by themselves, don't wait for them forever
+                timeout_graceful_shutdown=config.get("graceful_shutdown_seconds", 5),
                 ssl_keyfile=config["ssl_keyfile"],
                 ssl_certfile=config["ssl_certfile"]
                 )
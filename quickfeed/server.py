@@ -1,11 +1,19 @@
-from contextlib import contextmanager
+import asyncio
+import logging
+import os
+import threading
+import time
 
-from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 
-from quickfeed import basic_auth, jobs, routes, utils
+from quickfeed import (api, assets, basic_auth, cache, compression, events,
+                       http_client, jobs, json_api, routes, timeline, tracing,
+                       utils, worker, writer)
+
+logger = logging.getLogger(__name__)
 
 config = utils.get_config("config.json")
 utils.configure_logging(config)
@@ -16,37 +24,139 @@ app = FastAPI()
 app.add_middleware(
     basic_auth.AuthMiddleware,
     username=config["user_login"]["username"],
-    password=config["user_login"]["password"]
+    password=config["user_login"]["password"],
+    # Never derived from the credentials: a cookie signed with those would let anyone holding one test passwords
+    session_secret=config.get("session_secret") or basic_auth.load_or_create_session_secret(
+        config.get("session_secret_file", basic_auth.DEFAULT_SESSION_SECRET_FILE))
 )
+app.add_middleware(compression.CompressionMiddleware)
+# Outermost, so request traces include the time spent in the other middleware
+app.add_middleware(tracing.TracingMiddleware)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+static_assets = assets.StaticAssets(directory="static")
+app.mount("/static", static_assets, name="static")
 
 
 @app.on_event("startup")
 def load_config() -> None:
+    """Set up what serving a request needs. Anything else is left to `start_background_work`."""
+    start = time.perf_counter()
     app.state.config = config  # Storing the config in the app state for later access
 
-    SessionLocal = utils.setup_database(config['database_url'])
-
-    @contextmanager
-    def session_maker():
-        session_maker = SessionLocal()
-        try:
-            yield session_maker
-        finally:
-            session_maker.close()
-
+    session_maker = utils.setup_session_maker(config['database_url'])
     app.state.session_maker = session_maker
-
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(jobs.entrypoint, 'interval', minutes=5, args=[session_maker, jobs.update_feeds])
-    scheduler.start()
-
-    app.state.scheduler = scheduler
+    # Read routes use the async engine so slow queries don't hold a threadpool worker
+    app.state.async_engine, app.state.async_session_maker = utils.setup_async_database(
+        config.get('async_database_url') or config['database_url']
+    )
+
+    http_client.configure(**config.get("http_client", {}))
+    tracing.configure(**config.get("tracing", {}))
+
+    cache.page_cache.max_entries = config.get("page_cache_size", cache.DEFAULT_MAX_ENTRIES)
+    app.state.page_cache = cache.page_cache
+    cache.lookup_cache.ttl = config.get("lookup_cache_ttl_seconds", cache.DEFAULT_LOOKUP_TTL_SECONDS)
+    timeline.timelines.size = config.get("timeline_size", timeline.DEFAULT_SIZE)
+    if config.get("single_writer", False):
+        writer.write_queue.max_batch = config.get("write_batch_size", writer.DEFAULT_MAX_BATCH)
+        writer.write_queue.start(session_maker)
+
+    app.state.scheduler = None
+    # Guards starting the scheduler in the background against shutting down at the same time
+    app.state.scheduler_lock = threading.Lock()
+    app.state.stopping = False
+    app.state.scheduler_owner = jobs.process_owner_id()
+    static_assets.load()
     app.state.templates = Jinja2Templates(directory="templates")
+    # Compiled templates are shared on disk so restarted workers skip recompilation
+    template_cache_dir = config.get("template_cache_dir", ".template_cache")
+    os.makedirs(template_cache_dir, exist_ok=True)
+    app.state.templates.env.bytecode_cache = FileSystemBytecodeCache(template_cache_dir)
+    app.state.templates.env.globals["static_url"] = static_assets.url
     app.include_router(routes.router)
+    app.include_router(json_api.router)
+    logger.info("Started in %.0fms", (time.perf_counter() - start) * 1000)
+
+
+@app.on_event("startup")
+async def start_background_work() -> None:
+    """Start the scheduler and warm the caches without holding up the first requests."""
+    app.state.background_startup = asyncio.create_task(background_startup())
+
+
+async def background_startup() -> None:
+    start = time.perf_counter()
+    try:
+        await run_in_threadpool(start_scheduler)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception(
+            "Starting the scheduler failed: feeds won't be updated by this process and changes made by others "
+            "won't be picked up")
+    try:
+        await run_in_threadpool(warm_templates)
+        await run_in_threadpool(warm_lookups)
+        await warm_timelines()
+    except Exception as ex:  # pylint: disable=broad-except
+        # Caches fill on demand anyway, a failed warm up only costs the first requests some time
+        logger.warning("Warming caches failed: %s", ex)
+        return
+    logger.info("Finished the background startup in %.0fms", (time.perf_counter() - start) * 1000)
+
+
+def start_scheduler() -> None:
+    """Start the scheduled jobs, unless the app is already shutting down."""
+    from apscheduler.schedulers.background import BackgroundScheduler  # pylint: disable=import-outside-toplevel
+    scheduler = BackgroundScheduler()
+    session_maker = app.state.session_maker
+    if config.get("run_scheduler", True):
+        worker.schedule_update_feeds(scheduler, session_maker, config, app.state.scheduler_owner)
+    scheduler.add_job(
+        jobs.ExternalUpdateWatcher(session_maker),
+        'interval',
+        seconds=config.get("external_update_check_seconds", 30),
+        **worker.JOB_DEFAULTS
+    )
+    with app.state.scheduler_lock:
+        if app.state.stopping:
+            return
+        scheduler.start()
+        app.state.scheduler = scheduler
+
+
+def warm_templates() -> None:
+    """Load every template, from the bytecode cache when it has them."""
+    env = app.state.templates.env
+    for name in env.list_templates(extensions=["html"]):
+        env.get_template(name)
+
+
+def warm_lookups() -> None:
+    with app.state.session_maker() as session:
+        api.get_bookmark_list(session)
+        api.get_default_category(session)
+
+
+async def warm_timelines() -> None:
+    """Build the timelines of All and of every category, which the first listing pages are served from."""
+    async with app.state.async_session_maker() as session:
+        categories = await api.get_categories_async(session)
+        for category in [timeline.ALL, *(category.name for category in categories)]:
+            await routes.load_timeline(session, category)
 
 
 @app.on_event("shutdown")
-def shutdown_event() -> None:
-    app.state.scheduler.shutdown(wait=False)
+async def shutdown_event() -> None:
+    events.broker.close()
+    app.state.background_startup.cancel()
+    # The cancelled task may still be starting the scheduler in a thread: it either started it already, or
+    # won't once it sees the flag
+    with app.state.scheduler_lock:
+        app.state.stopping = True
+        scheduler = app.state.scheduler
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+    writer.write_queue.stop()
+    if config.get("run_scheduler", True):
+        jobs.release_lease(app.state.session_maker, jobs.update_feeds.__name__, app.state.scheduler_owner)
+    http_client.feed_fetcher.close()
+    await app.state.async_engine.dispose()
@@ -0,0 +1,200 @@
+"""
+In-memory timelines of the newest articles.
+
+A timeline holds the IDs of the newest rows of one listing (a category, or All) in rank order, along with
+the number of rows each feed has in it. The first pages of a listing are then a slice of the timeline and a
+primary key lookup of those rows, instead of a sorted scan and a count over the whole category.
+
+Timelines are built lazily, the first time one of their pages is shown, and kept up to date by the writers:
+ingest adds the new articles, deleting a feed removes its rows and moving a feed removes them from its old
+category. Changes whose effect isn't known exactly (the destination of a move, renamed categories, changes
+made by other processes) discard the timelines involved, which are rebuilt on their next view.
+"""
+
+import bisect
+import datetime
+import threading
+import typing as T
+
+DEFAULT_SIZE = 150
+# A timeline is rebuilt once it remembers this many times its size in articles added since it was built
+MAX_ADDED_FACTOR = 10
+# Key of the timeline listing every feed, like a None category name in the listing functions
+ALL = None
+
+TimelineRow = T.Tuple[int, int, datetime.datetime]  # article_id, feed_id, published_at
+
+
+class Timeline:
+    """The newest rows of a listing as (published_at, article_id) in ascending order, and row counts per feed."""
+
+    def __init__(
+        self, size: int, rows: T.Iterable[TimelineRow], feed_counts: T.Mapping[int, int], last_article_id: int
+    ) -> None:
+        self.size = size
+        rows = sorted(rows, key=lambda row: (row[2], row[0]))[-size:] if size > 0 else []
+        self.keys: T.List[T.Tuple[datetime.datetime, int]] = [
+            (published_at, article_id) for article_id, _, published_at in rows
+        ]
+        self.feed_ids: T.Dict[int, int] = {article_id: feed_id for article_id, feed_id, _ in rows}
+        self.feed_counts: T.Dict[int, int] = dict(feed_counts)
+        self.total = sum(self.feed_counts.values())
+        # Articles are announced both by this process's ingest and by the watcher, and may already be counted in
+        # the rows the timeline was built from: IDs up to last_article_id were, later ones are remembered
+        self.last_article_id = last_article_id
+        self.added_ids: T.Set[int] = set()
+
+    def holds_all(self) -> bool:
+        return len(self.keys) >= self.total
+
+    def page(self, offset: int, limit: int) -> T.Optional[T.List[int]]:
+        """Article IDs of a page, newest first, or None if it reaches past the rows held."""
+        if offset + limit > len(self.keys) and not self.holds_all():
+            return None
+        end = max(0, len(self.keys) - offset)
+        return [article_id for _, article_id in reversed(self.keys[max(0, end - limit):end])]
+
+    def add(self, article_id: int, feed_id: int, published_at: datetime.datetime) -> None:
+        if article_id <= self.last_article_id or article_id in self.added_ids:
+            return
+        self.added_ids.add(article_id)
+        key = (published_at, article_id)
+        # Older than everything held, while older rows are missing: it belongs to the part we don't hold
+        fits = self.holds_all() or bool(self.keys and key > self.keys[0])
+        self.feed_counts[feed_id] = self.feed_counts.get(feed_id, 0) + 1
+        self.total += 1
+        if not fits or self.size <= 0:
+            return
+        bisect.insort(self.keys, key)
+        self.feed_ids[article_id] = feed_id
+        if len(self.keys) > self.size:
+            _, dropped_id = self.keys.pop(0)
+            del self.feed_ids[dropped_id]
+
+    def remove_feed(self, feed_id: int) -> None:
+        # What remains is still the newest rows of the listing, there are just fewer of them
+        self.total -= self.feed_counts.pop(feed_id, 0)
+        self.keys = [key for key in self.keys if self.feed_ids[key[1]] != feed_id]
+        self.feed_ids = {
+            article_id: owner_id for article_id, owner_id in self.feed_ids.items() if owner_id != feed_id
+        }
+
+
+class TimelineCache:
+    """Timelines by category name, plus the All timeline under the ALL key.
+
+    Loading runs outside the lock, on the async session, so every change bumps the version of the timelines it
+    touches; a load whose version moved in between was built from an outdated snapshot and is dropped."""
+
+    def __init__(self, size: int = DEFAULT_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.__timelines: T.Dict[T.Optional[str], Timeline] = {}
+        self.__versions: T.Dict[T.Optional[str], int] = {}
+        self.__generation = 0
+        self.__lock = threading.Lock()
+
+    def __touch(self, key: T.Optional[str]) -> None:
+        self.__versions[key] = self.__versions.get(key, 0) + 1
+
+    def version(self, key: T.Optional[str]) -> T.Tuple[int, int]:
+        with self.__lock:
+            return self.__generation, self.__versions.get(key, 0)
+
+    def get_page(self, key: T.Optional[str], offset: int, limit: int) -> T.Optional[T.Tuple[T.List[int], int]]:
+        """Article IDs of a page of a listing and its total row count, if the timeline holds that page."""
+        with self.__lock:
+            timeline = self.__timelines.get(key)
+            article_ids = timeline.page(offset, limit) if timeline is not None else None
+            if article_ids is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return article_ids, timeline.total
+
+    def load(
+        self, key: T.Optional[str], version: T.Tuple[int, int], rows: T.Iterable[TimelineRow],
+        feed_counts: T.Mapping[int, int], last_article_id: int
+    ) -> bool:
+        """Store a timeline read from the database, unless it changed since `version` was taken."""
+        timeline = Timeline(self.size, rows, feed_counts, last_article_id)
+        with self.__lock:
+            if (self.__generation, self.__versions.get(key, 0)) != version:
+                return False
+            self.__timelines[key] = timeline
+            return True
+
+    def add(
+        self, category_name: T.Optional[str], article_id: int, feed_id: int, published_at: datetime.datetime,
+        in_all: bool = True, in_category: bool = True
+    ) -> None:
+        """Add a committed article to the All timeline and its category's, if listed there."""
+        keys = ([ALL] if in_all else []) + ([category_name] if in_category and category_name is not None else [])
+        with self.__lock:
+            for key in keys:
+                self.__touch(key)
+                timeline = self.__timelines.get(key)
+                if timeline is None:
+                    continue
+                timeline.add(article_id, feed_id, published_at)
+                if len(timeline.added_ids) > MAX_ADDED_FACTOR * self.size:
+                    del self.__timelines[key]
+
+    def remove_feed(self, feed_id: int, *category_names: T.Optional[str]) -> None:
+        """Remove a feed's rows from the All timeline and the given categories', e.g. once it is deleted."""
+        with self.__lock:
+            for key in {ALL, *(name for name in category_names if name is not None)}:
+                self.__touch(key)
+                if key in self.__timelines:
+                    self.__timelines[key].remove_feed(feed_id)
+
+    def move_feed(
+        self, feed_id: int, old_category_name: T.Optional[str], new_category_name: T.Optional[str],
+        has_duplicates: bool
+    ) -> None:
+        """Account for a feed moved between categories. The All timeline doesn't depend on categories.
+
+        Its rows leave the old category as they are, unless duplicates link them to other feeds: which of those
+        are listed in a category depends on the categories of both sides. The new category is rebuilt."""
+        if old_category_name == new_category_name:
+            return
+        with self.__lock:
+            for key in (old_category_name, new_category_name):
+                if key is None:
+                    continue
+                self.__touch(key)
+                timeline = self.__timelines.get(key)
+                if timeline is None:
+                    continue
+                if key == old_category_name and not has_duplicates:
+                    timeline.remove_feed(feed_id)
+                else:
+                    del self.__timelines[key]
+
+    def discard(self, *category_names: T.Optional[str]) -> None:
+        """Drop category timelines, or the All timeline for ALL, to be rebuilt on their next view."""
+        with self.__lock:
+            for key in category_names:
+                self.__touch(key)
+                self.__timelines.pop(key, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__generation += 1
+            self.__timelines.clear()
+
+    def stats(self) -> T.Dict[str, T.Any]:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "timelines": len(self.__timelines),
+                "size": self.size,
+                "rows": sum(len(timeline.keys) for timeline in self.__timelines.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+timelines = TimelineCache()
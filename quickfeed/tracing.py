@@ -0,0 +1,353 @@
+"""
+Lightweight tracing spans, exported to a local JSONL file.
+
+The API follows OpenTelemetry's tracing API, so the calls read the same and could be pointed at the real SDK:
+
+    tracer = tracing.get_tracer(__name__)
+    with tracer.start_as_current_span("update_feed", attributes={"feed.id": feed_id}) as span:
+        span.set_attribute("articles.inserted", count)
+
+A span started with no current span is the root of a new trace, which is sampled with `sample_rate`. Spans of
+a trace are kept in memory until its root ends, then appended to `path` as one JSON object per line. Nothing
+leaves the process; `scripts/trace_summary.py` reads the file back.
+
+Roots are started by the request middleware and the feed update job. Functions wrapped by `instrument` (every
+function of quickfeed.api) and database statements only record spans inside a sampled trace, so code running
+outside of one (the watcher, the writer thread) costs a context variable lookup.
+
+Tracing is off unless configured with `"tracing": {"enabled": true}`.
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+import typing as T
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 0.1
+DEFAULT_PATH = "traces.jsonl"
+# Spans past this in a single trace are counted on the root instead of kept, e.g. for runs over many feeds
+MAX_SPANS_PER_TRACE = 10000
+MAX_STATEMENT_LENGTH = 200
+
+AttributeValue = T.Union[str, bool, int, float]
+
+
+class StatusCode:
+    UNSET = "UNSET"
+    OK = "OK"
+    ERROR = "ERROR"
+
+
+class Trace:
+    """The finished spans of a sampled trace, written out when its root ends."""
+
+    def __init__(self, trace_id: str) -> None:
+        self.trace_id = trace_id
+        self.spans: T.List[T.Dict[str, T.Any]] = []
+        self.dropped = 0
+        self.exported = False
+
+
+class Span:  # pylint: disable=too-many-instance-attributes
+    """A recorded operation of a sampled trace."""
+
+    def __init__(
+        self, name: str, trace: Trace, parent: T.Optional["Span"],
+        attributes: T.Optional[T.Mapping[str, AttributeValue]] = None
+    ) -> None:
+        self.name = name
+        self.trace = trace
+        self.span_id = random.getrandbits(64).to_bytes(8, "big").hex()
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.attributes: T.Dict[str, AttributeValue] = dict(attributes or {})
+        self.status = StatusCode.UNSET
+        self.status_description: T.Optional[str] = None
+        self.start_time = time.time_ns()
+        self.end_time: T.Optional[int] = None
+
+    def is_recording(self) -> bool:
+        return self.end_time is None
+
+    def update_name(self, name: str) -> None:
+        self.name = name
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: T.Mapping[str, AttributeValue]) -> None:
+        self.attributes.update(attributes)
+
+    def set_status(self, status: str, description: T.Optional[str] = None) -> None:
+        self.status = status
+        self.status_description = description
+
+    def record_exception(self, exception: BaseException) -> None:
+        self.attributes["exception.type"] = type(exception).__name__
+        self.attributes["exception.message"] = str(exception)
+
+    def end(self) -> None:
+        if self.end_time is not None:
+            return
+        self.end_time = time.time_ns()
+        trace = self.trace
+        if self.parent_span_id is None:
+            if trace.dropped:
+                self.attributes["tracing.dropped_spans"] = trace.dropped
+            trace.spans.append(self.to_dict())
+            exporter.export(trace.spans)
+            trace.exported = True
+            trace.spans = []
+        elif len(trace.spans) >= MAX_SPANS_PER_TRACE:
+            trace.dropped += 1
+        else:
+            trace.spans.append(self.to_dict())
+            if trace.exported:
+                # Ended after its root, e.g. in a thread the request didn't wait for
+                exporter.export(trace.spans)
+                trace.spans = []
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        assert self.end_time is not None
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time,
+            "end_time_unix_nano": self.end_time,
+            "duration_ms": (self.end_time - self.start_time) / 1e6,
+            "status": self.status,
+            "status_description": self.status_description,
+            "attributes": self.attributes,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+
+
+class NonRecordingSpan:
+    """Stands in for spans that aren't recorded: when tracing is off, or for traces that weren't sampled."""
+
+    def is_recording(self) -> bool:
+        return False
+
+    def update_name(self, name: str) -> None:
+        pass
+
+    def set_attribute(self, key: str, value: AttributeValue) -> None:
+        pass
+
+    def set_attributes(self, attributes: T.Mapping[str, AttributeValue]) -> None:
+        pass
+
+    def set_status(self, status: str, description: T.Optional[str] = None) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+INVALID_SPAN = NonRecordingSpan()
+AnySpan = T.Union[Span, NonRecordingSpan]
+
+_current_span: contextvars.ContextVar[T.Optional[AnySpan]] = contextvars.ContextVar("current_span", default=None)
+
+
+def get_current_span() -> AnySpan:
+    span = _current_span.get()
+    return span if span is not None else INVALID_SPAN
+
+
+class JsonlExporter:
+    """Appends finished spans to a file, a trace at a time."""
+
+    def __init__(self, path: str = DEFAULT_PATH) -> None:
+        self.path = path
+        self.exported = 0
+        self.__lock = threading.Lock()
+
+    def export(self, spans: T.List[T.Dict[str, T.Any]]) -> None:
+        if not spans:
+            return
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+        try:
+            with self.__lock:
+                # A single append per trace keeps the lines of concurrent processes whole
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(lines)
+                self.exported += len(spans)
+        except OSError as ex:
+            logger.warning("Exporting %d spans to %s failed: %s", len(spans), self.path, ex)
+
+
+class Tracer:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def start_span(self, name: str, attributes: T.Optional[T.Mapping[str, AttributeValue]] = None) -> AnySpan:
+        """Start a span as a child of the current one, or as the root of a new trace. It isn't made current."""
+        if not settings.enabled:
+            return INVALID_SPAN
+        parent = _current_span.get()
+        if isinstance(parent, NonRecordingSpan):
+            return INVALID_SPAN  # Inside a trace that wasn't sampled
+        if isinstance(parent, Span):
+            return Span(name, parent.trace, parent, attributes)
+        if random.random() >= settings.sample_rate:
+            return INVALID_SPAN
+        return Span(name, Trace(random.getrandbits(128).to_bytes(16, "big").hex()), None, attributes)
+
+    @contextlib.contextmanager
+    def start_as_current_span(
+        self, name: str, attributes: T.Optional[T.Mapping[str, AttributeValue]] = None,
+        record_exception: bool = True, set_status_on_exception: bool = True, end_on_exit: bool = True
+    ) -> T.Iterator[AnySpan]:
+        """Start a span and make it current for the duration of the block."""
+        span = self.start_span(name, attributes)
+        # Unsampled roots are made current too, so the spans under them don't start traces of their own
+        token = _current_span.set(span) if settings.enabled else None
+        try:
+            yield span
+        except BaseException as ex:
+            if record_exception:
+                span.record_exception(ex)
+            if set_status_on_exception:
+                span.set_status(StatusCode.ERROR, f"{type(ex).__name__}: {ex}")
+            raise
+        finally:
+            if token is not None:
+                _current_span.reset(token)
+            if end_on_exit:
+                span.end()
+
+
+def get_tracer(name: str) -> Tracer:
+    return Tracer(name)
+
+
+class Settings:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.sample_rate = DEFAULT_SAMPLE_RATE
+
+
+settings = Settings()
+exporter = JsonlExporter()
+tracer = get_tracer(__name__)
+
+
+def configure(enabled: bool = False, sample_rate: float = DEFAULT_SAMPLE_RATE, path: str = DEFAULT_PATH) -> None:
+    settings.enabled = enabled
+    settings.sample_rate = sample_rate
+    exporter.path = path
+    if enabled:
+        logger.info("Tracing %.0f%% of requests and feed updates to %s", sample_rate * 100, path)
+
+
+def in_sampled_trace() -> bool:
+    return isinstance(_current_span.get(), Span)
+
+
+def traced(func: T.Callable, name: T.Optional[str] = None) -> T.Callable:
+    """Wrap a function, sync or async, in a span, recorded only within a sampled trace."""
+    span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args: T.Any, **kwargs: T.Any) -> T.Any:
+            if not in_sampled_trace():
+                return await func(*args, **kwargs)
+            with tracer.start_as_current_span(span_name):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args: T.Any, **kwargs: T.Any) -> T.Any:
+        if not in_sampled_trace():
+            return func(*args, **kwargs)
+        with tracer.start_as_current_span(span_name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def instrument(namespace: T.Dict[str, T.Any]) -> None:
+    """Wrap the public functions defined in a module, from its globals(), in spans.
+
+    Calls between the module's functions go through its globals, so they are traced too. Generator functions
+    are left alone, their work happens after they return; their callers' spans account for it."""
+    module_name = namespace["__name__"]
+    for name, value in list(namespace.items()):
+        if (
+            name.startswith("_") or not inspect.isfunction(value) or value.__module__ != module_name
+            or inspect.isgeneratorfunction(value) or inspect.isasyncgenfunction(value)
+        ):
+            continue
+        namespace[name] = traced(value)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_span(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument,too-many-arguments
+    if in_sampled_trace():
+        span = tracer.start_span("db.execute", {"db.statement": statement[:MAX_STATEMENT_LENGTH]})
+        conn.info.setdefault("tracing_spans", []).append(span)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement_span(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument,too-many-arguments
+    spans = conn.info.get("tracing_spans")
+    if spans:
+        spans.pop().end()
+
+
+@event.listens_for(Engine, "handle_error")
+def end_failed_statement_span(exception_context):
+    spans = exception_context.connection.info.get("tracing_spans") if exception_context.connection else None
+    if spans:
+        span = spans.pop()
+        span.set_status(StatusCode.ERROR, str(exception_context.original_exception))
+        span.end()
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware starting a trace per HTTP request, named after the matched route."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.enabled:
+            await self.app(scope, receive, send)
+            return
+        attributes = {"http.method": scope["method"], "http.target": scope["path"]}
+        with tracer.start_as_current_span(f"{scope['method']} {scope['path']}", attributes) as span:
+
+            async def send_with_status(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Set by the router once it matched, templates like /feed/{category} group traces better
+                route = scope.get("route")
+                if route is not None and hasattr(route, "path"):
+                    span.update_name(f"{scope['method']} {route.path}")
+                    span.set_attribute("http.route", route.path)
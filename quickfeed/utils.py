@@ -1,8 +1,18 @@
 import json
 import logging
+import typing as T
+from contextlib import contextmanager
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    async_sessionmaker, create_async_engine)
+from sqlalchemy.orm import Session, sessionmaker
+
+# Async drivers used when the configured database URL names a sync one
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
 
 
 class AnsiColors:
@@ -38,6 +48,37 @@ def setup_database(sqlalchemy_database_url: str):
     return local_session_maker
 
 
+def setup_session_maker(sqlalchemy_database_url: str) -> T.Callable[[], T.ContextManager[Session]]:
+    """Create a context manager factory yielding sessions that are closed on exit."""
+    SessionLocal = setup_database(sqlalchemy_database_url)
+
+    @contextmanager
+    def session_maker() -> T.Iterator[Session]:
+        session = SessionLocal()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    return session_maker
+
+
+def get_async_database_url(sqlalchemy_database_url: str) -> str:
+    """Swap the driver of a database URL for its async counterpart, e.g. sqlite:// to sqlite+aiosqlite://."""
+    url = make_url(sqlalchemy_database_url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url.render_as_string(hide_password=False)
+
+
+def setup_async_database(sqlalchemy_database_url: str) -> T.Tuple[AsyncEngine, async_sessionmaker[AsyncSession]]:
+    engine = create_async_engine(get_async_database_url(sqlalchemy_database_url))
+    # Objects are handed to templates after the session closes, so keep them loaded
+    local_session_maker = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    return engine, local_session_maker
+
+
 def get_config(path: str) -> dict:
     with open(path, 'r', encoding="utf-8") as file:
         config = json.load(file)
@@ -0,0 +1,129 @@
+"""
+Standalone feed fetching worker.
+
+Runs the feed update job on its own so web processes can be started with `"run_scheduler": false`
+and scaled across cores without multiplying fetch load:
+
+    poetry run python -m quickfeed.worker --config config.json
+
+Several workers (or web processes with scheduling enabled) can run at once; a DB lease makes sure
+only one of them fetches at a time.
+
+For large numbers of feeds, run any number of fetchers instead, on one or more machines sharing the
+database. Due feeds are queued in the fetch_job table (by whichever fetcher holds the enqueue lease)
+and each fetcher claims jobs with a time-limited lease; jobs whose fetcher died are retried:
+
+    poetry run python -m quickfeed.worker --mode fetcher
+"""
+
+import argparse
+import datetime
+import functools
+import logging
+import threading
+
+from quickfeed import http_client, jobs, tracing, utils
+
+logger = logging.getLogger("quickfeed.worker")  # __name__ is __main__ when run with -m
+
+DEFAULT_UPDATE_INTERVAL_MINUTES = 5
+# Runs missed while the previous one was still going (or the process was busy) are merged into a single late
+# run instead of being fired back to back, and a job never runs concurrently with itself in this process
+JOB_DEFAULTS = {"coalesce": True, "max_instances": 1, "misfire_grace_time": None}
+
+
+def schedule_update_feeds(scheduler, session_maker, config: dict, owner: str) -> None:
+    """Add the lease-guarded feed update job to a scheduler."""
+    interval_minutes = config.get("update_interval_minutes", DEFAULT_UPDATE_INTERVAL_MINUTES)
+    # The lease outlives the interval so the active scheduler keeps it between runs
+    lease_duration = datetime.timedelta(minutes=interval_minutes * 2)
+    scheduler.add_job(
+        jobs.leased_entrypoint,
+        'interval',
+        minutes=interval_minutes,
+        args=[session_maker, jobs.update_feeds, owner, lease_duration],
+        **JOB_DEFAULTS
+    )
+
+
+def schedule_enqueue_fetch_jobs(scheduler, session_maker, config: dict, owner: str) -> None:
+    """Add the lease-guarded job queueing due feeds for fetchers to a scheduler."""
+    interval_minutes = config.get("update_interval_minutes", DEFAULT_UPDATE_INTERVAL_MINUTES)
+    lease_duration = datetime.timedelta(minutes=interval_minutes * 2)
+    enqueue = functools.update_wrapper(
+        functools.partial(jobs.enqueue_fetch_jobs, fetch_interval=datetime.timedelta(minutes=interval_minutes)),
+        jobs.enqueue_fetch_jobs
+    )
+    scheduler.add_job(
+        jobs.leased_entrypoint,
+        'interval',
+        minutes=interval_minutes,
+        next_run_time=datetime.datetime.now(),
+        args=[session_maker, enqueue, owner, lease_duration],
+        **JOB_DEFAULTS
+    )
+
+
+# apscheduler is imported by the functions running a scheduler: web processes import this module for its
+# settings and only need the scheduler once they have started serving
+def run_scheduler(session_maker, config: dict, owner: str) -> None:
+    from apscheduler.schedulers.blocking import BlockingScheduler  # pylint: disable=import-outside-toplevel
+    scheduler = BlockingScheduler()
+    schedule_update_feeds(scheduler, session_maker, config, owner)
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        jobs.release_lease(session_maker, jobs.update_feeds.__name__, owner)
+
+
+def run_fetcher(session_maker, config: dict, owner: str, threads: int) -> None:
+    from apscheduler.schedulers.background import BackgroundScheduler  # pylint: disable=import-outside-toplevel
+    scheduler = BackgroundScheduler()
+    schedule_enqueue_fetch_jobs(scheduler, session_maker, config, owner)
+    scheduler.start()
+    # Fetch threads share the HTTP client, so per-host limits apply across all of them
+    stop = threading.Event()
+    fetch_threads = [
+        threading.Thread(target=jobs.run_fetcher, args=(session_maker, owner), kwargs={"stop": stop}, daemon=True)
+        for _ in range(threads)
+    ]
+    for thread in fetch_threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in fetch_threads):
+            stop.wait(1)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        stop.set()
+        scheduler.shutdown(wait=False)
+        jobs.release_lease(session_maker, jobs.enqueue_fetch_jobs.__name__, owner)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--mode", choices=["scheduler", "fetcher"], default="scheduler",
+                        help="scheduler: periodically update all feeds, fetcher: run jobs from the fetch queue")
+    parser.add_argument("--threads", type=int, default=4, help="Number of fetch threads in fetcher mode")
+    args = parser.parse_args()
+
+    config = utils.get_config(args.config)
+    utils.configure_logging(config)
+    session_maker = utils.setup_session_maker(config["database_url"])
+    http_client.configure(**config.get("http_client", {}))
+    tracing.configure(**config.get("tracing", {}))
+    owner = jobs.process_owner_id()
+
+    logger.info("Starting %s worker %s", args.mode, owner)
+    if args.mode == "fetcher":
+        run_fetcher(session_maker, config, owner, args.threads)
+    else:
+        run_scheduler(session_maker, config, owner)
+    logger.info("Stopped %s worker %s", args.mode, owner)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Optional single writer for the database.
+
+SQLite has a single write lock: concurrent writers (the feed updater, read marks from /redirect, bookmarks)
+wait on each other, time out with "database is locked" and block readers while they hold it. When the write
+queue runs, those writers hand a unit of work (a callable taking a Session) to a dedicated thread instead of
+committing on their own. The thread runs the units queued at the same time in one shared transaction and
+hands each caller its result once that transaction is committed, so the lock is taken once per batch by a
+single connection.
+
+A unit must not commit or roll back, and returns plain values rather than ORM objects, which are expired by
+the commit. If a unit fails, the batch is rolled back and its units are run again one at a time, so only
+the failing unit reports the error.
+
+When the queue isn't started (the default, `"single_writer": false`), units run on the caller's session and
+are committed right away, as if they had been written inline.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+import typing as T
+
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH = 64
+# Writes queued while the previous batch commits are grouped anyway; waiting for more trades latency for size
+DEFAULT_MAX_DELAY_SECONDS = 0.0
+
+R = T.TypeVar("R")
+
+
+class QueuedWrite(T.NamedTuple):
+    unit: T.Callable[[Session], T.Any]
+    future: concurrent.futures.Future
+    queued_at: float
+
+
+class WriteQueue:  # pylint: disable=too-many-instance-attributes
+    """Units of work committed in batches by a single writer thread."""
+
+    def __init__(self, max_batch: int = DEFAULT_MAX_BATCH, max_delay: float = DEFAULT_MAX_DELAY_SECONDS) -> None:
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.units = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.split_batches = 0
+        self.failed_units = 0
+        self.wait_seconds = 0.0
+        self.__queue: "queue.Queue[T.Optional[QueuedWrite]]" = queue.Queue()
+        self.__session_maker: T.Optional[T.Callable[[], T.ContextManager[Session]]] = None
+        self.__thread: T.Optional[threading.Thread] = None
+        self.__lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.__thread is not None
+
+    def start(self, session_maker: T.Callable[[], T.ContextManager[Session]]) -> None:
+        if self.__thread is not None:
+            return
+        self.__session_maker = session_maker
+        self.__thread = threading.Thread(target=self.__run, name="quickfeed-writer", daemon=True)
+        self.__thread.start()
+        logger.info("Started the single writer")
+
+    def stop(self, timeout: T.Optional[float] = None) -> None:
+        """Commit what is already queued, then stop the writer thread. Later units run inline again."""
+        with self.__lock:
+            thread = self.__thread
+            if thread is None:
+                return
+            self.__thread = None
+            self.__queue.put(None)
+        thread.join(timeout)
+
+    def submit(self, unit: T.Callable[[Session], R]) -> "concurrent.futures.Future[R]":
+        """Queue a unit of work; its future resolves once the unit is committed. Requires a started queue."""
+        future = self.__queue_unit(unit)
+        if future is None:
+            raise RuntimeError("The write queue isn't running")
+        return future
+
+    def run(self, session: Session, unit: T.Callable[[Session], R]) -> R:
+        """Run a unit of work and commit it: through the writer thread if it runs, else on `session`."""
+        future = self.__queue_unit(unit)
+        if future is None:
+            result = unit(session)
+            session.commit()
+            return result
+        return future.result()
+
+    async def run_async(self, session: Session, unit: T.Callable[[Session], R]) -> R:
+        """Like `run`, awaiting the writer thread instead of blocking the event loop on it."""
+        future = self.__queue_unit(unit)
+        if future is None:
+            result = unit(session)
+            session.commit()
+            return result
+        return await asyncio.wrap_future(future)
+
+    def __queue_unit(self, unit: T.Callable[[Session], R]) -> T.Optional["concurrent.futures.Future[R]"]:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self.__lock:
+            # Under the lock, so nothing is queued behind the stop sentinel
+            if self.__thread is None:
+                return None
+            self.__queue.put(QueuedWrite(unit, future, time.monotonic()))
+        return future
+
+    def __run(self) -> None:
+        while True:
+            write = self.__queue.get()
+            if write is None:
+                return
+            batch = [write]
+            stopping = self.__collect(batch)
+            self.__execute(batch)
+            if stopping:
+                return
+
+    def __collect(self, batch: T.List[QueuedWrite]) -> bool:
+        """Add the writes queued behind the first one to the batch. Returns whether the queue was stopped."""
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                write = self.__queue.get(timeout=timeout) if timeout > 0 else self.__queue.get_nowait()
+            except queue.Empty:
+                return False
+            if write is None:
+                return True
+            batch.append(write)
+        return False
+
+    def __execute(self, batch: T.List[QueuedWrite]) -> None:
+        batch = [write for write in batch if write.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started_at = time.monotonic()
+        with self.__lock:
+            self.batches += 1
+            self.units += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.wait_seconds += sum(started_at - write.queued_at for write in batch)
+        assert self.__session_maker is not None
+        with self.__session_maker() as session:
+            try:
+                results = [write.unit(session) for write in batch]
+                session.commit()
+            except Exception as ex:  # pylint: disable=broad-except
+                session.rollback()
+                if len(batch) == 1:
+                    self.__fail(batch[0], ex)
+                    return
+                logger.debug("Write batch of %d failed (%s), running its units one at a time", len(batch), ex)
+                with self.__lock:
+                    self.split_batches += 1
+            else:
+                for write, result in zip(batch, results):
+                    write.future.set_result(result)
+                return
+        for write in batch:
+            with self.__session_maker() as session:
+                try:
+                    result = write.unit(session)
+                    session.commit()
+                except Exception as ex:  # pylint: disable=broad-except
+                    session.rollback()
+                    self.__fail(write, ex)
+                else:
+                    write.future.set_result(result)
+
+    def __fail(self, write: QueuedWrite, ex: Exception) -> None:
+        with self.__lock:
+            self.failed_units += 1
+        write.future.set_exception(ex)
+
+    def stats(self) -> T.Dict[str, T.Any]:
+        with self.__lock:
+            return {
+                "running": self.running,
+                "queued": self.__queue.qsize(),
+                "units": self.units,
+                "batches": self.batches,
+                "units_per_batch": self.units / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "split_batches": self.split_batches,
+                "failed_units": self.failed_units,
+                "average_wait_seconds": self.wait_seconds / self.units if self.units else 0.0,
+                "max_batch": self.max_batch,
+                "max_delay": self.max_delay,
+            }
+
+
+write_queue = WriteQueue()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmark feed ingest offline, against a local server of generated feeds.
+
+Starts a feed server in a separate process, then runs `jobs.update_feeds` against a fresh SQLite database
+--runs times and reports for each run: feeds and new entries per second, DB statements per feed, peak RSS
+and run time.
+
+    poetry run python scripts/benchmark_ingest.py --feeds 2000 --entries 20 --runs 3
+
+Between runs, --changed-rate of the feeds get --new-entries new entries. The others answer 304 to the
+conditional requests ingest sends, unless --ignore-conditional is given. The server can also add
+--latency-ms (plus up to --jitter-ms) to every response and answer 500 to --error-rate of them.
+
+Documents are generated from --seed, so the same arguments replay the same corpus. --record DIR saves
+every document served, under DIR/<run>/<feed>.xml. --replay DIR serves such a directory instead of
+generated feeds, which can also be real-world feeds saved by hand into DIR/0/. --single-writer commits
+the inserts through the write queue (see quickfeed.writer) instead of the updater's own session. --trace
+PATH exports a trace per feed update, to be read with scripts/trace_summary.py.
+"""
+
+import argparse
+import email.utils
+import hashlib
+import http.server
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as T
+
+LOREM = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore. "
+# Publication dates count back from here, so generated documents don't depend on the current time
+EPOCH = 1700000000
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+class Corpus:
+    """The documents served for each feed, as of the current round. A round starts with every run."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.round = 0
+        self.lock = threading.Lock()
+        self.description = (LOREM * (args.description_bytes // len(LOREM) + 1))[:args.description_bytes]
+        if args.replay:
+            self.names = sorted(os.path.splitext(name)[0] for name in os.listdir(os.path.join(args.replay, "0")))
+        else:
+            self.names = [str(feed) for feed in range(args.feeds)]
+        # Number of times each feed changed, i.e. got new entries
+        self.versions = {name: 0 for name in self.names}
+
+    def advance(self) -> None:
+        with self.lock:
+            self.round += 1
+            rng = random.Random(f"{self.args.seed}:{self.round}")
+            for name in self.names:
+                if rng.random() < self.args.changed_rate:
+                    self.versions[name] += 1
+
+    def document(self, name: str) -> T.Tuple[bytes, str, int]:
+        """A feed's document, its ETag and its modification time."""
+        with self.lock:
+            version = self.versions[name]
+            round_number = self.round
+        if self.args.replay:
+            # Feeds unchanged or failing while recording have no document in later rounds, serve the latest one
+            for recorded_round in range(round_number, -1, -1):
+                path = os.path.join(self.args.replay, str(recorded_round), f"{name}.xml")
+                if os.path.exists(path):
+                    with open(path, "rb") as file:
+                        body = file.read()
+                    return body, f'"{hashlib.sha1(body).hexdigest()}"', EPOCH + recorded_round * 3600
+            raise FileNotFoundError(name)
+        modified = EPOCH + version * 3600
+        body = self.generate(name, version, modified)
+        if self.args.record:
+            directory = os.path.join(self.args.record, str(round_number))
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"{name}.xml"), "wb") as file:
+                file.write(body)
+        return body, f'"{name}-{version}"', modified
+
+    def generate(self, name: str, version: int, modified: int) -> bytes:
+        newest = self.args.entries + version * self.args.new_entries
+        numbers = range(newest - 1, max(-1, newest - 1 - self.args.entries), -1)
+        atom = self.args.format == "atom" or (self.args.format == "mixed" and int(name) % 2 == 1)
+        if atom:
+            entries = "".join(
+                f"<entry><title>Article {name}-{n}</title><link href=\"http://feeds.test/{name}/{n}\"/>"
+                f"<id>urn:feeds.test:{name}:{n}</id><summary><![CDATA[<p>{self.description}</p>]]></summary>"
+                f"<updated>{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(modified - (newest - n) * 60))}</updated>"
+                f"</entry>"
+                for n in numbers
+            )
+            return (
+                f'<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+                f'<title>Feed {name}</title><link href="http://feeds.test/{name}"/><id>urn:feeds.test:{name}</id>'
+                f"{entries}</feed>"
+            ).encode("utf-8")
+        items = "".join(
+            f"<item><title>Article {name}-{n}</title><link>http://feeds.test/{name}/{n}</link>"
+            f"<guid>{name}-{n}</guid><description><![CDATA[<p>{self.description}</p>]]></description>"
+            f"<pubDate>{email.utils.formatdate(modified - (newest - n) * 60)}</pubDate></item>"
+            for n in numbers
+        )
+        return (
+            f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>Feed {name}</title>'
+            f"<link>http://feeds.test/{name}</link><description>Feed {name}</description>{items}</channel></rss>"
+        ).encode("utf-8")
+
+
+def make_feed_handler(corpus: Corpus, stats: T.Dict[str, int]):
+    args = corpus.args
+    stats_lock = threading.Lock()
+
+    def count(key: str, amount: int = 1) -> None:
+        with stats_lock:
+            stats[key] = stats.get(key, 0) + amount
+
+    class FeedHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like real feed hosts
+
+        def send_body(self, status: int, body: bytes, content_type: str, headers: T.Dict[str, str]) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            if self.path == "/_feeds":
+                self.send_body(200, json.dumps(corpus.names).encode("utf-8"), "application/json", {})
+                return
+            if self.path == "/_stats":
+                with stats_lock:
+                    body = json.dumps(stats).encode("utf-8")
+                    stats.clear()
+                self.send_body(200, body, "application/json", {})
+                return
+            name = self.path.rsplit("/", 1)[-1]
+            if name not in corpus.versions:
+                self.send_body(404, b"", "text/plain", {})
+                return
+            if args.latency_ms or args.jitter_ms:
+                time.sleep((args.latency_ms + random.uniform(0, args.jitter_ms)) / 1000)
+            count("requests")
+            # The same feeds fail in every replay of a run
+            if args.error_rate and random.Random(f"{args.seed}:{corpus.round}:{name}").random() < args.error_rate:
+                count("errors")
+                self.send_body(500, b"Internal Server Error", "text/plain", {})
+                return
+            body, etag, modified = corpus.document(name)
+            headers = {"ETag": etag, "Last-Modified": email.utils.formatdate(modified, usegmt=True)}
+            if not args.ignore_conditional and self.headers.get("If-None-Match") == etag:
+                count("not_modified")
+                self.send_body(304, b"", "application/rss+xml", headers)
+                return
+            count("ok")
+            count("bytes", len(body))
+            self.send_body(200, body, "application/atom+xml" if b"<feed" in body[:200] else "application/rss+xml",
+                           headers)
+
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            if self.path == "/_advance":
+                corpus.advance()
+                self.send_body(200, b"", "text/plain", {})
+            else:
+                self.send_body(404, b"", "text/plain", {})
+
+        def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+            pass
+
+    return FeedHandler
+
+
+def serve(args: argparse.Namespace) -> None:
+    random.seed(args.seed)
+    corpus = Corpus(args)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), make_feed_handler(corpus, {}))
+    server.daemon_threads = True
+    print(server.server_port, flush=True)
+    server.serve_forever()
+
+
+def server_arguments(args: argparse.Namespace) -> T.List[str]:
+    arguments = [
+        "--feeds", str(args.feeds), "--entries", str(args.entries), "--new-entries", str(args.new_entries),
+        "--description-bytes", str(args.description_bytes), "--format", args.format,
+        "--changed-rate", str(args.changed_rate), "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+    ]
+    if args.ignore_conditional:
+        arguments.append("--ignore-conditional")
+    if args.record:
+        arguments += ["--record", args.record]
+    if args.replay:
+        arguments += ["--replay", args.replay]
+    return arguments
+
+
+def benchmark(args: argparse.Namespace, base_url: str) -> T.List[T.Dict[str, T.Any]]:
+    # pylint: disable=import-outside-toplevel,too-many-locals
+    import httpx
+    from sqlalchemy import event, func, select
+    from sqlalchemy.engine import Engine
+
+    from quickfeed import api, http_client, jobs, models, tracing, utils, writer
+
+    logging.getLogger("quickfeed").setLevel(logging.ERROR)  # Failed feeds are counted, not logged
+    statements = [0]
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_statement(*_: T.Any) -> None:  # pylint: disable=unused-argument
+        statements[0] += 1
+
+    # Every feed is on the same host here, don't let the per-host politeness limits dominate the numbers
+    http_client.configure(per_host_interval=0, per_host_concurrency=args.per_host_concurrency)
+    if args.trace:
+        tracing.configure(enabled=True, sample_rate=args.trace_sample_rate, path=args.trace)
+    control = httpx.Client(base_url=base_url)
+    names = control.get("/_feeds").json()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'ingest.db')}"
+        session_maker = utils.setup_session_maker(database_url)
+        with session_maker() as session:
+            models.Base.metadata.create_all(session.get_bind())
+            category = api.add_category(session, "Default", "", 0)
+            for name in names:
+                api.add_feed(session, f"{base_url}/feeds/{name}", f"http://feeds.test/{name}", f"Feed {name}", "",
+                             category.id)
+            session.commit()
+        if args.single_writer:
+            writer.write_queue.start(session_maker)
+
+        for run in range(args.runs):
+            if run:
+                control.post("/_advance")
+            control.get("/_stats")  # Reset the server's counters
+            statements[0] = 0
+            start = time.perf_counter()
+            jobs.entrypoint(session_maker, jobs.update_feeds)
+            seconds = time.perf_counter() - start
+            run_statements = statements[0]
+            served = control.get("/_stats").json()
+            with session_maker() as session:
+                job_run = session.scalars(select(models.JobRun).order_by(models.JobRun.id.desc()).limit(1)).one()
+                articles = session.scalar(select(func.count()).select_from(models.Article))
+            results.append({
+                "run": run + 1,
+                "feeds": job_run.feeds_processed,
+                "entries": job_run.articles_inserted,
+                "articles": articles,
+                "seconds": seconds,
+                "feeds_per_second": job_run.feeds_processed / seconds,
+                "entries_per_second": job_run.articles_inserted / seconds,
+                "statements_per_feed": run_statements / max(1, job_run.feeds_processed),
+                "peak_rss_mb": peak_rss_mb(),
+                "feed_errors": job_run.errors,
+                "served": served,
+            })
+        writer.write_queue.stop()
+    control.close()
+    http_client.feed_fetcher.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--feeds", type=int, default=1000)
+    parser.add_argument("--entries", type=int, default=20, help="Entries per document")
+    parser.add_argument("--new-entries", type=int, default=3, help="New entries in a feed that changed")
+    parser.add_argument("--description-bytes", type=int, default=2000)
+    parser.add_argument("--format", choices=["rss", "atom", "mixed"], default="mixed")
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--changed-rate", type=float, default=0.2, help="Share of feeds changed between runs")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument("--ignore-conditional", action="store_true", help="Never answer 304")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record", metavar="DIR", help="Save the documents served, per run")
+    parser.add_argument("--replay", metavar="DIR", help="Serve documents saved with --record")
+    parser.add_argument("--per-host-concurrency", type=int, default=4)
+    parser.add_argument("--single-writer", action="store_true", help="Commit through the write queue")
+    parser.add_argument("--trace", metavar="PATH", help="Export feed update spans to this JSONL file")
+    parser.add_argument("--trace-sample-rate", type=float, default=1.0)
+    parser.add_argument("--database-url", help="Benchmark against this (empty) database instead of a new SQLite one")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON lines")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    with subprocess.Popen([sys.executable, __file__, "--serve", *server_arguments(args)], stdout=subprocess.PIPE,
+                          text=True) as server:
+        try:
+            port = int(server.stdout.readline())
+            results = benchmark(args, f"http://127.0.0.1:{port}")
+        finally:
+            server.terminate()
+
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+            continue
+        served = result["served"]
+        print(f"run {result['run']}: {result['feeds']} feeds, {result['entries']} new entries in "
+              f"{result['seconds']:.2f}s | {result['feeds_per_second']:.1f} feeds/s, "
+              f"{result['entries_per_second']:.1f} entries/s | {result['statements_per_feed']:.1f} statements/feed | "
+              f"peak RSS {result['peak_rss_mb']:.1f}MB | served {served.get('ok', 0)} x 200, "
+              f"{served.get('not_modified', 0)} x 304, {served.get('errors', 0)} x 500, "
+              f"{served.get('bytes', 0) / 1e6:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
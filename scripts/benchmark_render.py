@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Measure server-side render time per page with and without the sidebar fragment cache.
+
+Run from a directory containing config.json, static/ and templates/ (e.g. the repo root):
+
+    poetry run python scripts/benchmark_render.py --requests 200 /feed /feeds
+"""
+
+import argparse
+import logging
+import statistics
+import time
+import typing as T
+
+from fastapi.testclient import TestClient
+
+from quickfeed import cache, server
+
+
+def measure(client: TestClient, path: str, requests: int, auth: T.Tuple[str, str]) -> T.List[float]:
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(path, auth=auth)
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return timings
+
+
+def report(label: str, timings: T.List[float]) -> None:
+    timings = sorted(timings)
+    print(f"  {label:<22} median {statistics.median(timings):7.2f}ms  "
+          f"p95 {timings[int(len(timings) * 0.95) - 1]:7.2f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", default=["/feed", "/feeds", "/categories"])
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    login = server.config["user_login"]
+    auth = (login["username"], login["password"])
+    with TestClient(server.app) as client:
+        logging.getLogger("quickfeed").setLevel(logging.INFO)
+        # Whole page caching would hide the render cost being measured
+        cache.page_cache.max_entries = 0
+        for path in args.paths:
+            print(path)
+            cache.fragment_cache.max_entries = 0
+            cache.fragment_cache.clear()
+            report("without sidebar cache", measure(client, path, args.requests, auth))
+            cache.fragment_cache.max_entries = cache.DEFAULT_FRAGMENT_MAX_ENTRIES
+            report("with sidebar cache", measure(client, path, args.requests, auth))
+
+
+if __name__ == "__main__":
+    main()
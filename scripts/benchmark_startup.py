@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Measure how fast a web process starts, in fresh processes.
+
+Import time: runs `python -X importtime -c "import quickfeed.server"` --runs times and reports the median
+import time, along with the packages that took longest to import (their own time, grouped by top-level
+package), to spot heavy imports that could be deferred.
+
+Time to first response: starts uvicorn --runs times and reports the time from spawning the process to the
+first answer to --path, and how long a second request takes once the background warm up had a moment.
+
+Run it from a directory holding config.json, templates/, static/ and the database, as the server would:
+
+    poetry run python scripts/benchmark_startup.py --runs 5
+"""
+
+import argparse
+import base64
+import collections
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import typing as T
+import urllib.error
+import urllib.request
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_RESPONSE_TIMEOUT = 60.0
+
+
+def environment() -> T.Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPOSITORY, env.get("PYTHONPATH")]))
+    return env
+
+
+def measure_imports(module: str) -> T.Tuple[float, T.Dict[str, float]]:
+    """Import a module in a new interpreter. Returns its import time and the own time per top-level package,
+    in milliseconds."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=environment(),
+                            capture_output=True, text=True, check=True)
+    lines = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        lines.append((int(own), int(cumulative), name))
+    # A module is listed after everything it imported. Interpreter startup (site, encodings) comes first, at
+    # the top level like the module
+    top_level = [index for index, (_, _, name) in enumerate(lines) if not name[1:].startswith(" ")]
+    last = max(index for index in top_level if lines[index][2].strip() == module)
+    first = max((index + 1 for index in top_level if index < last), default=0)
+    packages: T.Dict[str, float] = collections.Counter()
+    for own, _, name in lines[first:last + 1]:
+        packages[name.strip().split(".")[0]] += own / 1000
+    return lines[last][1] / 1000, packages
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(url: str, authorization: str) -> int:
+    request = urllib.request.Request(url, headers={"Authorization": authorization})
+    try:
+        with urllib.request.urlopen(request, timeout=FIRST_RESPONSE_TIMEOUT) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as ex:
+        return ex.code
+
+
+def measure_first_response(path: str, authorization: str, settle: float) -> T.Dict[str, T.Any]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    start = time.perf_counter()
+    with subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "quickfeed.server:app", "--port", str(port), "--log-level", "warning"],
+        env=environment(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    ) as server:
+        try:
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"The server exited with {server.returncode}")
+                if time.perf_counter() - start > FIRST_RESPONSE_TIMEOUT:
+                    raise RuntimeError("No response from the server")
+                try:
+                    status = get(url, authorization)
+                    break
+                except (ConnectionError, urllib.error.URLError):
+                    time.sleep(0.005)
+            first_response = time.perf_counter() - start
+            time.sleep(settle)
+            request_start = time.perf_counter()
+            get(url, authorization)
+            second_request = time.perf_counter() - request_start
+        finally:
+            server.terminate()
+    return {"status": status, "first_response_ms": first_response * 1000, "second_request_ms": second_request * 1000}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="quickfeed.server", help="Module whose import time is measured")
+    parser.add_argument("--top", type=int, default=12, help="Packages to list by import time")
+    parser.add_argument("--path", default="/feed", help="Requested to measure the time to first response")
+    parser.add_argument("--settle", type=float, default=1.0,
+                        help="Seconds to wait before the second request, for the background warm up")
+    parser.add_argument("--skip-server", action="store_true", help="Only measure import time")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    import_times = []
+    packages: T.Dict[str, T.List[float]] = collections.defaultdict(list)
+    for _ in range(args.runs):
+        total, own_times = measure_imports(args.module)
+        import_times.append(total)
+        for package, milliseconds in own_times.items():
+            packages[package].append(milliseconds)
+    results: T.Dict[str, T.Any] = {
+        "import_ms": statistics.median(import_times),
+        "packages_ms": dict(sorted(
+            ((package, statistics.median(times)) for package, times in packages.items()),
+            key=lambda item: item[1], reverse=True
+        )[:args.top]),
+    }
+
+    if not args.skip_server:
+        with open("config.json", encoding="utf-8") as file:
+            login = json.load(file)["user_login"]
+        credentials = base64.b64encode(f"{login['username']}:{login['password']}".encode()).decode()
+        runs = [measure_first_response(args.path, f"Basic {credentials}", args.settle) for _ in range(args.runs)]
+        results.update({
+            "status": runs[0]["status"],
+            "first_response_ms": statistics.median(run["first_response_ms"] for run in runs),
+            "second_request_ms": statistics.median(run["second_request_ms"] for run in runs),
+        })
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"import {args.module}: {results['import_ms']:.0f}ms (median of {args.runs})")
+    for package, milliseconds in results["packages_ms"].items():
+        print(f"  {milliseconds:8.1f}ms  {package}")
+    if not args.skip_server:
+        print(f"first response to {args.path} ({results['status']}): {results['first_response_ms']:.0f}ms after spawn, "
+              f"next request {results['second_request_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
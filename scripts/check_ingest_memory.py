@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Check that feed ingest memory doesn't grow with the number of feeds.
+
+Runs `jobs.update_feeds` against a throwaway SQLite database and a local feed server, once per feed count,
+each in a fresh process, and compares how much the peak RSS grew during the run. Exits with status 1 if
+the largest run grew more than --tolerance-mb beyond the smallest one:
+
+    poetry run python scripts/check_ingest_memory.py --feeds 25 100 400 --entries 20
+
+Caches bounded by design would fill up more in the larger runs and pass for a leak, see `bound_caches`.
+"""
+
+import argparse
+import email.utils
+import http.server
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as T
+
+DESCRIPTION = "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40 + "</p>"
+# SQLite's default page cache is 2MB per connection, which a large enough database fills
+SQLITE_CACHE_KB = 64
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def make_feed_handler(entries: int):
+    class FeedHandler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            feed = self.path.strip("/")
+            items = "".join(
+                f"<item><title>Article {feed}-{i}</title><link>http://feeds.test/{feed}/{i}</link>"
+                f"<guid>{feed}-{i}</guid><description><![CDATA[{DESCRIPTION}]]></description>"
+                f"<pubDate>{email.utils.formatdate(time.time() - i * 3600)}</pubDate></item>"
+                for i in range(entries)
+            )
+            body = (
+                f'<?xml version="1.0"?><rss version="2.0"><channel><title>Feed {feed}</title>'
+                f"<link>http://feeds.test/{feed}</link><description>Feed</description>{items}</channel></rss>"
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+            pass
+
+    return FeedHandler
+
+
+def bound_caches() -> None:
+    """Take the caches bounded by design out of the comparison, so only memory kept per feed is left.
+
+    The article IDs announced to event subscribers are filled up to their limit beforehand, and SQLite's page
+    cache is kept small."""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    from quickfeed import events
+
+    events.published_ids.claim(range(-events.published_ids.size, 0))  # Never real article IDs
+
+    def set_cache_size(dbapi_connection: T.Any, connection_record: T.Any) -> None:  # pylint: disable=unused-argument
+        dbapi_connection.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+
+    event.listen(Engine, "connect", set_cache_size)
+
+
+def create_database(directory: str, feeds: int, port: int) -> T.Callable[[], T.ContextManager[T.Any]]:
+    """Create a database subscribed to `feeds` feeds of the local server, returns its session maker."""
+    # pylint: disable=import-outside-toplevel
+    from quickfeed import api, models, utils
+
+    session_maker = utils.setup_session_maker(f"sqlite:///{os.path.join(directory, 'ingest.db')}")
+    with session_maker() as session:
+        models.Base.metadata.create_all(session.get_bind())
+        category = api.add_category(session, "Default", "", 0)
+        for feed in range(feeds):
+            api.add_feed(session, f"http://127.0.0.1:{port}/{feed}", f"http://feeds.test/{feed}",
+                         f"Feed {feed}", "", category.id)
+        session.commit()
+    return session_maker
+
+
+def run_ingest(feeds: int, entries: int) -> dict:
+    """Ingest `feeds` feeds of `entries` entries into a new database, returns the RSS measurements."""
+    # pylint: disable=import-outside-toplevel
+    from quickfeed import http_client, jobs
+
+    bound_caches()
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), make_feed_handler(entries))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    http_client.configure(per_host_interval=0, per_host_concurrency=4)
+
+    with tempfile.TemporaryDirectory() as directory:
+        session_maker = create_database(directory, feeds, server.server_port)
+        before = peak_rss_mb()
+        start = time.perf_counter()
+        jobs.entrypoint(session_maker, jobs.update_feeds)
+        duration = time.perf_counter() - start
+        after = peak_rss_mb()
+    server.shutdown()
+    return {"feeds": feeds, "before_mb": before, "after_mb": after, "growth_mb": after - before, "seconds": duration}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--feeds", type=int, nargs="+", default=[25, 100, 400])
+    parser.add_argument("--entries", type=int, default=20)
+    parser.add_argument("--tolerance-mb", type=float, default=2.0)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_ingest(args.child, args.entries)))
+        return
+
+    results = []
+    for feeds in sorted(args.feeds):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", str(feeds), "--entries", str(args.entries)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{feeds:6d} feeds: peak RSS {result['before_mb']:7.1f}MB -> {result['after_mb']:7.1f}MB "
+              f"(+{result['growth_mb']:.1f}MB) in {result['seconds']:.1f}s")
+
+    excess = results[-1]["growth_mb"] - results[0]["growth_mb"]
+    if excess > args.tolerance_mb:
+        print(f"FAIL: ingesting {results[-1]['feeds']} feeds grew {excess:.1f}MB more than {results[0]['feeds']}")
+        sys.exit(1)
+    print(f"OK: growth differs by {excess:.1f}MB across feed counts (tolerance {args.tolerance_mb}MB)")
+
+
+if __name__ == "__main__":
+    main()
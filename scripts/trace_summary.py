@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Summarize traces exported by quickfeed.tracing.
+
+Prints the span tree of a trace, the slowest one by default, then its critical path: the chain of spans the
+trace actually waited on, walking back from the end of each span through the child that finished last.
+Time on the critical path is then attributed to the span names it was spent in, so for a slow page it tells
+the database, row building and template rendering apart, and for a feed update the fetch from the inserts.
+
+    poetry run python scripts/trace_summary.py traces.jsonl
+    poetry run python scripts/trace_summary.py traces.jsonl --name "GET /feed/{category}"
+    poetry run python scripts/trace_summary.py traces.jsonl --trace 3f2a... --depth 3
+    poetry run python scripts/trace_summary.py traces.jsonl --list 20
+"""
+
+import argparse
+import collections
+import json
+import statistics
+import sys
+import typing as T
+
+Span = T.Dict[str, T.Any]
+
+# Attributes printed next to span names in the tree
+SHOWN_ATTRIBUTES = (
+    "db.statement", "template", "rows", "feed.url", "entries.new", "articles.inserted", "http.headers_ms",
+    "http.receive_ms", "http.response_bytes", "http.status_code", "exception.type",
+)
+
+
+def load_traces(path: str) -> T.Dict[str, T.List[Span]]:
+    traces: T.Dict[str, T.List[Span]] = collections.defaultdict(list)
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                span = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping malformed line {line_number}", file=sys.stderr)
+                continue
+            traces[span["trace_id"]].append(span)
+    return traces
+
+
+def find_root(spans: T.List[Span]) -> T.Optional[Span]:
+    for span in spans:
+        if span["parent_span_id"] is None:
+            return span
+    return None
+
+
+def children_by_parent(spans: T.List[Span]) -> T.Dict[T.Optional[str], T.List[Span]]:
+    children: T.Dict[T.Optional[str], T.List[Span]] = collections.defaultdict(list)
+    for span in spans:
+        children[span["parent_span_id"]].append(span)
+    for siblings in children.values():
+        siblings.sort(key=lambda span: span["start_time_unix_nano"])
+    return children
+
+
+def critical_path(
+    span: Span, children: T.Dict[T.Optional[str], T.List[Span]], segments: T.List[T.Tuple[str, int]]
+) -> None:
+    """Append (span name, nanoseconds) for the time of `span` on the critical path, its own and its children's."""
+    cursor = span["end_time_unix_nano"]
+    start = span["start_time_unix_nano"]
+    # Latest finishing first, so overlapping (concurrent) children only count for the one waited on
+    pending = sorted(children.get(span["span_id"], []), key=lambda child: child["end_time_unix_nano"], reverse=True)
+    for child in pending:
+        child_end = min(child["end_time_unix_nano"], cursor)
+        if child_end <= start or child["start_time_unix_nano"] >= cursor:
+            continue
+        segments.append((span["name"], cursor - child_end))  # The span's own time after this child
+        critical_path(child, children, segments)
+        cursor = max(start, child["start_time_unix_nano"])
+    segments.append((span["name"], cursor - start))
+
+
+def print_tree(
+    span: Span, children: T.Dict[T.Optional[str], T.List[Span]], trace_start: int, depth: int, max_depth: int,
+    indent: str = ""
+) -> None:
+    own_children = children.get(span["span_id"], [])
+    child_ms = sum(child["duration_ms"] for child in own_children)
+    offset_ms = (span["start_time_unix_nano"] - trace_start) / 1e6
+    status = " !" if span.get("status") == "ERROR" else ""
+    attributes = span.get("attributes") or {}
+    detail = ", ".join(
+        f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+        for key, value in attributes.items() if key in SHOWN_ATTRIBUTES
+    )
+    print(f"{offset_ms:9.2f} {span['duration_ms']:9.2f} {max(0.0, span['duration_ms'] - child_ms):9.2f}  "
+          f"{indent}{span['name']}{status}{'  ' + detail[:100] if detail else ''}")
+    if depth >= max_depth:
+        if own_children:
+            print(f"{'':29}  {indent}  ... {len(own_children)} child spans")
+        return
+    # Runs of same-named siblings (e.g. a lookup per entry) are folded into one line
+    index = 0
+    while index < len(own_children):
+        child = own_children[index]
+        run_end = index + 1
+        while run_end < len(own_children) and own_children[run_end]["name"] == child["name"]:
+            run_end += 1
+        if run_end - index > 2:
+            print_run(own_children[index:run_end], children, trace_start, indent + "  ")
+            index = run_end
+            continue
+        print_tree(child, children, trace_start, depth + 1, max_depth, indent + "  ")
+        index += 1
+
+
+def print_run(
+    run: T.List[Span], children: T.Dict[T.Optional[str], T.List[Span]], trace_start: int, indent: str
+) -> None:
+    """Print a run of same-named sibling spans as a single line, with their summed times."""
+    total_ms = sum(span["duration_ms"] for span in run)
+    self_ms = total_ms - sum(
+        grandchild["duration_ms"] for span in run for grandchild in children.get(span["span_id"], []))
+    print(f"{(run[0]['start_time_unix_nano'] - trace_start) / 1e6:9.2f} {total_ms:9.2f} {self_ms:9.2f}  "
+          f"{indent}{run[0]['name']} x{len(run)}")
+
+
+def summarize(spans: T.List[Span], max_depth: int) -> None:
+    root = find_root(spans)
+    if root is None:
+        print("Trace has no root span (still in progress, or truncated)")
+        return
+    children = children_by_parent(spans)
+    print(f"Trace {root['trace_id']}: {root['name']}, {root['duration_ms']:.2f}ms, {len(spans)} spans")
+    dropped = (root.get("attributes") or {}).get("tracing.dropped_spans")
+    if dropped:
+        print(f"({dropped} spans over the per-trace limit were dropped)")
+    print()
+    print(f"{'start ms':>9} {'total ms':>9} {'self ms':>9}  span")
+    print_tree(root, children, root["start_time_unix_nano"], 0, max_depth)
+
+    segments: T.List[T.Tuple[str, int]] = []
+    critical_path(root, children, segments)
+    by_name: T.Dict[str, int] = collections.Counter()
+    for name, nanoseconds in segments:
+        by_name[name] += nanoseconds
+    total = sum(by_name.values()) or 1
+    print()
+    print("Critical path by span:")
+    for name, nanoseconds in sorted(by_name.items(), key=lambda item: item[1], reverse=True):
+        if nanoseconds <= 0:
+            continue
+        print(f"  {nanoseconds / 1e6:9.2f}ms {nanoseconds / total:6.1%}  {name}")
+
+
+def list_traces(traces: T.Dict[str, T.List[Span]], roots: T.List[Span], limit: int) -> None:
+    by_name: T.Dict[str, T.List[float]] = collections.defaultdict(list)
+    for root in roots:
+        by_name[root["name"]].append(root["duration_ms"])
+    print(f"{'count':>6} {'median ms':>10} {'max ms':>10}  root")
+    for name, durations in sorted(by_name.items(), key=lambda item: max(item[1]), reverse=True):
+        print(f"{len(durations):6} {statistics.median(durations):10.2f} {max(durations):10.2f}  {name}")
+    print()
+    print(f"Slowest {limit}:")
+    for root in sorted(roots, key=lambda root: root["duration_ms"], reverse=True)[:limit]:
+        print(f"  {root['trace_id']} {root['duration_ms']:10.2f}ms {len(traces[root['trace_id']]):6} spans  "
+              f"{root['name']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default="traces.jsonl")
+    parser.add_argument("--trace", help="Trace ID, or a prefix of it")
+    parser.add_argument("--name", help="Only consider traces whose root span has this name")
+    parser.add_argument("--depth", type=int, default=6, help="Levels of the span tree to print")
+    parser.add_argument("--list", type=int, metavar="N", help="List root span names and the N slowest traces")
+    args = parser.parse_args()
+
+    traces = load_traces(args.path)
+    roots = [root for root in map(find_root, traces.values()) if root is not None]
+    if args.name:
+        roots = [root for root in roots if root["name"] == args.name]
+    if not roots:
+        sys.exit("No complete traces found")
+
+    if args.list:
+        list_traces(traces, roots, args.list)
+        return
+    if args.trace:
+        matching = [trace_id for trace_id in traces if trace_id.startswith(args.trace)]
+        if len(matching) != 1:
+            sys.exit(f"{len(matching)} traces match {args.trace}")
+        trace_id = matching[0]
+    else:
+        trace_id = max(roots, key=lambda root: root["duration_ms"])["trace_id"]
+    summarize(traces[trace_id], args.depth)
+
+
+if __name__ == "__main__":
+    main()